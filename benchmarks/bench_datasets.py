@@ -0,0 +1,399 @@
+"""Measure the throughput of brocc on the bundled datasets.
+
+Usage, from the top-level directory of the repository:
+
+    python -m benchmarks.bench_datasets [DATASET ...]
+
+Each pair of files named NAME_blast and NAME_fasta in the datasets
+directory is a dataset.  Give dataset names to run only those.  Three
+stages are measured for every dataset:
+
+* parse: reading the FASTA file and the BLAST output,
+* lineages: looking up taxon IDs and lineages for the hits of each
+  query, starting with empty caches, and
+* assign: classifying each query with Assigner.assign, again starting
+  with empty caches.
+
+No network access is needed.  The lookups are done in a small
+taxonomy database, made up for the run, in which every accession in
+the datasets is given a taxon.  The hits for a query mostly point to
+one species and its near relatives, so the votes look like real ones.
+
+Each stage is timed several times and the best time is kept.  Peak
+memory is measured in a separate run under tracemalloc, which slows
+things down.  With --save_baseline, the results for each dataset, the
+totals, and a description of the machine are written to a JSON file.
+With --baseline, the results are compared with those in the file,
+using only the datasets found in both.  The speed of each stage is
+compared over all of these datasets together, since most datasets
+take only milliseconds and their times are mostly noise.  Peak memory
+does not vary between runs, so it is compared for each dataset.  The
+script exits with an error if any stage is slower, or uses more
+memory, than the baseline allows.
+
+Timings depend on the machine, so a baseline should be made on the
+machine where it is checked.  The baseline in this directory,
+baseline.json, was made with
+
+    python -m benchmarks.bench_datasets --save_baseline benchmarks/baseline.json
+
+Its memory figures hold on any machine, but its speeds only on the
+machine described in the file.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+from brocclib.assign import Assigner
+from brocclib.command import AMPLICON_MIN_IDS, CONSENSUS_THRESHOLDS
+from brocclib.parse import iter_fasta, read_blast, unversion
+from brocclib.taxonomy_db import NcbiLocal, init_db, init_lineages
+
+DATASETS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "datasets")
+STAGES = ["parse", "lineages", "assign"]
+
+# Number of taxa under each taxon at every rank of the fixture taxonomy
+FIXTURE_RANKS = [
+    ("domain", 2), ("kingdom", 3), ("phylum", 3), ("class", 3),
+    ("order", 3), ("family", 3), ("genus", 3), ("species", 4),
+    ]
+# Chance that an accession is assigned to the query's species, to
+# another species in the same genus, or in the same family.  The rest
+# go to a species anywhere in the tree, or are left out of the
+# database.
+FIXTURE_SAME_SPECIES = 0.6
+FIXTURE_SAME_GENUS = 0.8
+FIXTURE_SAME_FAMILY = 0.9
+FIXTURE_ANY_SPECIES = 0.97
+
+
+def find_datasets(datasets_dir, names=None):
+    """Return (name, fasta_fp, blast_fp, queries) for each dataset.
+
+    Datasets that cannot be read, or have no queries, are skipped.
+    """
+    datasets = []
+    for blast_fp in sorted(glob.glob(os.path.join(datasets_dir, "*_blast*"))):
+        m = re.match(r"(.*)_blast(\d*)$", os.path.basename(blast_fp))
+        if m is None:
+            continue
+        fasta_fp = os.path.join(
+            datasets_dir, "{0}_fasta{1}".format(*m.groups()))
+        name = m.group(1) + m.group(2)
+        if names and (name not in names):
+            continue
+        if not os.path.exists(fasta_fp):
+            continue
+        try:
+            queries = load_dataset(fasta_fp, blast_fp)
+        except (ValueError, IndexError) as e:
+            print("Skipping {0}: {1!r}".format(name, e))
+            continue
+        if queries:
+            datasets.append((name, fasta_fp, blast_fp, queries))
+    return datasets
+
+
+def load_dataset(fasta_fp, blast_fp):
+    with open(fasta_fp) as f:
+        sequences = list(iter_fasta(f))
+    with open(blast_fp, "rb") as f:
+        blast_hits = read_blast(f)
+    return [(name, seq, blast_hits[name]) for name, seq in sequences]
+
+
+def fixture_taxonomy():
+    """Make the nodes of the fixture taxonomy.
+
+    Returns the nodes and a list of species, in which species of the
+    same genus are next to each other.  Every genus also has one
+    generic "uncultured" species, under "environmental samples".
+    """
+    nodes = [(1, 1, "root", "no rank")]
+    species = []
+
+    def add(parent, name, rank):
+        taxid = len(nodes) + 1
+        nodes.append((taxid, parent, name, rank))
+        return taxid
+
+    def grow(parent, parent_name, depth):
+        rank, n = FIXTURE_RANKS[depth]
+        for i in range(n):
+            if rank == "species":
+                species.append(add(
+                    parent, "{0} sp{1}".format(parent_name, i), rank))
+                continue
+            name = "{0}{1}{2}".format(rank.capitalize(), parent_name[-3:], i)
+            taxid = add(parent, name, rank)
+            grow(taxid, name, depth + 1)
+        if rank == "species":
+            samples = add(parent, "environmental samples", "no rank")
+            species.append(add(samples, "uncultured " + parent_name, rank))
+
+    grow(1, "", 0)
+    return nodes, species
+
+
+def fixture_accessions(datasets, species):
+    """Assign a species to each accession in the datasets."""
+    genus_size = FIXTURE_RANKS[-1][1] + 1
+    family_size = genus_size * FIXTURE_RANKS[-2][1]
+    accessions = {}
+    for _, _, _, queries in datasets:
+        for query_id, _, hits in queries:
+            # The same query always gets the same species
+            query_idx = zlib.crc32(query_id.encode("utf-8")) % len(species)
+            for hit in hits:
+                acc = unversion(hit.accession)
+                if acc in accessions:
+                    continue
+                rng = random.Random(zlib.crc32(
+                    (query_id + "\t" + acc).encode("utf-8")))
+                idx = query_idx
+                x = rng.random()
+                if x < FIXTURE_SAME_SPECIES:
+                    pass
+                elif x < FIXTURE_SAME_GENUS:
+                    idx = idx - idx % genus_size + rng.randrange(genus_size)
+                elif x < FIXTURE_SAME_FAMILY:
+                    idx = idx - idx % family_size + rng.randrange(family_size)
+                elif x < FIXTURE_ANY_SPECIES:
+                    idx = rng.randrange(len(species))
+                else:
+                    idx = None
+                accessions[acc] = idx
+    return sorted(
+        (acc, species[idx]) for acc, idx in accessions.items()
+        if idx is not None)
+
+
+def build_fixture_db(db_fp, datasets, lineages=False):
+    nodes, species = fixture_taxonomy()
+    init_db(db_fp, fixture_accessions(datasets, species), nodes)
+    if lineages:
+        init_lineages(db_fp)
+
+
+def run_parse(fasta_fp, blast_fp, queries, db_fp):
+    load_dataset(fasta_fp, blast_fp)
+
+
+def run_lineages(fasta_fp, blast_fp, queries, db_fp):
+    db = NcbiLocal(db_fp)
+    for _, _, hits in queries:
+        taxon_ids = db.get_taxon_ids(set(hit.accession for hit in hits))
+        db.get_lineages(set(t for t in taxon_ids.values() if t is not None))
+    db.con.close()
+
+
+def run_assign(fasta_fp, blast_fp, queries, db_fp):
+    db = NcbiLocal(db_fp)
+    min_species_id, min_genus_id = AMPLICON_MIN_IDS["ITS"]
+    assigner = Assigner(
+        0.7, min_species_id, min_genus_id, 80.0,
+        [t for _, t in CONSENSUS_THRESHOLDS], 4, db)
+    for name, seq, hits in queries:
+        assigner.assign(name, seq, list(hits))
+    db.con.close()
+
+
+STAGE_FUNCTIONS = {
+    "parse": run_parse,
+    "lineages": run_lineages,
+    "assign": run_assign,
+    }
+
+
+def measure(stage, args, repeat):
+    fn = STAGE_FUNCTIONS[stage]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(datasets, db_fp, repeat):
+    results = {"datasets": {}, "stages": {}}
+    totals = dict((stage, [0, 0.0, 0]) for stage in STAGES)
+    for name, fasta_fp, blast_fp, queries in datasets:
+        num_queries = len(queries)
+        dataset_results = {"queries": num_queries}
+        args = (fasta_fp, blast_fp, queries, db_fp)
+        for stage in STAGES:
+            elapsed, peak = measure(stage, args, repeat)
+            dataset_results[stage] = _stage_results(
+                num_queries, elapsed, peak)
+            stage_totals = totals[stage]
+            stage_totals[0] += num_queries
+            stage_totals[1] += elapsed
+            stage_totals[2] = max(stage_totals[2], peak)
+        results["datasets"][name] = dataset_results
+        _print_dataset(name, dataset_results)
+    for stage in STAGES:
+        results["stages"][stage] = _stage_results(*totals[stage])
+    _print_dataset("TOTAL", results["stages"])
+    return results
+
+
+def _stage_results(num_queries, elapsed, peak):
+    return {
+        "seconds": elapsed,
+        "queries_per_sec": num_queries / elapsed if elapsed else 0.0,
+        "peak_memory_mb": peak / 1e6,
+        }
+
+
+def _print_dataset(name, dataset_results):
+    fields = [
+        "{0:>10.0f} q/s {1:7.2f} MB".format(
+            dataset_results[stage]["queries_per_sec"],
+            dataset_results[stage]["peak_memory_mb"])
+        for stage in STAGES]
+    print("{0:24s} {1}".format(name, "  ".join(fields)))
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Return a message for each stage that is worse than the baseline.
+
+    Only the datasets found in both the results and the baseline are
+    compared.  Speeds are compared over these datasets together, and
+    peak memory for each dataset.
+    """
+    regressions = []
+    shared = sorted(set(results["datasets"]) & set(baseline["datasets"]))
+    for stage in STAGES:
+        current = _pooled_speed(results, shared, stage)
+        base = _pooled_speed(baseline, shared, stage)
+        if (current is None) or (base is None):
+            continue
+        if current < base * (1 - tolerance):
+            regressions.append(
+                "{0}: {1:.0f} queries/sec, baseline {2:.0f}".format(
+                    stage, current, base))
+    for name in shared:
+        for stage in STAGES:
+            current = results["datasets"][name].get(stage)
+            base = baseline["datasets"][name].get(stage)
+            if (current is None) or (base is None):
+                continue
+            max_memory = base["peak_memory_mb"] * (1 + tolerance)
+            if current["peak_memory_mb"] > max_memory:
+                regressions.append(
+                    "{0} {1}: {2:.2f} MB peak memory, baseline {3:.2f} MB"
+                    .format(
+                        name, stage, current["peak_memory_mb"],
+                        base["peak_memory_mb"]))
+    return regressions
+
+
+def _pooled_speed(results, names, stage):
+    # Queries per second over several datasets together
+    num_queries = 0
+    seconds = 0.0
+    for name in names:
+        stage_results = results["datasets"][name].get(stage)
+        if stage_results is None:
+            continue
+        num_queries += results["datasets"][name]["queries"]
+        seconds += stage_results["seconds"]
+    if seconds <= 0:
+        return None
+    return num_queries / seconds
+
+
+def machine_info():
+    """Describe the machine, to be saved with a baseline."""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Measure the throughput of brocc on bundled datasets")
+    p.add_argument(
+        "datasets", nargs="*",
+        help="names of datasets to run (default: all)")
+    p.add_argument(
+        "--datasets_dir", default=DATASETS_DIR,
+        help="directory of datasets (default: %(default)s)")
+    p.add_argument(
+        "--repeat", type=int, default=3,
+        help="number of times to time each stage (default: %(default)s)")
+    p.add_argument(
+        "--lineages", action="store_true",
+        help="precompute lineages in the taxonomy database")
+    p.add_argument("--baseline", help="JSON file of results to compare with")
+    p.add_argument(
+        "--tolerance", type=float, default=0.25,
+        help=(
+            "fraction by which a stage can be slower or use more memory "
+            "than the baseline (default: %(default)s)"))
+    p.add_argument("--save_baseline", help="write the results to a JSON file")
+    args = p.parse_args(argv)
+
+    datasets = find_datasets(args.datasets_dir, args.datasets)
+    if not datasets:
+        p.error("No datasets found")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_fp = os.path.join(temp_dir, "taxonomy.db")
+        build_fixture_db(db_fp, datasets, args.lineages)
+        results = run_benchmarks(datasets, db_fp, args.repeat)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    results["machine"] = machine_info()
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        missing = sorted(set(results["datasets"]) - set(baseline["datasets"]))
+        if missing:
+            print("Not in the baseline, not compared: " + ", ".join(missing))
+        if not set(results["datasets"]) & set(baseline["datasets"]):
+            p.error("No datasets in common with the baseline")
+        if baseline.get("machine") != results["machine"]:
+            print(
+                "The baseline was made on a different machine, so the "
+                "speeds may not be comparable: " +
+                json.dumps(baseline.get("machine"), sort_keys=True))
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for message in regressions:
+            print("REGRESSION " + message)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measure the throughput of the BLAST output parser.
+
+Usage, from the top-level directory of the repository:
+
+    python -m benchmarks.bench_parse [BLAST_FILE ...]
+
+With no arguments, a synthetic BLAST file is written to a temporary
+directory and parsed.  Each file is parsed as a binary file object,
+which is the fast path used by brocc, and as an iterable of lines.
+Each file is also converted to a hit store, and we time how long it
+takes to load the store and get the hits for every query.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from brocclib.hitstore import HitStore, write_hit_store
+from brocclib.parse import iter_blast
+
+NUM_SYNTHETIC_QUERIES = 2000
+HITS_PER_QUERY = 100
+
+
+def write_synthetic_blast(fp, num_queries, hits_per_query, seed=0):
+    rng = random.Random(seed)
+    with open(fp, "w") as f:
+        for i in range(num_queries):
+            query_id = "{0} Q.{1}_{2}".format(i, rng.randint(1000, 9999), i)
+            f.write("# BLASTN 2.2.25+\n")
+            f.write("# Query: {0}\n".format(query_id))
+            f.write("# Database: nt\n")
+            f.write("# {0} hits found\n".format(hits_per_query))
+            for _ in range(hits_per_query):
+                f.write(
+                    "{0}\tgi|{1}|gb|GQ{2}.1|\t{3:.2f}\t{4}\t1\t1\t407\t564"
+                    "\t1\t159\t2e-70\t 275\n".format(
+                        i, rng.randint(1, 10 ** 9), rng.randint(10 ** 5, 10 ** 6),
+                        rng.uniform(80, 100), rng.randint(100, 500)))
+
+
+def time_parse(fp, as_lines):
+    start = time.perf_counter()
+    num_hits = 0
+    if as_lines:
+        with open(fp) as f:
+            for _ in iter_blast(iter(f)):
+                num_hits += 1
+    else:
+        with open(fp, "rb") as f:
+            for _ in iter_blast(f):
+                num_hits += 1
+    return num_hits, time.perf_counter() - start
+
+
+def time_hit_store(hits_fp):
+    start = time.perf_counter()
+    num_hits = 0
+    store = HitStore(hits_fp)
+    for query_id in store:
+        num_hits += len(store[query_id])
+    return num_hits, time.perf_counter() - start
+
+
+def report(fp, temp_dir):
+    size_mb = os.path.getsize(fp) / 1e6
+    print("{0} ({1:.1f} MB)".format(fp, size_mb))
+    for label, as_lines in [("binary file", False), ("lines", True)]:
+        num_hits, elapsed = time_parse(fp, as_lines)
+        _print_result(label, num_hits, elapsed, size_mb)
+
+    hits_fp = os.path.join(temp_dir, "bench.hits")
+    with open(fp, "rb") as f:
+        write_hit_store(hits_fp, iter_blast(f))
+    num_hits, elapsed = time_hit_store(hits_fp)
+    _print_result("hit store", num_hits, elapsed, size_mb)
+
+
+def _print_result(label, num_hits, elapsed, size_mb):
+    print("  {0:12s} {1:8d} hits {2:7.2f} s {3:10.0f} hits/s "
+          "{4:7.1f} MB/s".format(
+              label, num_hits, elapsed, num_hits / elapsed,
+              size_mb / elapsed))
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        if not argv:
+            fp = os.path.join(temp_dir, "synthetic_blast.txt")
+            write_synthetic_blast(fp, NUM_SYNTHETIC_QUERIES, HITS_PER_QUERY)
+            argv = [fp]
+        for fp in argv:
+            report(fp, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Sorted, memory-mapped index of accession to taxon ID.
+
+The index file is a short header followed by fixed-width records,
+sorted by accession.  Each record holds an unversioned accession,
+padded with null bytes to the key width, and a taxon ID.  Lookups are
+a binary search over the memory-mapped file, so the index opens
+almost instantly and its pages are shared by all processes that read
+it.  Taxon IDs are written in the native byte order, so the file
+should be built on the same kind of machine that reads it.
+"""
+
+import mmap
+import os
+import struct
+import sys
+
+from brocclib.parse import unversion
+
+INDEX_MAGIC = b"BROCCACC"
+INDEX_VERSION = 1
+# magic, version, byte order, key width, number of records
+_HEADER = struct.Struct("=8sIBxxxIQ")
+_TAXID = struct.Struct("=I")
+_BYTE_ORDERS = {"little": 0, "big": 1}
+
+INDEX_EXT = ".acc"
+
+
+def accession_index_fp(database_fp):
+    """Location of the index file that goes with a taxonomy database."""
+    return os.path.splitext(database_fp)[0] + INDEX_EXT
+
+
+def write_accession_index(fp, accessions, key_width):
+    """Write an index file from (accession, taxid) records.
+
+    The records must be sorted by accession, and no accession may be
+    longer than key_width bytes.
+    """
+    # A brocc run may have the old file mapped, so the new file is
+    # written alongside it and moved into place.
+    temp_fp = "{0}.{1}.tmp".format(fp, os.getpid())
+    try:
+        with open(temp_fp, "wb") as f:
+            _write_records(f, accessions, key_width)
+        os.replace(temp_fp, fp)
+    finally:
+        if os.path.exists(temp_fp):
+            os.remove(temp_fp)
+
+
+def _write_records(f, accessions, key_width):
+    num_records = 0
+    last_key = None
+    # The number of records is filled in at the end.
+    f.write(_HEADER.pack(
+        INDEX_MAGIC, INDEX_VERSION, _BYTE_ORDERS[sys.byteorder],
+        key_width, 0))
+    for acc, taxid in accessions:
+        key = acc.encode("ascii")
+        if len(key) > key_width:
+            raise ValueError(
+                "Accession {0} is longer than {1} bytes".format(
+                    acc, key_width))
+        if (last_key is not None) and (key <= last_key):
+            raise ValueError(
+                "Accessions are not sorted or not unique at {0}".format(
+                    acc))
+        f.write(key.ljust(key_width, b"\0"))
+        f.write(_TAXID.pack(int(taxid)))
+        last_key = key
+        num_records += 1
+    f.seek(0)
+    f.write(_HEADER.pack(
+        INDEX_MAGIC, INDEX_VERSION, _BYTE_ORDERS[sys.byteorder],
+        key_width, num_records))
+
+
+class AccessionIndex(object):
+    def __init__(self, fp):
+        self.fp = fp
+        with open(fp, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byte_order, key_width, num_records = \
+            _HEADER.unpack_from(self._mmap)
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not an accession index file: {0}".format(fp))
+        if version != INDEX_VERSION:
+            raise ValueError(
+                "Unsupported accession index version: {0}".format(version))
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(
+                "Accession index was built on a machine with a different "
+                "byte order: {0}".format(fp))
+        self.key_width = key_width
+        self.record_size = key_width + _TAXID.size
+        self.num_records = num_records
+
+    def __len__(self):
+        return self.num_records
+
+    def _key_at(self, idx):
+        start = _HEADER.size + idx * self.record_size
+        return self._mmap[start:start + self.key_width]
+
+    def get(self, acc):
+        """Return the taxon ID for an unversioned accession, or None."""
+        try:
+            key = acc.encode("ascii")
+        except UnicodeEncodeError:
+            return None
+        if len(key) > self.key_width:
+            return None
+        key = key.ljust(self.key_width, b"\0")
+
+        lo = 0
+        hi = self.num_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if (lo < self.num_records) and (self._key_at(lo) == key):
+            start = _HEADER.size + lo * self.record_size + self.key_width
+            return _TAXID.unpack_from(self._mmap, start)[0]
+        return None
+
+
+class NcbiAccessionIndex(object):
+    """Taxonomy backend that reads taxon IDs from an accession index.
+
+    Lineages are looked up in a second backend, such as NcbiLocal or
+    NcbiTree.
+    """
+    def __init__(self, index_fp, lineage_db=None):
+        self.index = AccessionIndex(index_fp)
+        self.lineage_db = lineage_db
+
+    def get_taxon_id(self, acc):
+        return self.index.get(unversion(acc))
+
+    def get_taxon_ids(self, accs):
+        return dict((acc, self.get_taxon_id(acc)) for acc in set(accs))
+
+    def get_lineage(self, taxon_id):
+        return self.lineage_db.get_lineage(taxon_id)
+
+    def get_lineages(self, taxon_ids):
+        return self.lineage_db.get_lineages(taxon_ids)
+
+    def stats(self):
+        if self.lineage_db is None:
+            return {}
+        return self.lineage_db.stats()
@@ -1,8 +1,18 @@
 from __future__ import division
+import bisect
 import collections
+import copy
 import logging
 
+from brocclib.cache import LruCache
 from brocclib.taxonomy import Lineage, NoLineage
+from brocclib.votetrace import format_vote_text, vote_record
+
+# Number of Lineage objects kept in memory.  A lineage takes a few
+# kilobytes.
+LINEAGE_CACHE_SIZE = 10000
+# Number of assignments kept for reuse with --dedup_queries
+ASSIGNMENT_CACHE_SIZE = 10000
 
 '''
 Created on Aug 29, 2011
@@ -29,6 +39,14 @@ class AssignmentCandidate(object):
         return "{1} ({2} votes)".format(self.rank, self.lineage.get_taxon(self.rank), self.votes)
 
 
+def _renamed(assignment, query_id):
+    # Assignments are not changed once they are made, so a copy can
+    # share the candidates and generic taxa.
+    a = copy.copy(assignment)
+    a.query_id = query_id
+    return a
+
+
 class Assignment(object):
     is_valid_assignment = True
 
@@ -59,20 +77,8 @@ class Assignment(object):
             self.num_generic, self.winning_candidate.rank, lineage)
 
     def log_details(self):
-        candidates2 = [c.to_string() for c in self.candidates if c.votes > 1]
-        generics2 = ["{0} ({1} votes)".format(k, v) for v, k in self.generics]
-        parts = [
-            "",
-            "** {0} voting for {1} **".format(self.query_id, self.rank),
-            "Candidates (>1 vote): {0}".format(", ".join(candidates2)),
-            "Generic taxa: {0}".format(", ".join(generics2)),
-            "Candidate total: {0} votes".format(self.total_votes),
-            "WINNER: {0}".format(self.winning_candidate.to_string()),
-            "",
-        ]
-        message = "\n".join(parts)
         logger = logging.getLogger("brocc.votes")
-        logger.debug(message)
+        logger.debug(format_vote_text(vote_record(self)))
 
 
 class NoAssignment(object):
@@ -100,29 +106,19 @@ class NoAssignment(object):
     format_for_log = format_for_standard_taxonomy
 
     def log_details(self):
-        candidates2 = [c.to_string() for c in self.candidates if c.votes > 1]
-        generics2 = ["{0} ({1} votes)".format(k, v) for v, k in self.generics]
-        parts = [
-            "",
-            "** {0} voting for {1} **".format(self.query_id, self.rank),
-            "Candidates (>1 vote): {0}".format(", ".join(candidates2)),
-            "Generic taxa: {0}".format(", ".join(generics2)),
-            "Candidate total: {0} votes".format(self.total_votes),
-            self.message,
-            "",
-        ]
-        message = "\n".join(parts)
         logger = logging.getLogger("brocc.votes")
-        logger.info(message)
+        logger.info(format_vote_text(vote_record(self)))
 
 class Assigner(object):
     ranks = [
         "species", "genus", "family", "order",
-        "class", "phylum", "kingdom", "superkingdom",
+        "class", "phylum", "kingdom", "domain",
         ]
 
     def __init__(self, min_cover, species_min_id, genus_min_id, min_id,
-                 consensus_thresholds, min_winning_votes, taxa_db):
+                 consensus_thresholds, min_winning_votes, taxa_db,
+                 lineage_cache_size=LINEAGE_CACHE_SIZE, lineage_cache=None,
+                 assignment_cache_size=0, vote_trace=None):
         self.min_cover = min_cover
         self.rank_min_ids = [
             species_min_id, genus_min_id, min_id, min_id,
@@ -132,6 +128,24 @@ class Assigner(object):
         self.consensus_thresholds = consensus_thresholds
         self.min_winning_votes = min_winning_votes
         self.taxa_db = taxa_db
+        # Lineage objects are never changed after they are made, so
+        # every hit to the same taxon ID can share one object.  The
+        # cache can also be shared between assigners.
+        if lineage_cache is None:
+            lineage_cache = LruCache(lineage_cache_size)
+        self.lineage_cache = lineage_cache
+        self._no_lineage = NoLineage()
+        # Queries with the same hits after quality filtering get the
+        # same assignment.  If the cache is on, we vote once and reuse
+        # the result for the other queries.
+        self.assignment_cache = LruCache(assignment_cache_size)
+        # If given, a VoteTrace keeps a record of the votes at each
+        # rank for the voting log.
+        self.vote_trace = vote_trace
+        # Counts of hits removed by the quality filter
+        self.num_hits_checked = 0
+        self.num_hits_low_identity = 0
+        self.num_hits_low_coverage = 0
 
     def _quality_filter(self, seq, hits):
         hits_to_keep = []
@@ -146,9 +160,20 @@ class Assigner(object):
             elif identity_is_ok and not coverage_is_ok:
                 num_low_coverage += 1
 
+        self.num_hits_checked += len(hits)
+        self.num_hits_low_coverage += num_low_coverage
+        self.num_hits_low_identity += \
+            len(hits) - len(hits_to_keep) - num_low_coverage
         frac_low_coverage = num_low_coverage / len(hits)
         return hits_to_keep, frac_low_coverage
 
+    def filter_stats(self):
+        return {
+            "hits_checked": self.num_hits_checked,
+            "hits_low_identity": self.num_hits_low_identity,
+            "hits_low_coverage": self.num_hits_low_coverage,
+            }
+
     def assign(self, name, seq, hits):
         if not hits:
             return NoAssignment(name, "No hits found in database")
@@ -159,66 +184,170 @@ class Assigner(object):
         if not hits_to_keep:
             message = "All BLAST hits were filtered for low quality."
             return NoAssignment(name, message)
-        return self.vote(name, seq, hits_to_keep)
-
-    def _retrieve_lineage(self, hit):
-        taxid = self.taxa_db.get_taxon_id(hit.accession)
-        if taxid is None:
-            return NoLineage()
-        raw_lineage = self.taxa_db.get_lineage(taxid)
-        if raw_lineage is None:
-            return NoLineage()
-        return Lineage(raw_lineage)
+        if self.assignment_cache.maxsize == 0:
+            return self.vote(name, seq, hits_to_keep)
+
+        # The sequence length only matters for the coverage filter, so
+        # the hits that pass the filter are enough to identify the vote.
+        fingerprint = tuple(
+            (hit.accession, hit.pct_id, hit.length) for hit in hits_to_keep)
+        a = self.assignment_cache.get(fingerprint)
+        if a is None:
+            a = self.vote(name, seq, hits_to_keep)
+            self.assignment_cache.put(fingerprint, a)
+            return a
+        if self._is_traced(name):
+            self.vote_trace.record_reuse(name, a.query_id)
+        return _renamed(a, name)
+
+    def _retrieve_lineages(self, taxon_ids):
+        """Return a Lineage object for each taxon ID.
+
+        Only taxon IDs that we have not seen recently are looked up in
+        the database.
+        """
+        lineages = {}
+        to_fetch = set()
+        for taxid in taxon_ids:
+            lineage = self.lineage_cache.get(taxid)
+            if lineage is None:
+                to_fetch.add(taxid)
+            else:
+                lineages[taxid] = lineage
+        if to_fetch:
+            raw_lineages = self.taxa_db.get_lineages(to_fetch)
+            for taxid in to_fetch:
+                raw_lineage = raw_lineages.get(taxid)
+                if raw_lineage is None:
+                    lineage = self._no_lineage
+                else:
+                    lineage = Lineage(raw_lineage)
+                self.lineage_cache.put(taxid, lineage)
+                lineages[taxid] = lineage
+        return lineages
 
     def vote(self, name, seq, hits):
         # Sort hits by percent ID.  This affects the way that ties are broken.
         hits.sort(reverse=True, key=lambda x: x.pct_id)
-        hits_lineage = [(hit, self._retrieve_lineage(hit)) for hit in hits]
-        for rank in self.ranks:
-            a = self.vote_at_rank(name, rank, hits_lineage)
-            a.log_details()
+        # Resolve taxon IDs and lineages for all hits in one call
+        # each to the database.
+        taxon_ids = self.taxa_db.get_taxon_ids(
+            set(hit.accession for hit in hits))
+        lineages = self._retrieve_lineages(
+            set(t for t in taxon_ids.values() if t is not None))
+        lineages[None] = self._no_lineage
+        hits_lineage = [
+            (hit, lineages[taxon_ids[hit.accession]]) for hit in hits]
+        # Votes at every rank are counted in one pass over the hits.
+        # Then we go up the ranks until one of them reaches consensus.
+        tallies = self._tally_votes(self._collapse_hits(hits_lineage))
+        is_traced = self._is_traced(name)
+        for rank_idx, tally in enumerate(tallies):
+            a = self._decide(name, rank_idx, tally)
+            if is_traced:
+                self.vote_trace.record_vote(a)
             if a.is_valid_assignment:
                 return a
         a.message = "Could not find consensus at domain level. No classification."
         return a
 
+    def _is_traced(self, query_id):
+        return (self.vote_trace is not None) and \
+            self.vote_trace.is_traced(query_id)
+
     def vote_at_rank(self, query_id, rank, db_hits):
         '''Votes at a given rank of the taxonomy.'''
         rank_idx = self.ranks.index(rank)
-        min_pct_id = self.rank_min_ids[rank_idx]
-        consensus_threshold = self.consensus_thresholds[rank_idx]
-
+        tallies = self._tally_votes(self._collapse_hits(db_hits))
+        return self._decide(query_id, rank_idx, tallies[rank_idx])
+
+    def _identity_bands(self):
+        # A hit votes at a rank if its percent identity is above the
+        # minimum for that rank.  We number the distinct minimums from
+        # lowest to highest.  A hit's band is the number of minimums it
+        # is above, and it votes at every rank whose minimum is
+        # numbered below its band.
+        min_ids = sorted(set(self.rank_min_ids))
+        rank_bands = [min_ids.index(m) for m in self.rank_min_ids]
+        return min_ids, rank_bands
+
+    def _collapse_hits(self, db_hits):
+        """Group hits that would cast the same votes.
+
+        Hits with the same lineage and identity band vote for the same
+        taxa at the same ranks, so each group is counted once, with a
+        weight.  Lineage objects are shared by all hits to a taxon ID.
+        Groups are kept in the order of their first hit, which keeps
+        the order in which taxa are first seen at each rank.
+        """
+        min_ids, _ = self._identity_bands()
+        weights = {}
+        groups = []
+        for hit, lineage in db_hits:
+            band = bisect.bisect_left(min_ids, hit.pct_id)
+            key = (lineage, band)
+            if key in weights:
+                weights[key] += 1
+            else:
+                weights[key] = 1
+                groups.append(key)
+        return [(lineage, band, weights[(lineage, band)])
+                for lineage, band in groups]
+
+    def _tally_votes(self, weighted_lineages):
         # We need to make a distinction between three types of
         # assignment candidates as we tally the votes:
         #
         # 1. Normal taxa (e.g. Debaryomycetaceae)
         # 2. Placeholders, created to fill a rank (e.g. Mortierellales (class))
         # 3. Generic taxa (e.g. uncultured Ascomycota)
+        #
+        # At each rank, taxa are given integer codes in the order we
+        # first see them, so that ties are broken the same way as
+        # before.
+        rank_slots = [Lineage.standard_rank_idx[rank] for rank in self.ranks]
+        _, rank_bands = self._identity_bands()
+        ranks = list(zip(range(len(self.ranks)), rank_slots, rank_bands))
+        tallies = [_RankTally() for _ in self.ranks]
+        for lineage, band, weight in weighted_lineages:
+            slot_taxa = lineage.slot_taxa
+            slot_generic = lineage.slot_generic
+            for rank_idx, slot, rank_band in ranks:
+                if band <= rank_band:
+                    continue
+                taxon = slot_taxa[slot]
+                if taxon is None:
+                    continue
+                tally = tallies[rank_idx]
+                if slot_generic[slot]:
+                    tally.generics[taxon] += weight
+                    continue
+                code = tally.codes.get(taxon)
+                if code is None:
+                    tally.codes[taxon] = len(tally.votes)
+                    tally.votes.append(weight)
+                    tally.lineages.append(lineage)
+                else:
+                    tally.votes[code] += weight
+        return tallies
+
+    def _decide(self, query_id, rank_idx, tally):
+        rank = self.ranks[rank_idx]
+        consensus_threshold = self.consensus_thresholds[rank_idx]
 
-        candidates = dict()
-        num_generic_votes = 0
-        generics = collections.defaultdict(int)
-        for hit, lineage in db_hits:
-            if hit.pct_id <= min_pct_id:
-                continue
-            taxon = lineage.get_taxon(rank)
-            if taxon is None:
-                continue
-            if lineage.is_generic(rank):
-                generics[taxon] += 1
-                num_generic_votes += 1
-                continue
-            if taxon not in candidates:
-                candidates[taxon] = AssignmentCandidate(lineage, rank)
-            candidates[taxon].votes += 1
+        candidates = []
+        for lineage, votes in zip(tally.lineages, tally.votes):
+            candidate = AssignmentCandidate(lineage, rank)
+            candidate.votes = votes
+            candidates.append(candidate)
 
         sorted_candidates = list(
-            sorted(candidates.values(), reverse=True, key=lambda c: c.votes))
+            sorted(candidates, reverse=True, key=lambda c: c.votes))
         total_candidate_votes = sum(c.votes for c in sorted_candidates)
         votes_needed_to_win = total_candidate_votes * consensus_threshold
 
         sorted_generics = list(
-            reversed(sorted((v, k) for k, v in generics.items())))
+            reversed(sorted((v, k) for k, v in tally.generics.items())))
 
         if len(candidates) == 0:
             return NoAssignment(
@@ -260,3 +389,14 @@ class Assigner(object):
         return Assignment(
             query_id, leading_candidate, rank=rank,
             candidates=sorted_candidates, generics=sorted_generics)
+
+
+class _RankTally(object):
+    """Votes for the taxa at one rank."""
+    __slots__ = ("codes", "votes", "lineages", "generics")
+
+    def __init__(self):
+        self.codes = {}
+        self.votes = []
+        self.lineages = []
+        self.generics = collections.defaultdict(int)
@@ -0,0 +1,58 @@
+import collections
+
+
+class LruCache(object):
+    """Size-bounded mapping that discards the least recently used item.
+
+    Keeps count of hits, misses, and evictions, so the size of the
+    cache can be tuned for a given run.  A maxsize of None means the
+    cache is unbounded, and a maxsize of 0 disables caching.
+    """
+    _missing = object()
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        value = self._items.get(key, self._missing)
+        if value is self._missing:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if (self.maxsize is not None) and (len(self._items) > self.maxsize):
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            }
+
+
+def format_cache_stats(stats):
+    """Format the statistics from LruCache.stats() for the log."""
+    if "hits" not in stats:
+        # Caches that only report their size
+        return "{size} items".format(**stats)
+    return (
+        "{size} items (max {maxsize}), {hits} hits, {misses} misses, "
+        "{evictions} evictions".format(**stats))
@@ -1,17 +1,31 @@
 from __future__ import division
 
+import collections
+import copy
+import itertools
+import json
 import logging
+import multiprocessing
 import optparse
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
-
-from brocclib.assign import Assigner
-from brocclib.get_xml import NcbiEutils
-from brocclib.taxonomy_db import NcbiLocal, TAXONOMY_DB_FP
-from brocclib.parse import iter_fasta, read_blast
+import time
+
+from brocclib.accession_index import NcbiAccessionIndex, accession_index_fp
+from brocclib.assign import (
+    Assigner, ASSIGNMENT_CACHE_SIZE, LINEAGE_CACHE_SIZE,
+    )
+from brocclib.cache import LruCache, format_cache_stats
+from brocclib.get_xml import NcbiEutils, EutilsCache
+from brocclib.taxonomy_db import NcbiLocal, TAXONOMY_DB_FP, TAXON_ID_CACHE_SIZE
+from brocclib.taxonomy_tree import NcbiTree, taxonomy_tree_fp
+from brocclib.hitstore import HitStore, is_hit_store
+from brocclib.profiler import Profiler, add_stats, cache_stats
+from brocclib.parse import iter_fasta, iter_query_hits, read_blast
+from brocclib.votetrace import VoteTrace, VoteTraceWriter, parse_vote_trace
 
 
 '''
@@ -28,11 +42,11 @@ CONSENSUS_THRESHOLDS = [
     ("class", 0.8),
     ("phylum", 0.9),
     ("kingdom", 0.9),
-    ("superkingdom", 0.9),
+    ("domain", 0.9),
     ]
 
 
-def parse_args(argv=None):
+def make_parser():
     parser = optparse.OptionParser(description=(
         "BROCC uses a consensus method determine taxonomic assignments from "
         "BLAST hits."))
@@ -53,34 +67,113 @@ def parse_args(argv=None):
         "after removal of generic taxa [default: %default]"))
     parser.add_option("--taxonomy_db", default=TAXONOMY_DB_FP, help=(
         "location of sqlite3 database holding a local copy of the "
-        "NCBI taxonomy [default: %default]"))
+        "NCBI taxonomy.  If a taxonomy tree file with the same name and "
+        "a .tree extension is found, it is used to look up lineages.  "
+        "Likewise, an accession index file with a .acc extension is used "
+        "to look up taxon IDs [default: %default]"))
+    parser.add_option("--taxon_id_cache_size", type="int",
+        default=TAXON_ID_CACHE_SIZE, help=(
+        "number of accession to taxon ID lookups to keep in memory when "
+        "using the local taxonomy database [default: %default]"))
+    parser.add_option("--lineage_cache_size", type="int",
+        default=LINEAGE_CACHE_SIZE, help=(
+        "number of lineages to keep in memory for voting "
+        "[default: %default]"))
+    parser.add_option("--dedup_queries", action="store_true", help=(
+        "classify queries with the same BLAST hits only once, reusing "
+        "the assignment for the others.  The voting log gives the full "
+        "details only for the first query with each set of hits"))
+    parser.add_option("--eutils_cache", help=(
+        "location of a file to keep the results of NCBI EUtils lookups "
+        "between runs, used if there is no local copy of the NCBI "
+        "taxonomy, e.g. ~/.brocc/eutils_cache.db [default: results are "
+        "kept only for the current run]"))
+    parser.add_option("--eutils_cache_ttl", type="float", help=(
+        "number of days to keep results in the NCBI EUtils cache before "
+        "looking them up again [default: keep forever]"))
+    parser.add_option("--stream", action="store_true", help=(
+        "read the FASTA and BLAST files one query at a time, writing "
+        "each assignment as soon as it is made.  This keeps memory use "
+        "low for large inputs, but queries must appear in the same order "
+        "in both files"))
+    parser.add_option("-p", "--processes", type="int", default=1, help=(
+        "number of processes to use for classification.  Each process "
+        "opens its own connection to the taxonomy database.  More than "
+        "one process needs a local copy of the NCBI taxonomy, to stay "
+        "within the request limit of NCBI EUtils [default: %default]"))
+    parser.add_option("--vote_trace", default="text", help=(
+        "how to record the votes behind each assignment: 'text' for "
+        "voting_log.txt, 'json' for one JSON record per line in "
+        "voting_log.jsonl, or 'off'.  Add 'sample=N' to record about "
+        "one query in N, for example 'json,sample=100' "
+        "[default: %default]"))
+    parser.add_option("--profile", action="store_true", help=(
+        "record the time spent in each stage of the run, with counts of "
+        "database lookups, cache hits, and filtered hits, and write them "
+        "to brocc_profile.json in the output directory"))
     parser.add_option("-v", "--verbose", action="store_true",
         help="output message after every query sequence is classified")
     parser.add_option("-i", "--input_fasta_file", dest="fasta_file",
         help="input fasta file of query sequences [REQUIRED]")
     parser.add_option("-b", "--input_blast_file", dest="blast_file",
-        help="input blast file [REQUIRED]")
+        help=(
+        "input blast file, or a hit store made with "
+        "create_brocc_hit_store [REQUIRED]"))
     parser.add_option("-o", "--output_directory",
         help="output directory [REQUIRED]")
     parser.add_option("-a", "--amplicon", help=(
         "amplicon being classified, either 'ITS' or '18S'. If this option is "
         "not supplied, both --min_species_id and --min_genus_id must be "
         "specified"))
+    return parser
+
+
+# Minimum species and genus identity for each amplicon
+AMPLICON_MIN_IDS = {
+    "ITS": (95.2, 83.05),
+    "18S": (99.0, 96.0),
+    }
+
+
+def parse_args(argv=None):
+    parser = make_parser()
     opts, args = parser.parse_args(argv)
+    _check_opts(parser, opts)
+    return opts
+
 
-    if opts.amplicon == "ITS":
-        opts.min_genus_id = 83.05
-        opts.min_species_id = 95.2
-    elif opts.amplicon == "18S":
-        opts.min_genus_id = 96.0
-        opts.min_species_id = 99.0
+def _check_opts(parser, opts, check_min_ids=True):
+    if opts.processes < 1:
+        parser.error("Number of processes must be at least 1.")
+    if (opts.processes > 1) and not os.path.exists(opts.taxonomy_db):
+        # Each process would make its own requests, going over the
+        # limit on requests per second.
+        parser.error(
+            "More than one process needs a local copy of the NCBI "
+            "taxonomy, made with create_local_taxonomy_db.")
+    if (opts.eutils_cache_ttl is not None) and not opts.eutils_cache:
+        parser.error("--eutils_cache_ttl needs a file given with "
+                     "--eutils_cache.")
+
+    if opts.amplicon in AMPLICON_MIN_IDS:
+        opts.min_species_id, opts.min_genus_id = \
+            AMPLICON_MIN_IDS[opts.amplicon]
     elif opts.amplicon:
         parser.error("Provided amplicon %s not recognized." % opts.amplicon)
-    else:
-        if not (opts.min_species_id and opts.min_genus_id):
-            parser.error("Must specify --amplicon, or provide both --min_species_id and --min_genus_id.")
+    elif check_min_ids and not _has_min_ids(opts):
+        parser.error("Must specify --amplicon, or provide both --min_species_id and --min_genus_id.")
 
-    return opts
+    opts.consensus_thresholds = [t for _, t in CONSENSUS_THRESHOLDS]
+
+    try:
+        opts.vote_trace_format, opts.vote_trace_sample = \
+            parse_vote_trace(opts.vote_trace)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def _has_min_ids(opts):
+    return bool(opts.min_species_id and opts.min_genus_id)
 
 
 def main(argv=None):
@@ -93,9 +186,7 @@ def main(argv=None):
     else:
         logging.basicConfig(level=logging.WARNING)
 
-    if os.path.exists(opts.taxonomy_db):
-        taxa_db = NcbiLocal(opts.taxonomy_db)
-    else:
+    if not os.path.exists(opts.taxonomy_db):
         sys.stderr.write(
             "Did not detect a local copy of the NCBI taxonomy.\n"
             "Using NCBI EUtils to get taxonomic info instead.\n\n"
@@ -103,20 +194,30 @@ def main(argv=None):
             "create_local_taxonomy_db\n"
             "This will greatly speed up the assignment process.\n"
         )
-        taxa_db = NcbiEutils()
-
-    consensus_thresholds = [t for _, t in CONSENSUS_THRESHOLDS]
-    assigner = Assigner(
-        opts.min_cover, opts.min_species_id, opts.min_genus_id, opts.min_id,
-        consensus_thresholds, opts.min_winning_votes, taxa_db)
+    if opts.profile:
+        profiler = Profiler()
+    else:
+        profiler = None
+    if opts.processes > 1:
+        # Each worker process opens its own database and assigner
+        taxa_db = None
+        assigner = None
+    else:
+        taxa_db = open_taxa_db(opts)
+        assigner = make_assigner(
+            opts, taxa_db, vote_trace=make_vote_trace(opts),
+            profiler=profiler)
 
     # Read input files
 
-    with open(opts.fasta_file) as f:
-        sequences = list(iter_fasta(f))
-
-    with open(opts.blast_file) as f:
-        blast_hits = read_blast(f)
+    start = time.perf_counter()
+    if opts.stream:
+        queries = _iter_streamed_queries(opts.fasta_file, opts.blast_file)
+    else:
+        queries = _read_queries(opts.fasta_file, opts.blast_file)
+    if profiler is not None:
+        profiler.add_time("parse", time.perf_counter() - start)
+        queries = profiler.timed_iter("parse", queries)
 
     # Open output files
 
@@ -129,29 +230,226 @@ def main(argv=None):
         "Sequence\tWinner_Votes\tVotes_Cast\tGenerics_Pruned\tLevel\t"
         "Classification\n")
 
-    # Set up log for voting details
-    vote_logger = logging.getLogger("brocc.votes")
-    vote_logger.setLevel(logging.DEBUG)
-    vote_handler = logging.FileHandler(os.path.join(opts.output_directory, "voting_log.txt"))
-    vote_handler.setLevel(logging.DEBUG)
-    vote_formatter = logging.Formatter('%(message)s')
-    vote_handler.setFormatter(vote_formatter)
-    vote_logger.addHandler(vote_handler)
-    vote_logger.propagate = False
-    # Do the work
+    if opts.vote_trace_format == "off":
+        vote_trace_writer = None
+    else:
+        vote_trace_writer = VoteTraceWriter(
+            opts.output_directory, opts.vote_trace_format)
 
-    for name, seq in sequences:
-        seq_hits = blast_hits[name]
-        # This is where the magic happens
-        a = assigner.assign(name, seq, seq_hits)
+    # Do the work
 
-        standard_taxa_file.write(a.format_for_standard_taxonomy())
-        log_file.write(a.format_for_log())
+    worker_stats = {}
+    if opts.processes > 1:
+        results = _assign_parallel(opts, queries, worker_stats)
+    else:
+        results = _assign(assigner, queries, profiler)
+    if profiler is not None:
+        # Time spent waiting for results is not spent on output
+        results = profiler.timed_iter("results", results)
+
+    start = time.perf_counter()
+    for standard_taxonomy_line, log_line, vote_records in results:
+        standard_taxa_file.write(standard_taxonomy_line)
+        log_file.write(log_line)
+        if vote_trace_writer is not None:
+            vote_trace_writer.write(vote_records)
 
     # Close output files
 
     standard_taxa_file.close()
     log_file.close()
+    if vote_trace_writer is not None:
+        vote_trace_writer.close()
+
+    if profiler is not None:
+        profiler.add_time(
+            "output",
+            time.perf_counter() - start - profiler.times["results"])
+        for worker_id, stats in worker_stats.items():
+            profiler.add_worker_stats(worker_id, stats)
+        profiler.write_report(
+            opts.output_directory, assigner, opts.processes)
+
+    if assigner is None:
+        caches = {}
+        for stats in worker_stats.values():
+            caches = add_stats(caches, stats["caches"])
+        _report_cache_stats(caches, len(worker_stats))
+    else:
+        _report_cache_stats(cache_stats(taxa_db, assigner), 1)
+
+
+def open_taxa_db(opts):
+    tree_fp = taxonomy_tree_fp(opts.taxonomy_db)
+    index_fp = accession_index_fp(opts.taxonomy_db)
+    if os.path.exists(opts.taxonomy_db):
+        taxa_db = NcbiLocal(opts.taxonomy_db, opts.taxon_id_cache_size)
+        if os.path.exists(tree_fp):
+            taxa_db = NcbiTree(tree_fp, taxa_db)
+        if os.path.exists(index_fp):
+            taxa_db = NcbiAccessionIndex(index_fp, taxa_db)
+    else:
+        if opts.eutils_cache:
+            cache = EutilsCache(opts.eutils_cache, opts.eutils_cache_ttl)
+        else:
+            cache = None
+        taxa_db = NcbiEutils(cache=cache)
+    return taxa_db
+
+
+def make_vote_trace(opts):
+    if opts.vote_trace_format == "off":
+        return None
+    return VoteTrace(opts.vote_trace_sample)
+
+
+def make_assigner(opts, taxa_db, lineage_cache=None, vote_trace=None,
+                  profiler=None):
+    if profiler is not None:
+        taxa_db = profiler.wrap_taxa_db(taxa_db)
+    return Assigner(
+        opts.min_cover, opts.min_species_id, opts.min_genus_id, opts.min_id,
+        opts.consensus_thresholds, opts.min_winning_votes, taxa_db,
+        opts.lineage_cache_size, lineage_cache,
+        ASSIGNMENT_CACHE_SIZE if opts.dedup_queries else 0, vote_trace)
+
+
+def _assign(assigner, queries, profiler=None):
+    vote_trace = assigner.vote_trace
+    assign = assigner.assign
+    if profiler is not None:
+        assign = profiler.timed("assign", assign)
+    for name, seq, seq_hits in queries:
+        # This is where the magic happens
+        a = assign(name, seq, seq_hits)
+        if vote_trace is None:
+            vote_records = []
+        else:
+            vote_records = vote_trace.pop_records()
+        yield a.format_for_standard_taxonomy(), a.format_for_log(), vote_records
+
+
+# Each worker process in the pool keeps its own assigner and database
+# connection.  Records for the voting log are sent back with each
+# block and written out by the main process, so that the log stays in
+# order.  The worker's cache statistics, and its timings if the run is
+# profiled, are sent back too.
+_worker_taxa_db = None
+_worker_assigner = None
+_worker_profiler = None
+
+
+def _init_worker(opts):
+    global _worker_taxa_db, _worker_assigner, _worker_profiler
+    if opts.profile:
+        _worker_profiler = Profiler()
+    _worker_taxa_db = open_taxa_db(opts)
+    _worker_assigner = make_assigner(
+        opts, _worker_taxa_db, vote_trace=make_vote_trace(opts),
+        profiler=_worker_profiler)
+
+
+def _assign_block(queries):
+    results = list(_assign(_worker_assigner, queries, _worker_profiler))
+    if _worker_profiler is None:
+        stats = {"caches": cache_stats(_worker_taxa_db, _worker_assigner)}
+    else:
+        stats = _worker_profiler.snapshot(_worker_assigner)
+    return results, (os.getpid(), stats)
+
+
+QUERY_BLOCK_SIZE = 100
+
+
+def _assign_parallel(opts, queries, worker_stats):
+    # Only a few blocks per process are read ahead of the output, so
+    # that memory use stays bounded in streaming mode.
+    max_pending = 4 * opts.processes
+    pending = collections.deque()
+    blocks = _iter_blocks(queries, QUERY_BLOCK_SIZE)
+    with multiprocessing.Pool(
+            opts.processes, _init_worker, (opts,)) as pool:
+        for block in blocks:
+            pending.append(pool.apply_async(_assign_block, (block,)))
+            if len(pending) >= max_pending:
+                for result in _block_results(pending.popleft(), worker_stats):
+                    yield result
+        while pending:
+            for result in _block_results(pending.popleft(), worker_stats):
+                yield result
+
+
+def _block_results(async_result, worker_stats):
+    results, (worker_id, stats) = async_result.get()
+    # Workers send their running totals, so we keep the latest.
+    worker_stats[worker_id] = stats
+    return results
+
+
+def _report_cache_stats(caches, processes):
+    # Written at the end of every run, so that the cache sizes can be
+    # tuned.  With several processes, the counts are added up.
+    if processes > 1:
+        sys.stderr.write(
+            "Cache statistics, added up over {0} processes:\n".format(
+                processes))
+    else:
+        sys.stderr.write("Cache statistics:\n")
+    for name, stats in sorted(caches.items()):
+        sys.stderr.write(
+            "  {0}: {1}\n".format(name, format_cache_stats(stats)))
+
+
+def _iter_blocks(xs, n):
+    xs = iter(xs)
+    while True:
+        block = list(itertools.islice(xs, n))
+        if not block:
+            return
+        yield block
+
+
+def _read_queries(fasta_fp, blast_fp):
+    with open(fasta_fp) as f:
+        sequences = list(iter_fasta(f))
+
+    if is_hit_store(blast_fp):
+        blast_hits = HitStore(blast_fp)
+    else:
+        with open(blast_fp, "rb") as f:
+            blast_hits = read_blast(f)
+
+    return ((name, seq, blast_hits[name]) for name, seq in sequences)
+
+
+def _iter_streamed_queries(fasta_fp, blast_fp):
+    if is_hit_store(blast_fp):
+        # Hits are read from the store as each query comes up
+        blast_hits = HitStore(blast_fp)
+        with open(fasta_fp) as f_fasta:
+            for name, seq in iter_fasta(f_fasta):
+                yield name, seq, blast_hits[name]
+        return
+
+    with open(fasta_fp) as f_fasta, open(blast_fp, "rb") as f_blast:
+        for query in iter_query_hits(f_fasta, f_blast):
+            yield query
+
+
+def read_assignments(f):
+    """Read a file in the format of Standard_Taxonomy.txt.
+
+    Returns a dict mapping each query ID to the rest of its line.
+    """
+    assignments = {}
+    for line in f:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        query_id, _, assignment = line.partition("\t")
+        assignments[query_id] = assignment
+    return assignments
+
 
 def run_comparison(argv=None):
     p = optparse.OptionParser()
@@ -185,6 +483,266 @@ def run_comparison(argv=None):
                 ["diff", observed_assignments_fp, expected_assignments_fp],
                 stdout=f,
             )
+        with open(observed_assignments_fp) as f:
+            observed = read_assignments(f)
+        with open(expected_assignments_fp) as f:
+            expected = read_assignments(f)
+        num_matching = sum(
+            1 for query_id, assignment in observed.items()
+            if expected.get(query_id) == assignment)
+        print("{0}: {1} of {2} assignments match".format(
+            base_filename, num_matching, len(expected)))
 
         if not opts.keep_temp:
             shutil.rmtree(output_dir)
+
+
+# Settings that can be varied in a parameter sweep
+SWEEP_PARAMETERS = [
+    "amplicon", "min_id", "min_cover", "min_species_id", "min_genus_id",
+    "min_winning_votes", "consensus_thresholds",
+    ]
+
+
+# brocc options that do not apply to a sweep
+SWEEP_UNSUPPORTED_OPTIONS = ["--processes", "--vote_trace", "--profile"]
+
+
+def run_sweep(argv=None):
+    """Classify the same queries with many different settings.
+
+    The queries are read and their hits looked up in the taxonomy
+    once.  Each configuration in the grid gets its own output
+    directory, and a summary of all configurations is written to
+    sweep_summary.txt.  Assignments are written as they are made, so
+    only counts are kept for the summary.
+    """
+    parser = make_parser()
+    parser.set_usage("%prog --grid GRID_FILE [brocc options]")
+    for option in SWEEP_UNSUPPORTED_OPTIONS:
+        parser.remove_option(option)
+    parser.add_option("--grid", help=(
+        "JSON file with the configurations to run.  This is either a "
+        "list of objects, each giving the settings for one "
+        "configuration, or an object that maps each setting to a list "
+        "of values to try in all combinations.  Settings that can be "
+        "varied: " + ", ".join(SWEEP_PARAMETERS) + " [REQUIRED]"))
+    parser.add_option("--expected", help=(
+        "file of expected assignments, in the same format as "
+        "Standard_Taxonomy.txt, to compare with each configuration"))
+    opts, args = parser.parse_args(argv)
+    # The grid may give the amplicon or identity thresholds, so they
+    # are checked for each configuration instead.
+    _check_opts(parser, opts, check_min_ids=False)
+    if not opts.grid:
+        parser.error("Must specify --grid.")
+
+    with open(opts.grid) as f:
+        grid = json.load(f)
+    try:
+        configs = [
+            (name, params, _sweep_opts(opts, params))
+            for name, params in _expand_grid(grid)]
+    except ValueError as e:
+        parser.error(str(e))
+
+    expected = None
+    if opts.expected:
+        with open(opts.expected) as f:
+            expected = read_assignments(f)
+
+    logging.basicConfig(level=logging.WARNING)
+    # Lookups are shared by all configurations, and all assigners
+    # share the same Lineage objects.
+    taxa_db = _SweepTaxaDb(open_taxa_db(opts), opts.taxon_id_cache_size)
+    lineage_cache = LruCache(opts.lineage_cache_size)
+    assigners = [
+        make_assigner(config_opts, taxa_db, lineage_cache)
+        for _, _, config_opts in configs]
+
+    if opts.stream:
+        queries = _iter_streamed_queries(opts.fasta_file, opts.blast_file)
+    else:
+        queries = _read_queries(opts.fasta_file, opts.blast_file)
+
+    if not os.path.exists(opts.output_directory):
+        os.mkdir(opts.output_directory)
+    outputs = [
+        _SweepOutput(os.path.join(opts.output_directory, config_name))
+        for config_name, _, _ in configs]
+    try:
+        for name, seq, seq_hits in queries:
+            baseline = None
+            for assigner, output in zip(assigners, outputs):
+                a = assigner.assign(name, seq, seq_hits)
+                assignment = output.write(a, baseline, expected)
+                if baseline is None:
+                    # Changes are counted from the first configuration
+                    baseline = assignment
+    finally:
+        for output in outputs:
+            output.close()
+
+    summary_fp = os.path.join(opts.output_directory, "sweep_summary.txt")
+    with open(summary_fp, "w") as f:
+        _write_sweep_summary(f, configs, outputs, expected is not None)
+
+
+def _expand_grid(grid):
+    if isinstance(grid, dict):
+        keys = sorted(grid)
+        value_lists = [grid[k] for k in keys]
+        for k, values in zip(keys, value_lists):
+            if not isinstance(values, list):
+                raise ValueError(
+                    "Grid setting {0} must be a list of values".format(k))
+        combinations = itertools.product(*value_lists)
+        grid = [dict(zip(keys, values)) for values in combinations]
+    names = set()
+    for idx, params in enumerate(grid):
+        params = dict(params)
+        name = params.pop("name", "config_{0:03d}".format(idx + 1))
+        if (name in names) or (os.sep in name) or name.startswith("."):
+            raise ValueError("Bad or repeated configuration name: " + name)
+        names.add(name)
+        yield name, params
+
+
+def _sweep_opts(opts, params):
+    unknown = set(params) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(
+            "Unknown settings in grid: " + ", ".join(sorted(unknown)))
+    config_opts = copy.copy(opts)
+    amplicon = params.get("amplicon")
+    if amplicon is not None:
+        if amplicon not in AMPLICON_MIN_IDS:
+            raise ValueError("Amplicon {0} not recognized".format(amplicon))
+        config_opts.min_species_id, config_opts.min_genus_id = \
+            AMPLICON_MIN_IDS[amplicon]
+    for key, value in params.items():
+        if key == "consensus_thresholds":
+            config_opts.consensus_thresholds = _sweep_thresholds(value)
+        elif key != "amplicon":
+            setattr(config_opts, key, value)
+    if not _has_min_ids(config_opts):
+        raise ValueError(
+            "Each configuration needs an amplicon, or both "
+            "min_species_id and min_genus_id, from the grid or the "
+            "command line.")
+    return config_opts
+
+
+def _sweep_thresholds(value):
+    # Either a list with one threshold per rank, or an object with
+    # thresholds for some ranks, the rest keeping their defaults.
+    ranks = [rank for rank, _ in CONSENSUS_THRESHOLDS]
+    if isinstance(value, list):
+        if len(value) != len(ranks):
+            raise ValueError(
+                "consensus_thresholds must have one value for each of "
+                "these ranks: " + ", ".join(ranks))
+        return value
+    unknown = set(value) - set(ranks)
+    if unknown:
+        raise ValueError(
+            "Unknown ranks in consensus_thresholds: " +
+            ", ".join(sorted(unknown)))
+    return [value.get(rank, t) for rank, t in CONSENSUS_THRESHOLDS]
+
+
+class _SweepTaxaDb(object):
+    """Keeps the taxon IDs of recent accessions for the whole sweep."""
+    _missing = object()
+
+    def __init__(self, taxa_db, cache_size):
+        self.taxa_db = taxa_db
+        self.taxon_ids = LruCache(cache_size)
+
+    def get_taxon_ids(self, accs):
+        taxon_ids = {}
+        to_fetch = []
+        for acc in set(accs):
+            taxon_id = self.taxon_ids.get(acc, self._missing)
+            if taxon_id is self._missing:
+                to_fetch.append(acc)
+            else:
+                taxon_ids[acc] = taxon_id
+        if to_fetch:
+            fetched = self.taxa_db.get_taxon_ids(to_fetch)
+            for acc in to_fetch:
+                self.taxon_ids.put(acc, fetched[acc])
+            taxon_ids.update(fetched)
+        return taxon_ids
+
+    def get_lineages(self, taxon_ids):
+        return self.taxa_db.get_lineages(taxon_ids)
+
+
+class _SweepOutput(object):
+    """Writes the assignments for one configuration, keeping counts."""
+    def __init__(self, output_dir):
+        if not os.path.exists(output_dir):
+            os.mkdir(output_dir)
+        self.standard_taxa_file = open(
+            os.path.join(output_dir, "Standard_Taxonomy.txt"), "w")
+        self.log_file = open(os.path.join(output_dir, "brocc.log"), "w")
+        self.log_file.write(
+            "Sequence\tWinner_Votes\tVotes_Cast\tGenerics_Pruned\tLevel\t"
+            "Classification\n")
+        self.num_queries = 0
+        self.num_assigned = 0
+        self.num_changed = 0
+        self.num_matching = 0
+        self.rank_counts = collections.Counter()
+
+    def write(self, a, baseline=None, expected=None):
+        """Write an assignment and return its text, for comparison."""
+        line = a.format_for_standard_taxonomy()
+        self.standard_taxa_file.write(line)
+        self.log_file.write(a.format_for_log())
+        assignment = line.rstrip("\n").partition("\t")[2]
+        self.num_queries += 1
+        if a.is_valid_assignment:
+            self.num_assigned += 1
+            self.rank_counts[a.rank] += 1
+        if (baseline is not None) and (assignment != baseline):
+            self.num_changed += 1
+        if (expected is not None) and \
+           (expected.get(a.query_id) == assignment):
+            self.num_matching += 1
+        return assignment
+
+    def close(self):
+        self.standard_taxa_file.close()
+        self.log_file.close()
+
+
+def _write_sweep_summary(f, configs, outputs, has_expected=False):
+    # Differences are given relative to the first configuration
+    ranks = [rank for rank, _ in CONSENSUS_THRESHOLDS]
+    header = [
+        "Configuration", "Settings", "Queries", "Assigned", "Assigned_Pct",
+        "Assigned_Pct_Diff", "Changed"]
+    if has_expected:
+        header.append("Matching_Expected")
+    header.extend(ranks)
+    f.write("\t".join(header) + "\n")
+
+    baseline_pct = None
+    for (name, params, _), output in zip(configs, outputs):
+        if output.num_queries:
+            assigned_pct = 100.0 * output.num_assigned / output.num_queries
+        else:
+            assigned_pct = 0.0
+        if baseline_pct is None:
+            baseline_pct = assigned_pct
+        row = [
+            name, json.dumps(params, sort_keys=True), output.num_queries,
+            output.num_assigned, "{0:.2f}".format(assigned_pct),
+            "{0:+.2f}".format(assigned_pct - baseline_pct),
+            output.num_changed]
+        if has_expected:
+            row.append(output.num_matching)
+        row.extend(output.rank_counts[rank] for rank in ranks)
+        f.write("\t".join(str(x) for x in row) + "\n")
@@ -1,41 +1,375 @@
+import concurrent.futures
+import itertools
 import json
+import threading
+import time
+import urllib.parse
 import urllib.request
 import urllib.error
 import os
+import sqlite3
 from xml.etree import ElementTree as ET
 import logging
 
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+
 
 class NcbiEutils(object):
-    def __init__(self):
+    def __init__(self, client=None, cache=None):
         self.lineages = {}
         self.taxon_ids = {}
+        if client is None:
+            client = EutilsClient()
+        self.client = client
+        self.cache = cache
 
     def get_lineage(self, taxon_id):
-        if taxon_id not in self.lineages:
-            self.lineages[taxon_id] = get_lineage(taxon_id)
-        return self.lineages[taxon_id]
+        return self.get_lineages([taxon_id])[taxon_id]
+
+    def get_lineages(self, taxon_ids):
+        taxon_ids = set(taxon_ids)
+        to_fetch = [t for t in taxon_ids if t not in self.lineages]
+        if to_fetch and (self.cache is not None):
+            cached = self.cache.load_lineages(to_fetch)
+            self.lineages.update(cached)
+            to_fetch = [t for t in to_fetch if t not in cached]
+        if to_fetch:
+            fetched = self.client.get_lineages(to_fetch)
+            self.lineages.update(fetched)
+            if self.cache is not None:
+                self.cache.save_lineages(fetched)
+        return dict((t, self.lineages[t]) for t in taxon_ids)
+
+    def stats(self):
+        return {
+            "http_requests": self.client.num_requests,
+            "taxon_id_cache": {"size": len(self.taxon_ids)},
+            "lineage_cache": {"size": len(self.lineages)},
+            }
 
     def get_taxon_id(self, acc):
-        if acc not in self.taxon_ids:
-            self.taxon_ids[acc] = get_taxid(acc)
-        return self.taxon_ids[acc]
+        return self.get_taxon_ids([acc])[acc]
+
+    def get_taxon_ids(self, accs):
+        accs = set(accs)
+        to_fetch = [acc for acc in accs if acc not in self.taxon_ids]
+        if to_fetch and (self.cache is not None):
+            cached = self.cache.load_taxon_ids(to_fetch)
+            self.taxon_ids.update(cached)
+            to_fetch = [acc for acc in to_fetch if acc not in cached]
+        if to_fetch:
+            fetched = self.client.get_taxon_ids(to_fetch)
+            self.taxon_ids.update(fetched)
+            if self.cache is not None:
+                self.cache.save_taxon_ids(fetched)
+        return dict((acc, self.taxon_ids[acc]) for acc in accs)
+
+
+class EutilsCache(object):
+    """Keeps results from E-utilities in a local sqlite3 database.
+
+    Only successful lookups are saved, so that IDs that could not be
+    resolved are tried again on the next run.  If a time to live is
+    given, in days, older results are ignored and fetched again.
+    Results are looked up as they are needed, so the cache is never
+    read into memory as a whole.
+    """
+    # Stay well under SQLITE_MAX_VARIABLE_NUMBER for older sqlite builds
+    max_query_params = 500
+
+    def __init__(self, fp, ttl=None):
+        self.fp = fp
+        self.ttl = ttl
+        cache_dir = os.path.dirname(fp)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # Several processes may write to the same cache
+        self.con = sqlite3.connect(fp, timeout=60)
+        self.con.executescript(EUTILS_CACHE_COMMANDS)
+
+    def _min_fetched(self):
+        if self.ttl is None:
+            return 0
+        return time.time() - self.ttl * 24 * 60 * 60
+
+    def load_taxon_ids(self, accs):
+        """Return the saved taxon IDs for the accessions that have one."""
+        result = {}
+        for batch in _batches(accs, self.max_query_params):
+            cur = self.con.execute(
+                "SELECT accession, taxid FROM taxon_ids "
+                "WHERE fetched >= ? AND accession IN ({0})".format(
+                    ",".join("?" * len(batch))),
+                [self._min_fetched()] + batch)
+            result.update(cur)
+        return result
+
+    def load_lineages(self, taxon_ids):
+        """Return the saved lineages for the taxon IDs that have one."""
+        result = {}
+        for batch in _batches(taxon_ids, self.max_query_params):
+            # Taxon IDs are saved as text, but may be given as numbers
+            keys = dict((str(t), t) for t in batch)
+            cur = self.con.execute(
+                "SELECT taxid, lineage FROM lineages "
+                "WHERE fetched >= ? AND taxid IN ({0})".format(
+                    ",".join("?" * len(keys))),
+                [self._min_fetched()] + list(keys))
+            for taxon_id, lineage in cur:
+                result[keys[taxon_id]] = [
+                    tuple(x) for x in json.loads(lineage)]
+        return result
+
+    def save_taxon_ids(self, taxon_ids):
+        now = time.time()
+        recs = [
+            (acc, taxon_id, now) for acc, taxon_id in taxon_ids.items()
+            if taxon_id is not None]
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO taxon_ids VALUES (?, ?, ?)", recs)
+
+    def save_lineages(self, lineages):
+        now = time.time()
+        recs = [
+            (str(taxon_id), json.dumps(lineage), now)
+            for taxon_id, lineage in lineages.items()
+            if lineage is not None]
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO lineages VALUES (?, ?, ?)", recs)
+
+EUTILS_CACHE_COMMANDS = """\
+CREATE TABLE IF NOT EXISTS taxon_ids (
+    "accession" TEXT PRIMARY KEY,
+    "taxid" TEXT,
+    "fetched" REAL
+);
+CREATE TABLE IF NOT EXISTS lineages (
+    "taxid" TEXT PRIMARY KEY,
+    "lineage" TEXT,
+    "fetched" REAL
+);
+"""
+
+
+class RateLimiter(object):
+    """Spaces out calls to wait() across threads."""
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class EutilsClient(object):
+    """Batched, concurrent client for NCBI E-utilities.
+
+    Each request resolves up to batch_size IDs, and up to max_workers
+    requests are in flight at a time.  Requests are spaced out to stay
+    within NCBI's limits: 3 requests per second, or 10 with an API key.
+    The API key is read from the NCBI_API_KEY environment variable if
+    not given.  Failed requests are retried with exponential backoff.
+    """
+    def __init__(self, base_url=EUTILS_URL, api_key=None, batch_size=200,
+                 max_workers=3, requests_per_second=None, max_tries=5,
+                 backoff=1.0, timeout=60):
+        self.base_url = base_url
+        if api_key is None:
+            api_key = os.environ.get("NCBI_API_KEY")
+        self.api_key = api_key
+        if requests_per_second is None:
+            requests_per_second = 10 if api_key else 3
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_tries = max_tries
+        self.backoff = backoff
+        self.timeout = timeout
+        # Number of HTTP requests made, including retries
+        self.num_requests = 0
+        self._num_requests_lock = threading.Lock()
+
+    def request(self, endpoint, params):
+        """POST a request to an E-utilities endpoint, return the response.
+
+        Bad requests (HTTP 400) are not retried.
+        """
+        params = dict(params)
+        if self.api_key:
+            params["api_key"] = self.api_key
+        url = self.base_url + endpoint
+        data = urllib.parse.urlencode(params).encode("ascii")
+        for n in range(self.max_tries):
+            if n > 0:
+                time.sleep(self.backoff * 2 ** (n - 1))
+            self.rate_limiter.wait()
+            with self._num_requests_lock:
+                self.num_requests += 1
+            try:
+                with urllib.request.urlopen(
+                        url, data, timeout=self.timeout) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                if e.code == 400:
+                    raise
+                logging.debug(
+                    "Retrying URL %s (attempt %s): %s" % (url, n + 1, e))
+            except (urllib.error.URLError, OSError) as e:
+                logging.debug(
+                    "Retrying URL %s (attempt %s): %s" % (url, n + 1, e))
+        raise urllib.error.URLError(
+            "Could not open URL %s (%s attempts)" % (url, self.max_tries))
+
+    def _map_batches(self, fn, ids):
+        batches = _batches(sorted(ids, key=str), self.batch_size)
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as ex:
+            for batch_results in ex.map(fn, batches):
+                results.update(batch_results)
+        return results
+
+    def get_taxon_ids(self, accs):
+        """Look up taxon IDs for many accessions or GI numbers.
+
+        Returns a dict mapping each accession to its taxon ID, or to
+        None if the accession could not be resolved.
+        """
+        return self._map_batches(self._fetch_taxon_ids, accs)
+
+    def _fetch_taxon_ids(self, accs):
+        params = {
+            "db": "nucleotide", "id": ",".join(accs), "retmode": "json"}
+        try:
+            response = self.request("esummary.fcgi", params)
+            found = get_taxon_ids_from_json(response)
+        except urllib.error.HTTPError as e:
+            if (e.code == 400) and (len(accs) > 1):
+                return self._split_batch(self._fetch_taxon_ids, accs)
+            logging.info("Accessions %s: %s" % (",".join(accs), e))
+            found = {}
+        except Exception as e:
+            logging.info("Accessions %s: %s" % (",".join(accs), e))
+            found = {}
+        return dict((acc, found.get(acc)) for acc in accs)
+
+    def get_lineages(self, taxon_ids):
+        """Look up lineages for many taxon IDs.
+
+        Returns a dict mapping each taxon ID to its lineage, or to None
+        if the lineage could not be retrieved.
+        """
+        return self._map_batches(self._fetch_lineages, taxon_ids)
+
+    def _fetch_lineages(self, taxon_ids):
+        ids = ",".join(str(t) for t in taxon_ids)
+        params = {"db": "taxonomy", "id": ids, "rettype": "xml"}
+        try:
+            response = self.request("efetch.fcgi", params)
+            found = get_taxa_from_xml(_get_xml_from_html(response))
+        except urllib.error.HTTPError as e:
+            if (e.code == 400) and (len(taxon_ids) > 1):
+                return self._split_batch(self._fetch_lineages, taxon_ids)
+            logging.info("Taxa %s: %s" % (ids, e))
+            found = {}
+        except Exception as e:
+            logging.info("Taxa %s: %s" % (ids, e))
+            found = {}
+        for taxon_id in taxon_ids:
+            if str(taxon_id) not in found:
+                logging.info(
+                    "Could not retrieve lineage for taxon {0}, will not be "
+                    "considered".format(taxon_id))
+        return dict((t, found.get(str(t))) for t in taxon_ids)
+
+    def _split_batch(self, fetch, ids):
+        # NCBI rejects the whole request if one ID is malformed.  We
+        # try each half of the batch in turn, so that only the bad IDs
+        # are lost.
+        mid = len(ids) // 2
+        results = fetch(ids[:mid])
+        results.update(fetch(ids[mid:]))
+        return results
+
+
+def _batches(xs, n):
+    xs = iter(xs)
+    while True:
+        batch = list(itertools.islice(xs, n))
+        if not batch:
+            return
+        yield batch
+
+
+def get_taxon_ids_from_json(json_string):
+    """Map accessions and GI numbers to taxon IDs in esummary output.
+
+    Each record can be found by its GI number (the uid), its versioned
+    accession, or its accession without the version.
+    """
+    result = json.loads(json_string).get("result", {})
+    taxon_ids = {}
+    for uid in result.get("uids", []):
+        rec = result.get(uid, {})
+        taxon_id = rec.get("taxid")
+        if not taxon_id:
+            continue
+        taxon_id = str(taxon_id)
+        for key in (uid, rec.get("accessionversion"), rec.get("caption")):
+            if key:
+                taxon_ids[key] = taxon_id
+    return taxon_ids
+
+
+def get_taxa_from_xml(xml_string):
+    """Map taxon IDs to lineages in efetch output for many taxa.
+
+    Taxa that were merged into another taxon can be found by their
+    old taxon ID as well.
+    """
+    lineages = {}
+    tree = ET.XML(xml_string)
+    for taxon_elem in tree.findall('Taxon'):
+        taxon_id = taxon_elem.find('TaxId').text
+        try:
+            lineage = _get_lineage_from_elem(taxon_elem)
+        except ValueError as e:
+            logging.info("Taxon %s: %s" % (taxon_id, e))
+            continue
+        lineages[taxon_id] = lineage
+        for aka_elem in taxon_elem.findall('AkaTaxIds/TaxId'):
+            lineages[aka_elem.text] = lineage
+    return lineages
 
 
 def get_taxon_from_xml(xml_string):
-    lineage_with_ranks = []
     tree = ET.XML(xml_string)
-    lineage_elem = tree.find('Taxon/LineageEx')
-    if lineage_elem is None:
+    taxon_elem = tree.find('Taxon')
+    if (taxon_elem is None) or (taxon_elem.find('LineageEx') is None):
         raise ValueError("No lineage info found in XML:\n" + xml_string)
+    return _get_lineage_from_elem(taxon_elem)
+
+
+def _get_lineage_from_elem(taxon_elem):
+    lineage_with_ranks = []
+    lineage_elem = taxon_elem.find('LineageEx')
+    if lineage_elem is None:
+        raise ValueError("No lineage info found in XML")
     for elem in list(lineage_elem):
         rank = elem.find('Rank').text
         name = elem.find('ScientificName').text
         lineage_with_ranks.append((name, rank))
 
     # Include lowest rank in lineage
-    rank = tree.find('Taxon/Rank').text
-    name = tree.find('Taxon/ScientificName').text
+    rank = taxon_elem.find('Rank').text
+    name = taxon_elem.find('ScientificName').text
     lineage_with_ranks.append((name, rank))
 
     return lineage_with_ranks
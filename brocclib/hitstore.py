@@ -0,0 +1,331 @@
+"""Compact, memory-mapped store of BLAST hits.
+
+Classifying the same BLAST results again with different settings
+would otherwise mean parsing the same text file every time.  The hit
+store holds the parsed hits in columns:
+
+* for each hit, the index of its accession in a table of accessions,
+* for each hit, the percent identity and the alignment length,
+* for each query, the runs of hits that belong to it,
+* the query IDs and accessions, as blocks of UTF-8 encoded strings,
+  and
+* the query indexes in the sorted order of their IDs, so that a query
+  can be found by binary search.
+
+The file is memory-mapped, and nothing is read until the hits for a
+query are requested.  Hits are written in the order they are given,
+through temporary files, so that the hits are never all in memory.
+The arrays are written in the native byte order, so the file should
+be built on the same kind of machine that reads it.
+"""
+
+import argparse
+import array
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+from brocclib.parse import BlastHit, iter_blast
+
+HIT_STORE_MAGIC = b"BROCCHIT"
+HIT_STORE_VERSION = 2
+# magic, version, byte order, number of queries, number of hits,
+# number of accessions, number of runs of hits, size of query ID
+# block, size of accession block
+_HEADER = struct.Struct("=8sIBxxxQQQQQQ")
+_BYTE_ORDERS = {"little": 0, "big": 1}
+
+HIT_STORE_EXT = ".hits"
+
+# Number of items kept in memory for each column before it is written
+# to its temporary file
+_CHUNK_SIZE = 65536
+
+
+def is_hit_store(fp):
+    """True if the file at fp is a hit store."""
+    with open(fp, "rb") as f:
+        return f.read(len(HIT_STORE_MAGIC)) == HIT_STORE_MAGIC
+
+
+def _aligned(n, size=8):
+    return (n + size - 1) // size * size
+
+
+def write_hit_store(fp, hits):
+    """Write a hit store from (query_id, hit) pairs.
+
+    The hits for each query are stored in the order given.  As with
+    read_blast, the hits for a query do not need to be together.  Each
+    run of hits for the same query is recorded, and a query's hits are
+    put back together from its runs when they are read.  Only the
+    query IDs, accessions, and runs are kept in memory.
+    """
+    temp_dir = os.path.dirname(os.path.abspath(fp))
+    # A brocc run may have the old file mapped, so the new file is
+    # written alongside it and moved into place.
+    temp_fp = "{0}.{1}.tmp".format(fp, os.getpid())
+    query_idxs = {}
+    accession_idxs = {}
+    query_ids = _StringColumn(temp_dir)
+    accessions = _StringColumn(temp_dir)
+    hit_accessions = _ArrayColumn("I", temp_dir)
+    pct_ids = _ArrayColumn("d", temp_dir)
+    lengths = _ArrayColumn("d", temp_dir)
+    run_queries = array.array("Q")
+    run_starts = array.array("Q")
+    num_hits = 0
+    last_query_idx = None
+    try:
+        for query_id, hit in hits:
+            query_idx = query_idxs.get(query_id)
+            if query_idx is None:
+                query_idx = query_idxs[query_id] = len(query_idxs)
+                query_ids.append(query_id)
+            if query_idx != last_query_idx:
+                run_queries.append(query_idx)
+                run_starts.append(num_hits)
+                last_query_idx = query_idx
+            accession_idx = accession_idxs.get(hit.accession)
+            if accession_idx is None:
+                accession_idx = accession_idxs[hit.accession] = \
+                    len(accession_idxs)
+                accessions.append(hit.accession)
+            hit_accessions.append(accession_idx)
+            pct_ids.append(hit.pct_id)
+            lengths.append(hit.length)
+            num_hits += 1
+
+        num_queries = len(query_idxs)
+        num_runs = len(run_queries)
+        run_ends = run_starts[1:]
+        run_ends.append(num_hits)
+        if num_runs != num_queries:
+            # Put the runs for each query together, keeping their order
+            order = sorted(range(num_runs), key=run_queries.__getitem__)
+            run_starts = array.array("Q", (run_starts[i] for i in order))
+            run_ends = array.array("Q", (run_ends[i] for i in order))
+        query_run_offsets = array.array("Q", bytes(8 * (num_queries + 1)))
+        for query_idx in run_queries:
+            query_run_offsets[query_idx + 1] += 1
+        for query_idx in range(num_queries):
+            query_run_offsets[query_idx + 1] += query_run_offsets[query_idx]
+        # Python sorts strings by code point, which is the same as the
+        # byte order of their UTF-8 encoding.
+        sorted_query_idxs = array.array(
+            "Q", (query_idxs[q] for q in sorted(query_idxs)))
+        query_idxs = accession_idxs = None
+
+        with open(temp_fp, "wb") as f:
+            f.write(_HEADER.pack(
+                HIT_STORE_MAGIC, HIT_STORE_VERSION,
+                _BYTE_ORDERS[sys.byteorder], num_queries, num_hits,
+                len(accessions), num_runs, query_ids.size, accessions.size))
+            _write_padded(f, query_run_offsets.tobytes())
+            _write_padded(f, run_starts.tobytes())
+            _write_padded(f, run_ends.tobytes())
+            hit_accessions.copy_to(f)
+            pct_ids.copy_to(f)
+            lengths.copy_to(f)
+            _write_padded(f, query_ids.offsets.tobytes())
+            _write_padded(f, sorted_query_idxs.tobytes())
+            _write_padded(f, accessions.offsets.tobytes())
+            query_ids.copy_to(f)
+            accessions.copy_to(f)
+        os.replace(temp_fp, fp)
+    finally:
+        for column in [
+                query_ids, accessions, hit_accessions, pct_ids, lengths]:
+            column.close()
+        if os.path.exists(temp_fp):
+            os.remove(temp_fp)
+
+
+class _ArrayColumn(object):
+    """Array of numbers, written to a temporary file in chunks."""
+    def __init__(self, fmt, temp_dir):
+        self.fmt = fmt
+        self.file = tempfile.TemporaryFile(dir=temp_dir)
+        self.buf = array.array(fmt)
+        self.num_written = 0
+
+    def append(self, x):
+        self.buf.append(x)
+        if len(self.buf) >= _CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.buf.tofile(self.file)
+        self.num_written += len(self.buf)
+        self.buf = array.array(self.fmt)
+
+    @property
+    def size(self):
+        return (self.num_written + len(self.buf)) * self.buf.itemsize
+
+    def copy_to(self, f):
+        size = self.size
+        self._flush()
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, f)
+        f.write(bytes(_aligned(size) - size))
+
+    def close(self):
+        self.file.close()
+
+
+class _StringColumn(_ArrayColumn):
+    """Block of UTF-8 encoded strings, with the offset of each one."""
+    def __init__(self, temp_dir):
+        super(_StringColumn, self).__init__("B", temp_dir)
+        self.offsets = array.array("Q", [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, s):
+        data = s.encode("utf-8")
+        self.buf.frombytes(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        if len(self.buf) >= _CHUNK_SIZE:
+            self._flush()
+
+
+def _write_padded(f, data):
+    f.write(data)
+    f.write(bytes(_aligned(len(data)) - len(data)))
+
+
+class HitStore(object):
+    """Read-only mapping of query ID to a list of BlastHit objects.
+
+    Like the dict returned by read_blast, a query with no hits gives
+    an empty list.  Query IDs are found by binary search in the
+    mapped file, so opening a store takes the same time at any size.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        with open(fp, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+
+        (magic, version, byte_order, num_queries, num_hits, num_accessions,
+         num_runs, query_block_size, accession_block_size) = \
+            _HEADER.unpack_from(buf)
+        if magic != HIT_STORE_MAGIC:
+            raise ValueError("Not a hit store file: {0}".format(fp))
+        if version != HIT_STORE_VERSION:
+            raise ValueError(
+                "Unsupported hit store version: {0}.  Make the hit store "
+                "again with create_brocc_hit_store".format(version))
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(
+                "Hit store was built on a machine with a different "
+                "byte order: {0}".format(fp))
+
+        self.num_queries = num_queries
+        self.num_hits = num_hits
+        pos = _HEADER.size
+        self._query_run_offsets, pos = _cast(buf, pos, "Q", num_queries + 1)
+        self._run_starts, pos = _cast(buf, pos, "Q", num_runs)
+        self._run_ends, pos = _cast(buf, pos, "Q", num_runs)
+        self._accession_idxs, pos = _cast(buf, pos, "I", num_hits)
+        self._pct_ids, pos = _cast(buf, pos, "d", num_hits)
+        self._lengths, pos = _cast(buf, pos, "d", num_hits)
+        self._query_block_offsets, pos = _cast(
+            buf, pos, "Q", num_queries + 1)
+        self._sorted_query_idxs, pos = _cast(buf, pos, "Q", num_queries)
+        self._accession_block_offsets, pos = _cast(
+            buf, pos, "Q", num_accessions + 1)
+        # Strings are sliced from the mmap, which gives bytes
+        self._query_block_pos = pos
+        pos += _aligned(query_block_size)
+        self._accession_block_pos = pos
+
+    def __len__(self):
+        return self.num_queries
+
+    def __iter__(self):
+        for idx in range(self.num_queries):
+            yield self._get_query_id(idx).decode("utf-8")
+
+    def __contains__(self, query_id):
+        return self._find_query(query_id) is not None
+
+    def __getitem__(self, query_id):
+        idx = self._find_query(query_id)
+        if idx is None:
+            return []
+        hits = []
+        for run in range(
+                self._query_run_offsets[idx],
+                self._query_run_offsets[idx + 1]):
+            start = self._run_starts[run]
+            end = self._run_ends[run]
+            accessions = self._get_accessions(
+                self._accession_idxs[start:end].tolist())
+            hits.extend(map(
+                BlastHit, accessions, self._pct_ids[start:end].tolist(),
+                self._lengths[start:end].tolist()))
+        return hits
+
+    def _get_query_id(self, idx):
+        start = self._query_block_pos + self._query_block_offsets[idx]
+        end = self._query_block_pos + self._query_block_offsets[idx + 1]
+        return self._mmap[start:end]
+
+    def _find_query(self, query_id):
+        key = query_id.encode("utf-8")
+        lo = 0
+        hi = self.num_queries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            idx = self._sorted_query_idxs[mid]
+            if self._get_query_id(idx) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_queries:
+            idx = self._sorted_query_idxs[lo]
+            if self._get_query_id(idx) == key:
+                return idx
+        return None
+
+    def _get_accessions(self, accession_idxs):
+        # Accessions are decoded each time they are needed, so that
+        # nothing is kept in memory for the accessions in the store.
+        block = self._mmap
+        offsets = self._accession_block_offsets
+        pos = self._accession_block_pos
+        return [
+            block[pos + offsets[i]:pos + offsets[i + 1]].decode("utf-8")
+            for i in accession_idxs]
+
+
+def _cast(buf, pos, fmt, n):
+    size = struct.calcsize(fmt) * n
+    return buf[pos:pos + size].cast(fmt), pos + _aligned(size)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=(
+            "Convert BLAST tabular output to a hit store, which brocc "
+            "reads without parsing any text"))
+    p.add_argument("blast_fp", help="BLAST output file")
+    p.add_argument(
+        "-o", "--output_fp",
+        help="output file (default: BLAST file with .hits extension)")
+    args = p.parse_args(argv)
+
+    output_fp = args.output_fp
+    if output_fp is None:
+        output_fp = os.path.splitext(args.blast_fp)[0] + HIT_STORE_EXT
+    if os.path.abspath(output_fp) == os.path.abspath(args.blast_fp):
+        p.error("Output file would overwrite the BLAST file")
+
+    with open(args.blast_fp, "rb") as f:
+        write_hit_store(output_fp, iter_blast(f))
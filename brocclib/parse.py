@@ -1,4 +1,5 @@
 from collections import defaultdict
+import itertools
 
 '''
 Created on Aug 29, 2011
@@ -22,6 +23,8 @@ def iter_fasta(fasta_lines):
 
 
 class BlastHit(object):
+    __slots__ = ("accession", "pct_id", "length")
+
     def __init__(self, accession, pct_id, length):
         self.accession = accession
         self.pct_id = pct_id
@@ -31,26 +34,95 @@ class BlastHit(object):
         return self.length / len(query_seq)
 
 
+# BLAST output files are read in blocks of about this many bytes
+BLAST_BLOCK_SIZE = 4 * 1024 * 1024
+# Lines are parsed in batches of this size if given as an iterable
+BLAST_BATCH_SIZE = 10000
+
+
 def iter_blast(blast_lines):
+    """Yield (query_id, hit) pairs from a BLAST tabular output file.
+
+    If blast_lines is a file object, it is read in large blocks,
+    rather than line by line.  Binary files are decoded as UTF-8.
+    Otherwise, blast_lines can be any iterable of lines.  Only the
+    first four columns are used: query ID, subject ID, percent
+    identity, and alignment length.
+    """
+    if hasattr(blast_lines, "read"):
+        batches = (block.split("\n") for block in _iter_blocks(blast_lines))
+    else:
+        batches = _iter_batches(blast_lines, BLAST_BATCH_SIZE)
+
     full_query_id = None
-    for line in blast_lines:
-        if line.startswith('# Query:'):
-            full_query_id = line[8:].strip()
-        if not line.startswith("#"):
-            vals = [x.strip() for x in line.split('\t')]
+    for lines in batches:
+        query_ids = []
+        descs = []
+        pct_ids = []
+        lengths = []
+        for line in lines:
+            if not line:
+                continue
+            if line[0] == "#":
+                if line.startswith("# Query:"):
+                    full_query_id = line[8:].strip()
+                continue
+            vals = line.split("\t", 4)
             # If this is a commented BLAST file, we'd like to use the
             # complete query ID as a convenience.  If not available,
             # we use the first word in the query ID, which is found
             # in the first column of each output row.
             if full_query_id is None:
-                query_id = vals[0]
+                query_ids.append(vals[0].strip())
             else:
-                query_id = full_query_id
-            accession = parse_accession(vals[1])
-            pct_id = float(vals[2])
-            length = float(vals[3])
-            hit = BlastHit(accession, pct_id, length)
-            yield query_id, hit
+                query_ids.append(full_query_id)
+            descs.append(vals[1].strip())
+            pct_ids.append(vals[2])
+            lengths.append(vals[3])
+        # Numbers are converted a whole batch at a time.  float()
+        # ignores the whitespace around each value.
+        hits = zip(
+            query_ids, map(parse_accession, descs), map(float, pct_ids),
+            map(float, lengths))
+        for query_id, accession, pct_id, length in hits:
+            yield query_id, BlastHit(accession, pct_id, length)
+
+
+def _iter_blocks(f, block_size=BLAST_BLOCK_SIZE):
+    # Each block ends at a line break, so that no line is split
+    # between blocks.  For binary files, this also means that no
+    # character is split between blocks.
+    rest = None
+    while True:
+        data = f.read(block_size)
+        if not data:
+            if rest:
+                yield _decode(rest)
+            return
+        if rest:
+            data = rest + data
+        newline = b"\n" if isinstance(data, bytes) else "\n"
+        end = data.rfind(newline) + 1
+        if end == 0:
+            rest = data
+            continue
+        rest = data[end:]
+        yield _decode(data[:end])
+
+
+def _decode(data):
+    if isinstance(data, bytes):
+        return data.decode("utf-8")
+    return data
+
+
+def _iter_batches(xs, n):
+    xs = iter(xs)
+    while True:
+        batch = list(itertools.islice(xs, n))
+        if not batch:
+            return
+        yield batch
 
 
 def read_blast(blast_lines):
@@ -60,6 +132,63 @@ def read_blast(blast_lines):
         res[query_id].append(hit)
     return res
 
+def iter_blast_queries(blast_lines):
+    """Yield (query_id, hits) for each query in a BLAST output file.
+
+    BLAST writes all the hits for a query together, so only the hits
+    for one query are held in memory at a time.
+    """
+    grouped_hits = itertools.groupby(iter_blast(blast_lines), lambda x: x[0])
+    for query_id, query_hits in grouped_hits:
+        yield query_id, [hit for _, hit in query_hits]
+
+
+def iter_query_hits(fasta_lines, blast_lines):
+    """Yield (name, seq, hits) for each sequence in a FASTA file.
+
+    The FASTA and BLAST files are read together, one query at a time.
+    The queries must appear in the same order in both files, as they
+    do when the FASTA file was given to BLAST as input.  Sequences
+    with no BLAST hits are yielded with an empty list of hits.
+
+    Sequences with no hits are held back until the next query in the
+    BLAST file is found in the FASTA file.  If that query was already
+    passed over, or is not in the FASTA file at all, the files are out
+    of order, and a ValueError is raised before anything after the
+    last matching query is yielded.  Only the names of past queries
+    are kept.
+    """
+    blast_queries = iter_blast_queries(blast_lines)
+    seen = set()
+    no_hits = []
+    next_query = next(blast_queries, None)
+    for name, seq in iter_fasta(fasta_lines):
+        if next_query is None:
+            yield name, seq, []
+            continue
+        seen.add(name)
+        if next_query[0] != name:
+            no_hits.append((name, seq))
+            continue
+        hits = next_query[1]
+        next_query = next(blast_queries, None)
+        if (next_query is not None) and (next_query[0] in seen):
+            _raise_out_of_order(next_query[0])
+        for no_hits_name, no_hits_seq in no_hits:
+            yield no_hits_name, no_hits_seq, []
+        no_hits = []
+        yield name, seq, hits
+    if next_query is not None:
+        _raise_out_of_order(next_query[0])
+
+
+def _raise_out_of_order(query_id):
+    raise ValueError(
+        "BLAST hits for query {0} do not match the next sequence in "
+        "the FASTA file. The FASTA and BLAST files must list queries "
+        "in the same order.".format(query_id))
+
+
 def parse_accession(desc):
     if "|" in desc:
         # Old format
@@ -67,3 +196,9 @@ def parse_accession(desc):
     else:
         # New format
         return desc
+
+def unversion(acc):
+    if "." in acc:
+        return acc.rpartition(".")[0]
+    else:
+        return acc
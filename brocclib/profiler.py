@@ -0,0 +1,156 @@
+"""Timings and counts for the stages of a brocc run.
+
+A Profiler is only made if profiling is turned on.  Otherwise nothing
+is wrapped or timed, and the run takes the same code path as before.
+The stages are:
+
+* parse: reading the FASTA and BLAST files,
+* taxon_ids: looking up the taxon ID of each accession,
+* lineages: looking up the lineage of each taxon ID,
+* vote: the rest of the time spent assigning queries, and
+* output: writing the output files.
+
+With more than one process, the taxon_ids, lineages, and vote times
+are added up over the worker processes, so they can be larger than
+the total wall time.
+"""
+
+import collections
+import json
+import os
+import time
+
+PROFILE_FILENAME = "brocc_profile.json"
+
+
+class Profiler(object):
+    def __init__(self):
+        self.times = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.start_time = time.perf_counter()
+        self.taxa_db = None
+        self.worker_stats = {}
+
+    def add_time(self, stage, seconds):
+        self.times[stage] += seconds
+
+    def timed(self, stage, fn):
+        """Wrap a function so that its calls are timed and counted."""
+        def timed_fn(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.times[stage] += time.perf_counter() - start
+                self.calls[stage] += 1
+        return timed_fn
+
+    def timed_iter(self, stage, xs):
+        """Yield from xs, timing how long each item takes to produce."""
+        xs = iter(xs)
+        while True:
+            start = time.perf_counter()
+            try:
+                x = next(xs)
+            except StopIteration:
+                return
+            finally:
+                self.times[stage] += time.perf_counter() - start
+            yield x
+
+    def wrap_taxa_db(self, taxa_db):
+        self.taxa_db = taxa_db
+        return _TimedTaxaDb(taxa_db, self)
+
+    def snapshot(self, assigner=None):
+        """Timings and counts so far, as nested dicts of numbers.
+
+        In the main process of a parallel run, there is no assigner,
+        and only the timings are taken.
+        """
+        counts = {
+            "queries": self.calls["assign"],
+            "taxon_id_lookups": self.calls["taxon_ids"],
+            "lineage_lookups": self.calls["lineages"],
+            }
+        if assigner is not None:
+            counts.update(assigner.filter_stats())
+        if self.taxa_db is not None:
+            for key, value in self.taxa_db.stats().items():
+                if not key.endswith("_cache"):
+                    counts[key] = value
+        return {
+            "times": dict(self.times),
+            "counts": counts,
+            "caches": cache_stats(self.taxa_db, assigner),
+            }
+
+    def add_worker_stats(self, worker_id, stats):
+        # Workers send their running totals, so we keep the latest.
+        self.worker_stats[worker_id] = stats
+
+    def report(self, assigner=None, processes=1):
+        stats = self.snapshot(assigner)
+        for worker_stats in self.worker_stats.values():
+            stats = add_stats(stats, worker_stats)
+        times = collections.defaultdict(float, stats["times"])
+        stages = collections.OrderedDict([
+            ("parse", times["parse"]),
+            ("taxon_ids", times["taxon_ids"]),
+            ("lineages", times["lineages"]),
+            ("vote", times["assign"] - times["taxon_ids"] - times["lineages"]),
+            ("output", times["output"]),
+            ])
+        return collections.OrderedDict([
+            ("processes", processes),
+            ("wall_time", time.perf_counter() - self.start_time),
+            ("stages", stages),
+            ("counts", stats["counts"]),
+            ("caches", stats["caches"]),
+            ])
+
+    def write_report(self, output_dir, assigner=None, processes=1):
+        fp = os.path.join(output_dir, PROFILE_FILENAME)
+        with open(fp, "w") as f:
+            json.dump(self.report(assigner, processes), f, indent=2)
+            f.write("\n")
+        return fp
+
+
+def cache_stats(taxa_db, assigner):
+    """Statistics for the caches of a taxonomy database and an Assigner."""
+    caches = {}
+    if assigner is not None:
+        caches["lineage_object_cache"] = assigner.lineage_cache.stats()
+        if assigner.assignment_cache.maxsize != 0:
+            caches["assignment_cache"] = assigner.assignment_cache.stats()
+    if taxa_db is not None:
+        for key, value in taxa_db.stats().items():
+            if key.endswith("_cache"):
+                caches[key] = value
+    return caches
+
+
+class _TimedTaxaDb(object):
+    """Times the batch lookups made by an Assigner."""
+    def __init__(self, taxa_db, profiler):
+        self.get_taxon_ids = profiler.timed("taxon_ids", taxa_db.get_taxon_ids)
+        self.get_lineages = profiler.timed("lineages", taxa_db.get_lineages)
+
+
+def add_stats(x, y):
+    """Add up the numbers in two nested dicts of statistics.
+
+    A maxsize of None, for an unbounded cache, stays None.
+    """
+    result = dict(x)
+    for key, value in y.items():
+        if key not in result:
+            result[key] = value
+        elif isinstance(value, dict):
+            result[key] = add_stats(result[key], value)
+        elif (value is None) or (result[key] is None):
+            result[key] = None
+        else:
+            result[key] += value
+    return result
@@ -0,0 +1,321 @@
+"""Synthetic taxonomy and BLAST results, for scaling tests.
+
+The taxonomy is written in the same format as the NCBI downloads:
+an accession2taxid file and a taxdump archive with names.dmp and
+nodes.dmp.  The files have the same names as the NCBI files, so the
+output directory can be given to create_local_taxonomy_db with
+--download_dir.  A FASTA file of queries and a BLAST tabular file
+with their hits are written alongside.
+
+Every level of the tree has more taxa than the one above, growing
+geometrically up to the number of species.  Taxa are given to
+parents at random, so some parents have many more children than
+others.  Extra levels of unranked taxa can be added between the
+standard ranks, to make longer lineages like the ones in the real
+taxonomy.  Taxa are numbered so that the species under any taxon are
+next to each other.
+
+Each query belongs to a species, and most of its hits are to that
+species or its near relatives, with lower identity for more distant
+relatives.  Some queries come from species missing from the
+database, with no hits to their own species.  Some species are
+generic, under an "environmental samples" taxon, as in the NCBI
+taxonomy.
+"""
+
+import argparse
+import gzip
+import io
+import os
+import random
+import tarfile
+
+from brocclib.taxonomy_db import ACCESSION_URL, TAXDUMP_URL
+
+STANDARD_RANKS = [
+    "domain", "kingdom", "phylum", "class",
+    "order", "family", "genus", "species",
+    ]
+# Rank of the taxa added to make lineages longer
+EXTRA_RANK = "clade"
+
+# Chance of a hit to a species that shares the query's species, genus,
+# family, or order.  The rest of the hits are to any species.
+HIT_LEVEL_WEIGHTS = [0.5, 0.25, 0.12, 0.06, 0.07]
+# Some queries are from species that are not in the database, so none
+# of their hits are to the same species.
+NOVEL_QUERY_FRACTION = 0.3
+NOVEL_HIT_LEVEL_WEIGHTS = [0.0, 0.5, 0.25, 0.12, 0.13]
+# Range of percent identity for hits at each of the levels above
+HIT_LEVEL_PCT_IDS = [
+    (97.0, 100.0), (93.0, 99.0), (88.0, 96.0), (84.0, 93.0), (80.0, 90.0)]
+# Fraction of hits with low coverage, which brocc filters out
+LOW_COVERAGE_FRACTION = 0.05
+# Fraction of species that are generic, like "uncultured Genus 7".  As
+# in the NCBI taxonomy, these are put under "environmental samples".
+GENERIC_FRACTION = 0.05
+
+_DNA = bytes(b"ACGT"[i % 4] for i in range(256))
+
+
+class SyntheticTaxonomy(object):
+    """A made-up taxonomy with accessions for every species.
+
+    Nodes are (taxon ID, parent ID, name, rank), with the root as
+    taxon 1.  For each standard rank, rank_ranges[rank][i] gives the
+    first and last-plus-one species under the i-th taxon of that rank.
+    """
+    def __init__(self, num_species, lineage_depth=len(STANDARD_RANKS),
+                 accessions_per_species=5, seed=0):
+        if lineage_depth < len(STANDARD_RANKS):
+            raise ValueError(
+                "Lineage depth must be at least {0}".format(
+                    len(STANDARD_RANKS)))
+        if num_species < 1:
+            raise ValueError("Number of species must be at least 1")
+        rng = random.Random(seed)
+        self.num_species = num_species
+        self.nodes = [(1, 1, "root", "no rank")]
+        self.rank_ranges = {}
+
+        # Number of taxa at each standard rank
+        num_levels = len(STANDARD_RANKS)
+        sizes = [
+            max(1, int(round(num_species ** ((k + 1) / num_levels))))
+            for k in range(num_levels)]
+        sizes[-1] = num_species
+        for k in range(1, num_levels):
+            sizes[k] = max(sizes[k], sizes[k - 1])
+
+        # Extra levels go after randomly chosen ranks, but never after
+        # species.
+        num_extra = lineage_depth - num_levels
+        extra_after = [0] * num_levels
+        for _ in range(num_extra):
+            extra_after[rng.randrange(num_levels - 1)] += 1
+
+        parent_ids = [1]
+        parent_names = [""]
+        child_counts = []
+        for k, rank in enumerate(STANDARD_RANKS):
+            # Every parent gets at least one child
+            counts = [1] * len(parent_ids)
+            for _ in range(sizes[k] - len(parent_ids)):
+                counts[rng.randrange(len(parent_ids))] += 1
+            child_counts.append(counts)
+            taxon_ids = []
+            names = []
+            for parent_id, parent_name, count in zip(
+                    parent_ids, parent_names, counts):
+                generic_parent_id = None
+                for j in range(count):
+                    node_parent_id = parent_id
+                    if rank != "species":
+                        name = "{0} {1}".format(
+                            rank.capitalize(), len(names) + 1)
+                    elif rng.random() < GENERIC_FRACTION:
+                        if generic_parent_id is None:
+                            generic_parent_id = self._add_node(
+                                parent_id, "environmental samples",
+                                "no rank")
+                        node_parent_id = generic_parent_id
+                        name = "uncultured {0} sp{1}".format(parent_name, j)
+                    else:
+                        name = "{0} sp{1}".format(parent_name, j)
+                    taxon_ids.append(
+                        self._add_node(node_parent_id, name, rank))
+                    names.append(name)
+            for n in range(extra_after[k]):
+                taxon_ids = [
+                    self._add_node(
+                        taxon_id, "{0} clade{1}".format(name, n + 1),
+                        EXTRA_RANK)
+                    for taxon_id, name in zip(taxon_ids, names)]
+            parent_ids = taxon_ids
+            parent_names = names
+        self.species_ids = parent_ids
+
+        # The species under each taxon are next to each other, so we
+        # can work out their range from the number of children.
+        ranges = [(i, i + 1) for i in range(num_species)]
+        for k in reversed(range(num_levels)):
+            self.rank_ranges[STANDARD_RANKS[k]] = ranges
+            if k == 0:
+                break
+            parent_ranges = []
+            child_idx = 0
+            for count in child_counts[k]:
+                start = ranges[child_idx][0]
+                child_idx += count
+                parent_ranges.append((start, ranges[child_idx - 1][1]))
+            ranges = parent_ranges
+        # Index of the taxon at each rank for every species
+        self.species_taxa = {}
+        for rank, ranges in self.rank_ranges.items():
+            idxs = [0] * num_species
+            for idx, (start, end) in enumerate(ranges):
+                idxs[start:end] = [idx] * (end - start)
+            self.species_taxa[rank] = idxs
+
+        self.accessions = []
+        num_accessions = 0
+        for _ in range(num_species):
+            n = rng.randint(1, 2 * accessions_per_species - 1)
+            self.accessions.append([
+                "SY{0:09d}".format(num_accessions + i) for i in range(n)])
+            num_accessions += n
+
+    def _add_node(self, parent_id, name, rank):
+        taxon_id = len(self.nodes) + 1
+        self.nodes.append((taxon_id, parent_id, name, rank))
+        return taxon_id
+
+    def species_range(self, species_idx, rank):
+        """Range of species that share the taxon at this rank.
+
+        If rank is None, the range covers all species.
+        """
+        if rank is None:
+            return 0, self.num_species
+        taxon_idx = self.species_taxa[rank][species_idx]
+        return self.rank_ranges[rank][taxon_idx]
+
+    def write_taxdump(self, fp):
+        """Write names.dmp and nodes.dmp to a gzipped tar archive."""
+        # The dump files are built in memory, so that nothing is
+        # written beside the archive.
+        names_dmp = "".join(
+            "{0}\t|\t{1}\t|\t\t|\tscientific name\t|\n".format(
+                taxon_id, name)
+            for taxon_id, _, name, _ in self.nodes)
+        nodes_dmp = "".join(
+            "{0}\t|\t{1}\t|\t{2}\t|\t\t|\t0\t|\t1\t|\t1\t|\t1\t|\t"
+            "1\t|\t1\t|\t0\t|\t0\t|\t\t|\n".format(
+                taxon_id, parent_id, rank)
+            for taxon_id, parent_id, _, rank in self.nodes)
+        # The taxonomy has no merged or deleted taxa
+        with tarfile.open(fp, "w:gz", compresslevel=1) as tar:
+            for filename, text in [
+                    ("names.dmp", names_dmp), ("nodes.dmp", nodes_dmp),
+                    ("merged.dmp", ""), ("delnodes.dmp", "")]:
+                data = text.encode("utf-8")
+                info = tarfile.TarInfo(filename)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    def write_accessions(self, fp):
+        """Write a gzipped accession2taxid file."""
+        with gzip.open(fp, "wt", compresslevel=1) as f:
+            f.write("accession\taccession.version\ttaxid\tgi\n")
+            for taxon_id, accessions in zip(
+                    self.species_ids, self.accessions):
+                for acc in accessions:
+                    f.write("{0}\t{0}.1\t{1}\t{2}\n".format(
+                        acc, taxon_id, int(acc[2:]) + 1))
+
+
+def write_queries(taxonomy, fasta_file, blast_file, num_queries,
+                  hits_per_query, query_length=250, seed=0):
+    """Write queries and their BLAST hits, in tabular format."""
+    rng = random.Random(seed)
+    # Random numbers are scaled by hand, rather than with randrange,
+    # which is several times slower.
+    rand = rng.random
+    hit_ranks = ["species", "genus", "family", "order", None]
+    low_coverage_lengths = (query_length // 10, query_length // 2)
+    lengths = (query_length * 9 // 10, query_length)
+    for q in range(num_queries):
+        query_id = "query{0}".format(q + 1)
+        seq = rng.randbytes(query_length).translate(_DNA).decode("ascii")
+        fasta_file.write(">{0}\n{1}\n".format(query_id, seq))
+
+        species_idx = rng.randrange(taxonomy.num_species)
+        if rng.random() < NOVEL_QUERY_FRACTION:
+            weights = NOVEL_HIT_LEVEL_WEIGHTS
+        else:
+            weights = HIT_LEVEL_WEIGHTS
+        levels = rng.choices(range(len(hit_ranks)), weights, k=hits_per_query)
+        level_ranges = [
+            taxonomy.species_range(species_idx, rank) for rank in hit_ranks]
+        hits = []
+        for level in levels:
+            start, end = level_ranges[level]
+            accessions = taxonomy.accessions[
+                start + int(rand() * (end - start))]
+            accession = accessions[int(rand() * len(accessions))]
+            low, high = HIT_LEVEL_PCT_IDS[level]
+            pct_id = low + (high - low) * rand()
+            if rand() < LOW_COVERAGE_FRACTION:
+                low, high = low_coverage_lengths
+            else:
+                low, high = lengths
+            length = low + int(rand() * (high - low + 1))
+            hits.append((pct_id, accession, length))
+        # BLAST lists the best hits first
+        hits.sort(reverse=True)
+        lines = []
+        for pct_id, accession, length in hits:
+            mismatches = int(length * (100.0 - pct_id) / 100.0)
+            lines.append(
+                "{0}\t{1}.1\t{2:.2f}\t{3}\t{4}\t0\t1\t{3}\t1\t{3}\t"
+                "1e-50\t{5}\n".format(
+                    query_id, accession, pct_id, length, mismatches,
+                    2 * (length - mismatches)))
+        blast_file.write("".join(lines))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description=(
+            "Write a synthetic taxonomy, in the format of the NCBI "
+            "downloads, with queries and BLAST hits for scaling tests"))
+    p.add_argument("output_dir", help="output directory")
+    p.add_argument(
+        "--species", type=int, default=100000,
+        help="number of species in the taxonomy (default: %(default)s)")
+    p.add_argument(
+        "--accessions_per_species", type=int, default=5,
+        help="average number of accessions per species (default: %(default)s)")
+    p.add_argument(
+        "--lineage_depth", type=int, default=len(STANDARD_RANKS),
+        help=(
+            "number of taxa in each lineage, below the root.  Levels "
+            "beyond the {0} standard ranks are filled with unranked "
+            "taxa (default: %(default)s)".format(len(STANDARD_RANKS))))
+    p.add_argument(
+        "--queries", type=int, default=10000,
+        help="number of queries (default: %(default)s)")
+    p.add_argument(
+        "--hits_per_query", type=int, default=100,
+        help="number of BLAST hits for each query (default: %(default)s)")
+    p.add_argument(
+        "--query_length", type=int, default=250,
+        help="length of each query sequence (default: %(default)s)")
+    p.add_argument(
+        "--seed", type=int, default=0,
+        help="seed for the random number generator (default: %(default)s)")
+    args = p.parse_args(argv)
+    if args.accessions_per_species < 1:
+        p.error("--accessions_per_species must be at least 1")
+    if args.query_length < 10:
+        p.error("--query_length must be at least 10")
+
+    try:
+        taxonomy = SyntheticTaxonomy(
+            args.species, args.lineage_depth, args.accessions_per_species,
+            args.seed)
+    except ValueError as e:
+        p.error(str(e))
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    taxonomy.write_taxdump(
+        os.path.join(args.output_dir, os.path.basename(TAXDUMP_URL)))
+    taxonomy.write_accessions(
+        os.path.join(args.output_dir, os.path.basename(ACCESSION_URL)))
+    fasta_fp = os.path.join(args.output_dir, "synthetic.fasta")
+    blast_fp = os.path.join(args.output_dir, "synthetic_blast.txt")
+    with open(fasta_fp, "w") as f_fasta, open(blast_fp, "w") as f_blast:
+        write_queries(
+            taxonomy, f_fasta, f_blast, args.queries, args.hits_per_query,
+            args.query_length, args.seed)
@@ -4,6 +4,10 @@ Created on Aug 29, 2011
 '''
 
 class NoLineage(object):
+    __slots__ = ()
+    slot_taxa = (None,) * 8
+    slot_generic = (False,) * 8
+
     def get_taxon(self, rank):
         return None
 
@@ -16,30 +20,55 @@ class Lineage(object):
     standard_rank_idx = dict(
         (rank, idx) for idx, rank in enumerate(ranks))
 
+    # The taxon and generic flag at each standard rank, in the same
+    # order as the ranks above.
+    __slots__ = ("_taxa", "slot_taxa", "slot_generic")
+
     def __init__(self, taxa):
         # Internally, taxa are stored using an integer to represent
         # the rank. This helps when comparing ranks to see which is
         # higher or lower
         self._taxa = [
             (name, self.standard_rank_idx.get(rank)) for name, rank in taxa]
+        self.slot_taxa, self.slot_generic = self._fill_slots(self._taxa)
 
-    def get_taxon(self, rank):
-        rank_idx = self.ranks.index(rank)
-        for name, idx in self._taxa:
+    @classmethod
+    def _fill_slots(cls, taxa):
+        # Work out the taxon and generic flag at every standard rank in
+        # one pass, so that lookups are a simple index.  The taxon at a
+        # rank comes from the first standard taxon at that rank or
+        # below it.  If that taxon is from a lower rank, we make a
+        # placeholder name, e.g. "Candida (family)".  The rank is
+        # generic if a generic name is found before that taxon.
+        num_ranks = len(cls.ranks)
+        slot_taxa = [None] * num_ranks
+        slot_generic = [False] * num_ranks
+        num_filled = 0
+        seen_generic = False
+        for name, idx in taxa:
             if idx is None:
+                if cls.is_generic_name(name):
+                    seen_generic = True
                 continue
-            elif idx == rank_idx:
-                return name
-            elif idx > rank_idx:
-                return "{0} ({1})".format(name, rank)
-        return None
+            for rank_idx in range(num_filled, idx + 1):
+                if rank_idx == idx:
+                    slot_taxa[rank_idx] = name
+                else:
+                    slot_taxa[rank_idx] = "{0} ({1})".format(
+                        name, cls.ranks[rank_idx])
+                slot_generic[rank_idx] = seen_generic
+            num_filled = max(num_filled, idx + 1)
+        for rank_idx in range(num_filled, num_ranks):
+            slot_generic[rank_idx] = seen_generic
+        # The top rank is never generic
+        slot_generic[0] = False
+        return tuple(slot_taxa), tuple(slot_generic)
+
+    def get_taxon(self, rank):
+        return self.slot_taxa[self._rank_slot(rank)]
 
     def get_standard_taxa(self, rank):
-        rank_idx = self.ranks.index(rank)
-        slice_idx = rank_idx + 1
-        ranks_up_to = self.ranks[:slice_idx]
-        for r in ranks_up_to:
-            yield self.get_taxon(r)
+        return iter(self.slot_taxa[:self._rank_slot(rank) + 1])
 
     @staticmethod
     def is_generic_name(name):
@@ -47,15 +76,10 @@ class Lineage(object):
             name.startswith("unclassified")
 
     def is_generic(self, rank):
-        rank_idx = self.ranks.index(rank)
-        last_idx = 0
-        for name, idx in self._taxa:
-            if idx is None:
-                if self.is_generic_name(name):
-                    if last_idx < rank_idx:
-                        return True
-            else:
-                if idx >= rank_idx:
-                    return False
-                last_idx = idx
-        return False
+        return self.slot_generic[self._rank_slot(rank)]
+
+    def _rank_slot(self, rank):
+        try:
+            return self.standard_rank_idx[rank]
+        except KeyError:
+            raise ValueError("Not a standard rank: {0}".format(rank))
@@ -1,6 +1,11 @@
 import argparse
+import collections
+import datetime
 import gzip
+import io
 import itertools
+import logging
+import multiprocessing
 import optparse
 import os
 import shutil
@@ -9,6 +14,14 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import time
+
+from brocclib.accession_index import (
+    accession_index_fp, write_accession_index,
+    )
+from brocclib.cache import LruCache
+from brocclib.parse import unversion
+from brocclib.taxonomy_tree import taxonomy_tree_fp, write_taxonomy_tree
 
 ACCESSION_URL = "ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/accession2taxid/nucl_gb.accession2taxid.gz"
 TAXDUMP_URL = "ftp://ftp.ncbi.nlm.nih.gov/pub/taxonomy/taxdump.tar.gz"
@@ -17,19 +30,36 @@ CONFIG_DIR = os.path.expanduser("~/.brocc")
 TAXONOMY_DB_FILENAME = "taxonomy.db"
 TAXONOMY_DB_FP = os.path.join(CONFIG_DIR, TAXONOMY_DB_FILENAME)
 
+# Default cache size for NcbiLocal.  A cached taxon ID takes about a
+# hundred bytes.
+TAXON_ID_CACHE_SIZE = 100000
+
+_NOT_CACHED = object()
+
+# The accession file is parsed in blocks of about this many characters
+ACCESSION_BLOCK_SIZE = 16 * 1024 * 1024
+
 def _parse_names(f):
     for rec in _parse_ncbi_table(f):
         taxid, name, _, name_class = rec
         if name_class == "scientific name":
-            yield taxid, name
+            yield int(taxid), name
 
 def _parse_nodes(f):
     for rec in _parse_ncbi_table(f):
-        taxid = rec[0]
-        parent = rec[1]
+        taxid = int(rec[0])
+        parent = int(rec[1])
         rank = rec[2]
         yield taxid, parent, rank
 
+def _parse_merged(f):
+    for rec in _parse_ncbi_table(f):
+        yield int(rec[0]), int(rec[1])
+
+def _parse_delnodes(f):
+    for rec in _parse_ncbi_table(f):
+        yield (int(rec[0]),)
+
 def _parse_ncbi_table(f):
     for line in f:
         yield line.rstrip("\t|\n").split("\t|\t")
@@ -42,27 +72,75 @@ def parse_names_and_nodes(names_file, nodes_file):
             name = "<no name ({0})>".format(taxid)
         yield taxid, parent, name, rank
 
-def parse_accessions(f):
+def parse_accessions(f, processes=1, block_size=ACCESSION_BLOCK_SIZE):
+    """Yield (accession, taxid) records from an accession2taxid file.
+
+    The file is read in blocks of whole lines, which are parsed in a
+    pool of worker processes if processes is more than one.  Records
+    come out sorted within each block.
+    """
     # Skip the header
     next(f)
-    for line in f:
+    blocks = _iter_line_blocks(f, block_size)
+    if processes == 1:
+        batches = map(_parse_accession_block, blocks)
+    else:
+        batches = _map_parallel(_parse_accession_block, blocks, processes)
+    for batch in batches:
+        for rec in batch:
+            yield rec
+
+def _parse_accession_block(block):
+    recs = []
+    for line in block.splitlines():
         vals = line.rstrip().split("\t")
         unversioned_accession = vals[0]
-        taxid = vals[2]
-        yield unversioned_accession, taxid
+        taxid = int(vals[2])
+        recs.append((unversioned_accession, taxid))
+    recs.sort()
+    return recs
+
+def _iter_line_blocks(f, block_size):
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return
+        # Finish the last line, so that no line is split between blocks
+        if not block.endswith("\n"):
+            block += f.readline()
+        yield block
+
+def _map_parallel(func, xs, processes):
+    # Like Pool.imap, but only a few items per process are read ahead,
+    # so that memory use stays bounded for large files.
+    max_pending = 2 * processes
+    pending = collections.deque()
+    with multiprocessing.Pool(processes) as pool:
+        for x in xs:
+            pending.append(pool.apply_async(func, (x,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
 
 def prepare_download_dir(user_download_dir):
     if user_download_dir is None:
         return tempfile.mkdtemp(), True
     else:
-        download_dir = args.download_dir
+        download_dir = user_download_dir
         if not os.path.exists(download_dir):
             os.mkdir(download_dir)
         return download_dir, False
 
 def prepare_database_dir(user_database_fp):
-    if os.path.exists(user_database_fp):
-        os.remove(user_database_fp)
+    # Files derived from an old database would be out of date
+    derived_fps = [
+        taxonomy_tree_fp(user_database_fp),
+        accession_index_fp(user_database_fp),
+        ]
+    for fp in [user_database_fp] + derived_fps:
+        if os.path.exists(fp):
+            os.remove(fp)
     database_dir = os.path.dirname(user_database_fp)
     database_dir_is_default = database_dir == CONFIG_DIR
     if database_dir_is_default and (not os.path.exists(CONFIG_DIR)):
@@ -76,92 +154,306 @@ def main(argv=None):
     p.add_argument(
         "--database_fp", default=TAXONOMY_DB_FP,
         help="filepath for sqlite3 database (default: %(default)s)")
+    p.add_argument(
+        "--update", action="store_true",
+        help=(
+            "rebuild an existing database only if NCBI has newer files, "
+            "keeping its precomputed lineages, tree file, and accession "
+            "index"))
+    p.add_argument(
+        "--processes", type=int, default=os.cpu_count() or 1,
+        help=(
+            "number of processes used to parse the accession file "
+            "(default: number of CPUs)"))
+    p.add_argument(
+        "--lineages", action="store_true",
+        help=(
+            "precompute the lineage of every taxon, for faster lookups "
+            "at the cost of a larger database"))
+    p.add_argument(
+        "--tree", action="store_true",
+        help=(
+            "also write a memory-mapped copy of the taxonomy tree next to "
+            "the database, for the fastest lineage lookups"))
+    p.add_argument(
+        "--accession_index", action="store_true",
+        help=(
+            "also write a sorted, memory-mapped index of accessions next "
+            "to the database, for the fastest taxon ID lookups"))
     args = p.parse_args(argv)
+    if args.processes < 1:
+        p.error("--processes must be at least 1")
+
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
 
     database_fp = os.path.expanduser(args.database_fp)
     download_dir, remove_download_dir = prepare_download_dir(args.download_dir)
-    accession_fp = download_accessions(download_dir)
-    names_fp, nodes_fp = download_nodes(download_dir)
+    # On an update, files left in the download directory by an earlier
+    # run are checked against the server.
+    update = args.update and os.path.exists(database_fp)
+    accession_fp = download_accessions(download_dir, update)
+    taxdump_fp = download_nodes(download_dir, update)
+    version = download_version(accession_fp, taxdump_fp)
+
+    if update and (get_db_version(database_fp) == version):
+        logging.info("Database is up to date: %s", version)
+        changed = False
+    else:
+        changed = True
+    # Files derived from the database are refreshed after an update
+    refresh_derived = update and changed
+
+    if changed:
+        # Precomputed lineages are kept in an updated database
+        lineages = args.lineages or (update and _has_lineages(database_fp))
+        if not update:
+            prepare_database_dir(database_fp)
+        build_db(
+            database_fp, accession_fp, taxdump_fp, version, args.processes,
+            lineages)
+    elif args.lineages:
+        init_lineages(database_fp)
 
-    with open(accession_fp) as f_acc, \
-         open(names_fp) as f_names, \
-         open(nodes_fp) as f_nodes:
-        accessions = parse_accessions(f_acc)
-        nodes = parse_names_and_nodes(f_names, f_nodes)
-        prepare_database_dir(database_fp)
-        init_db(database_fp, download_dir, accessions, nodes)
+    tree_fp = taxonomy_tree_fp(database_fp)
+    if args.tree or (refresh_derived and os.path.exists(tree_fp)):
+        init_tree(database_fp)
+
+    index_fp = accession_index_fp(database_fp)
+    if args.accession_index or (refresh_derived and os.path.exists(index_fp)):
+        init_accession_index(database_fp)
 
     if remove_download_dir:
         shutil.rmtree(download_dir)
 
-def download_accessions(download_dir):
-    zipped_accession_fp = os.path.join(
-        download_dir, os.path.basename(ACCESSION_URL))
-    accession_fp = os.path.splitext(zipped_accession_fp)[0]
-    if not os.path.exists(accession_fp):
+def download_accessions(download_dir, refresh=False):
+    return _download(ACCESSION_URL, download_dir, refresh)
+
+def download_nodes(download_dir, refresh=False):
+    return _download(TAXDUMP_URL, download_dir, refresh)
+
+def _download(url, download_dir, refresh=False):
+    """Download a file, unless it is already in the download directory.
+
+    With refresh, wget compares the file with the one on the server,
+    and downloads it again only if the server has a newer one.
+    """
+    fp = os.path.join(download_dir, os.path.basename(url))
+    if refresh or not os.path.exists(fp):
         subprocess.check_call(
-            ["wget", "--directory-prefix", download_dir, ACCESSION_URL])
-        subprocess.check_call(["gunzip", zipped_accession_fp])
-    return accession_fp
-
-def download_nodes(download_dir):
-    taxdump_fp = os.path.join(download_dir, os.path.basename(TAXDUMP_URL))
-    nodes_fp = os.path.join(download_dir, "nodes.dmp")
-    names_fp = os.path.join(download_dir, "names.dmp")
-    if not all(os.path.exists(x) for x in (nodes_fp, names_fp)):
-        if not os.path.exists(taxdump_fp):
-            subprocess.check_call(
-                ["wget", "--directory-prefix", download_dir, TAXDUMP_URL])
-        subprocess.check_call(["tar", "xvzf", taxdump_fp, "-C", download_dir])
-    return names_fp, nodes_fp
-
-def unversion(acc):
-    if "." in acc:
-        return acc.rpartition(".")[0]
-    else:
-        return acc
+            ["wget", "--timestamping", "--directory-prefix", download_dir,
+             url])
+    return fp
+
+def build_db(db, accession_fp, taxdump_fp, version, processes=1,
+             lineages=False):
+    """Build the database from the NCBI files, replacing any old one.
+
+    Accessions that point to a merged taxon are moved to the taxon it
+    was merged into, and accessions that point to a deleted taxon are
+    left out.
+    """
+    # A brocc run may have the old database open, so the new one is
+    # built alongside it and moved into place.
+    temp_fp = "{0}.{1}.tmp".format(db, os.getpid())
+    try:
+        # Records are read straight from the compressed files
+        with gzip.open(accession_fp, "rt") as f_acc, \
+             tarfile.open(taxdump_fp) as taxdump:
+            merged = dict(_parse_merged(_extract_text(taxdump, "merged.dmp")))
+            deleted = set(
+                taxid for taxid, in _parse_delnodes(
+                    _extract_text(taxdump, "delnodes.dmp")))
+            f_names = _extract_text(taxdump, "names.dmp")
+            f_nodes = _extract_text(taxdump, "nodes.dmp")
+            accessions = _current_accessions(
+                parse_accessions(f_acc, processes), merged, deleted)
+            nodes = parse_names_and_nodes(f_names, f_nodes)
+            init_db(temp_fp, accessions, nodes)
+        set_db_version(temp_fp, version)
+        if lineages:
+            init_lineages(temp_fp)
+        os.replace(temp_fp, db)
+    finally:
+        if os.path.exists(temp_fp):
+            os.remove(temp_fp)
+
+def _current_accessions(accessions, merged, deleted):
+    for acc, taxid in accessions:
+        taxid = merged.get(taxid, taxid)
+        if taxid not in deleted:
+            yield acc, taxid
+
+def _extract_text(tar, filename):
+    return io.TextIOWrapper(tar.extractfile(filename), encoding="utf-8")
+
+def download_version(*fps):
+    """Version stamp for a set of downloaded files.
+
+    wget sets the modification time of each file to that of the file
+    on the server, so the stamp changes when NCBI publishes new files.
+    """
+    stamps = []
+    for fp in fps:
+        stat = os.stat(fp)
+        modified = datetime.datetime.fromtimestamp(
+            int(stat.st_mtime), datetime.timezone.utc)
+        stamps.append("{0} {1} {2}".format(
+            os.path.basename(fp), modified.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            stat.st_size))
+    return "; ".join(stamps)
+
+def _chunks(xs, n):
+    xs = iter(xs)
+    while True:
+        chunk = list(itertools.islice(xs, n))
+        if not chunk:
+            return
+        yield chunk
 
 class NcbiLocal(object):
     select_taxon_id = "SELECT taxid FROM accessions WHERE accession = ?"
-    select_node = "SELECT parent, name, rank FROM nodes WHERE taxid = ?"
+    select_taxon_ids = (
+        "SELECT accession, taxid FROM accessions WHERE accession IN ({0})")
+    select_stored_lineage = "SELECT lineage FROM lineages WHERE taxid = ?"
+    select_stored_lineages = (
+        "SELECT taxid, lineage FROM lineages WHERE taxid IN ({0})")
+    # Walk up the tree from a taxon to the root in a single query.  The
+    # root node, which is its own parent, is not part of the lineage.
+    # As a guard against cycles, we stop after 100 levels.
+    select_lineage = """\
+WITH RECURSIVE lineage(taxid, parent, name, rank, depth) AS (
+    SELECT taxid, parent, name, rank, 0 FROM nodes WHERE taxid = ?
+    UNION ALL
+    SELECT n.taxid, n.parent, n.name, n.rank, l.depth + 1
+    FROM nodes n JOIN lineage l ON n.taxid = l.parent
+    WHERE l.parent != l.taxid AND l.depth < 99
+)
+SELECT name, rank FROM lineage WHERE parent != taxid ORDER BY depth DESC"""
+    select_lineages = """\
+WITH RECURSIVE lineage(query, taxid, parent, name, rank, depth) AS (
+    SELECT taxid, taxid, parent, name, rank, 0 FROM nodes
+    WHERE taxid IN ({0})
+    UNION ALL
+    SELECT l.query, n.taxid, n.parent, n.name, n.rank, l.depth + 1
+    FROM nodes n JOIN lineage l ON n.taxid = l.parent
+    WHERE l.parent != l.taxid AND l.depth < 99
+)
+SELECT query, name, rank FROM lineage WHERE parent != taxid
+ORDER BY query, depth DESC"""
+    # Stay well under SQLITE_MAX_VARIABLE_NUMBER for older sqlite builds
+    max_query_params = 500
 
-    def __init__(self, db):
+    def __init__(self, db, taxon_id_cache_size=TAXON_ID_CACHE_SIZE):
         self.db = db
         self.con = sqlite3.connect(self.db)
+        # Lineages are not cached here.  The Assigner keeps the Lineage
+        # objects made from them.
+        self.taxon_id_cache = LruCache(taxon_id_cache_size)
+        # Number of SELECT statements run for lookups
+        self.num_queries = 0
+        # If the lineages table was built, we can skip the walk up
+        # the tree for most taxa.
+        if _has_table(self.con, "lineages"):
+            self.rank_names = dict(
+                self.con.execute("SELECT code, rank FROM ranks"))
+        else:
+            self.rank_names = None
 
     def get_taxon_id(self, acc):
         unversioned_acc = unversion(acc)
-        cur = self.con.cursor()
-        cur.execute(self.select_taxon_id, (unversioned_acc,))
-        self.con.commit()
-        res = cur.fetchone()
-        cur.close()
+        taxon_id = self.taxon_id_cache.get(unversioned_acc, _NOT_CACHED)
+        if taxon_id is not _NOT_CACHED:
+            return taxon_id
+        self.num_queries += 1
+        res = self.con.execute(
+            self.select_taxon_id, (unversioned_acc,)).fetchone()
         if res is None:
-            return None
+            taxon_id = None
         else:
-            return res[0]
+            taxon_id = res[0]
+        self.taxon_id_cache.put(unversioned_acc, taxon_id)
+        return taxon_id
+
+    def get_taxon_ids(self, accs):
+        """Look up many accessions at once.
+
+        Returns a dict mapping each accession to its taxon ID, or to
+        None if the accession is not found.
+        """
+        unversioned_accs = dict((acc, unversion(acc)) for acc in accs)
+        found = {}
+        to_query = []
+        for unversioned_acc in set(unversioned_accs.values()):
+            taxon_id = self.taxon_id_cache.get(unversioned_acc, _NOT_CACHED)
+            if taxon_id is _NOT_CACHED:
+                to_query.append(unversioned_acc)
+            else:
+                found[unversioned_acc] = taxon_id
+        to_query.sort()
+        for chunk in _chunks(to_query, self.max_query_params):
+            placeholders = ",".join("?" * len(chunk))
+            query = self.select_taxon_ids.format(placeholders)
+            self.num_queries += 1
+            res = dict(self.con.execute(query, chunk))
+            for unversioned_acc in chunk:
+                taxon_id = res.get(unversioned_acc)
+                self.taxon_id_cache.put(unversioned_acc, taxon_id)
+                found[unversioned_acc] = taxon_id
+        return dict(
+            (acc, found.get(unversioned_acc))
+            for acc, unversioned_acc in unversioned_accs.items())
 
     def get_lineage(self, taxon_id):
-        lineage = list(self._query_nodes(taxon_id))
-        lineage.reverse()
+        if self.rank_names is not None:
+            self.num_queries += 1
+            res = self.con.execute(
+                self.select_stored_lineage, (taxon_id,)).fetchone()
+            if res is not None:
+                return self._decode_lineage(res[0])
+        self.num_queries += 1
+        cur = self.con.execute(self.select_lineage, (taxon_id,))
+        return [(name, rank) for name, rank in cur]
+
+    def get_lineages(self, taxon_ids):
+        """Look up the lineages of many taxa at once.
+
+        Returns a dict mapping each taxon ID to its lineage.
+        """
+        taxon_ids = set(taxon_ids)
+        lineages = {}
+        if self.rank_names is not None:
+            for chunk in _chunks(sorted(taxon_ids), self.max_query_params):
+                placeholders = ",".join("?" * len(chunk))
+                query = self.select_stored_lineages.format(placeholders)
+                self.num_queries += 1
+                for taxon_id, encoded in self.con.execute(query, chunk):
+                    lineages[taxon_id] = self._decode_lineage(encoded)
+            taxon_ids.difference_update(lineages)
+
+        for taxon_id in taxon_ids:
+            lineages[taxon_id] = []
+        for chunk in _chunks(sorted(taxon_ids), self.max_query_params):
+            placeholders = ",".join("?" * len(chunk))
+            query = self.select_lineages.format(placeholders)
+            self.num_queries += 1
+            for taxon_id, name, rank in self.con.execute(query, chunk):
+                lineages[taxon_id].append((name, rank))
+        return lineages
+
+    def _decode_lineage(self, encoded):
+        lineage = []
+        if not encoded:
+            return lineage
+        for entry in encoded.split("\n"):
+            code, _, name = entry.partition("\t")
+            lineage.append((name, self.rank_names[int(code)]))
         return lineage
 
-    def _query_nodes(self, taxon_id):
-        max_iter = 100
-        for num_iter in range(max_iter):
-            cur = self.con.cursor()
-            cur.execute(self.select_node, (taxon_id,))
-            self.con.commit()
-            res = cur.fetchone()
-            cur.close()
-            if res is None:
-                break
-            parent, name, rank = res
-            if parent == taxon_id:
-                break
-            else:
-                yield name, rank
-                taxon_id = parent
+    def stats(self):
+        return {
+            "db_queries": self.num_queries,
+            "taxon_id_cache": self.taxon_id_cache.stats(),
+            }
 
     def save_cache(self):
         pass
@@ -170,23 +462,48 @@ class NcbiLocal(object):
         pass
 
 
-def init_db(db, temp_dir, accessions, nodes):
-    accession_fp = os.path.join(temp_dir, "accessions_import.txt")
-    with open(accession_fp, "w") as f:
-        _write_tsv(accessions, f)
+def init_db(db, accessions, nodes):
+    con = sqlite3.connect(db)
+    # The database is built from scratch, so we trade safety for speed.
+    # If the build fails, we start over.
+    con.executescript(SQLITE3_BUILD_PRAGMAS)
+    con.executescript(SQLITE3_CREATE_TABLES)
+    _insert_all(
+        con, "INSERT INTO accessions VALUES (?, ?)", accessions, "accessions")
+    _insert_all(con, "INSERT INTO nodes VALUES (?, ?, ?, ?)", nodes, "nodes")
+    # Indexes are faster to build after the tables are filled
+    con.executescript(SQLITE3_CREATE_INDEXES)
+    con.close()
+
+INSERT_BATCH_SIZE = 100000
+PROGRESS_INTERVAL = 1000000
 
-    nodes_fp = os.path.join(temp_dir, "nodes_import.txt")
-    with open(nodes_fp, "w") as f:
-        _write_tsv(nodes, f)
+def _insert_all(con, statement, recs, label):
+    start = time.monotonic()
+    num_rows = 0
+    next_report = PROGRESS_INTERVAL
+    with con:
+        for batch in _chunks(recs, INSERT_BATCH_SIZE):
+            con.executemany(statement, batch)
+            num_rows += len(batch)
+            if num_rows >= next_report:
+                _log_progress(label, num_rows, start)
+                next_report += PROGRESS_INTERVAL
+    _log_progress(label, num_rows, start)
 
-    commands_fp = os.path.join(temp_dir, "create_taxondb.sql")
-    with open(commands_fp, "w") as f:
-        f.write(SQLITE3_IMPORT_COMMANDS)
+def _log_progress(label, num_rows, start):
+    elapsed = time.monotonic() - start
+    rate = num_rows / elapsed if elapsed > 0 else 0
+    logging.info("Loaded %d %s (%.0f rows/sec)", num_rows, label, rate)
 
-    with open(commands_fp) as f:
-        subprocess.check_call(["sqlite3", db], stdin=f, cwd=temp_dir)
+SQLITE3_BUILD_PRAGMAS = """\
+PRAGMA journal_mode = OFF;
+PRAGMA synchronous = OFF;
+PRAGMA locking_mode = EXCLUSIVE;
+PRAGMA cache_size = -1000000;
+"""
 
-SQLITE3_IMPORT_COMMANDS = """\
+SQLITE3_CREATE_TABLES = """\
 CREATE TABLE accessions (
     "accession" TEXT,
     "taxid" INTEGER
@@ -197,15 +514,122 @@ CREATE TABLE nodes (
     "name" TEXT,
     "rank" TEXT
 );
-.separator "\t"
-.import accessions_import.txt accessions
-.import nodes_import.txt nodes
+"""
+
+SQLITE3_CREATE_INDEXES = """\
 CREATE UNIQUE INDEX idx_accessions ON accessions(accession);
 CREATE UNIQUE INDEX idx_taxid ON nodes(taxid);
 """
 
 
-def _write_tsv(recs, f):
-    for rec in recs:
-        f.write("\t".join(str(r) for r in rec))
-        f.write("\n")
+def get_db_version(db):
+    """Return the version stamp of the database, or None."""
+    con = sqlite3.connect(db)
+    try:
+        if not _has_table(con, "metadata"):
+            return None
+        res = con.execute(
+            "SELECT value FROM metadata WHERE key = 'version'").fetchone()
+        return res[0] if res else None
+    finally:
+        con.close()
+
+
+def set_db_version(db, version):
+    """Record the version stamp and time of the last build or update."""
+    updated = datetime.datetime.now(datetime.timezone.utc)
+    con = sqlite3.connect(db)
+    with con:
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "\"key\" TEXT PRIMARY KEY, \"value\" TEXT)")
+        con.executemany(
+            "INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", [
+                ("version", version),
+                ("updated", updated.strftime("%Y-%m-%dT%H:%M:%SZ")),
+                ])
+    con.close()
+
+
+def init_lineages(db):
+    """Precompute the lineage of every taxon in the nodes table.
+
+    Each lineage is stored as newline-separated entries of rank code
+    and name, from the top of the tree down to the taxon itself.
+    Ranks are stored once, in a separate table.
+    """
+    con = sqlite3.connect(db)
+    con.executescript(SQLITE3_LINEAGE_COMMANDS)
+    con.commit()
+    con.close()
+
+SQLITE3_LINEAGE_COMMANDS = """\
+DROP TABLE IF EXISTS lineages;
+DROP TABLE IF EXISTS ranks;
+CREATE TABLE ranks (
+    "code" INTEGER PRIMARY KEY,
+    "rank" TEXT UNIQUE
+);
+INSERT INTO ranks (rank) SELECT DISTINCT rank FROM nodes ORDER BY rank;
+CREATE TABLE lineages (
+    "taxid" INTEGER PRIMARY KEY,
+    "lineage" TEXT
+);
+CREATE INDEX idx_parent ON nodes(parent);
+WITH RECURSIVE paths(taxid, lineage) AS (
+    SELECT n.taxid,
+        CASE WHEN n.parent = n.taxid THEN ''
+        ELSE r.code || char(9) || n.name END
+    FROM nodes n JOIN ranks r ON r.rank = n.rank
+    WHERE n.parent = n.taxid OR n.parent NOT IN (SELECT taxid FROM nodes)
+    UNION ALL
+    SELECT n.taxid,
+        CASE WHEN p.lineage = '' THEN r.code || char(9) || n.name
+        ELSE p.lineage || char(10) || r.code || char(9) || n.name END
+    FROM nodes n
+    JOIN paths p ON n.parent = p.taxid
+    JOIN ranks r ON r.rank = n.rank
+    WHERE n.parent != n.taxid
+)
+INSERT INTO lineages (taxid, lineage) SELECT taxid, lineage FROM paths;
+DROP INDEX idx_parent;
+"""
+
+
+def init_tree(db):
+    """Write a tree file from the nodes table of the database."""
+    con = sqlite3.connect(db)
+    nodes = con.execute("SELECT taxid, parent, name, rank FROM nodes")
+    write_taxonomy_tree(taxonomy_tree_fp(db), nodes)
+    con.close()
+
+
+def init_accession_index(db):
+    """Write an accession index file from the accessions table.
+
+    The unique index on the accessions table hands back the records
+    in sorted order.
+    """
+    con = sqlite3.connect(db)
+    key_width = con.execute(
+        "SELECT MAX(LENGTH(accession)) FROM accessions").fetchone()[0]
+    accessions = con.execute(
+        "SELECT accession, taxid FROM accessions ORDER BY accession")
+    write_accession_index(accession_index_fp(db), accessions, key_width or 1)
+    con.close()
+
+
+def _has_lineages(db):
+    con = sqlite3.connect(db)
+    try:
+        return _has_table(con, "lineages")
+    finally:
+        con.close()
+
+
+def _has_table(con, table):
+    res = con.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,)).fetchone()
+    return res is not None
+
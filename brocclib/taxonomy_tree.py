@@ -0,0 +1,191 @@
+"""Compact, memory-mapped copy of the NCBI taxonomy tree.
+
+The tree file holds a few arrays, indexed by taxon ID:
+
+* the parent of each node (0 if there is no node with that ID),
+* a code for the rank of each node, and
+* the offset of each node's name in a block of UTF-8 encoded names.
+
+The rank names are stored once, at the end of the file.  Because the
+file is memory-mapped, it opens almost instantly and its pages are
+shared by all processes that read it.  The arrays are written in the
+native byte order, so the file should be built on the same kind of
+machine that reads it.
+"""
+
+import array
+import mmap
+import os
+import struct
+import sys
+
+TREE_MAGIC = b"BROCCTRE"
+TREE_VERSION = 1
+# magic, version, byte order, number of slots, number of ranks,
+# size of names block in bytes
+_HEADER = struct.Struct("=8sIBxxxIIQ")
+_BYTE_ORDERS = {"little": 0, "big": 1}
+
+TREE_EXT = ".tree"
+
+
+def taxonomy_tree_fp(database_fp):
+    """Location of the tree file that goes with a taxonomy database."""
+    return os.path.splitext(database_fp)[0] + TREE_EXT
+
+
+def _aligned(n, size=8):
+    return (n + size - 1) // size * size
+
+
+def write_taxonomy_tree(fp, nodes):
+    """Write a tree file from (taxid, parent, name, rank) records."""
+    parents = {}
+    names = {}
+    ranks = {}
+    rank_codes = {}
+    for taxid, parent, name, rank in nodes:
+        taxid = int(taxid)
+        parents[taxid] = int(parent)
+        names[taxid] = name.encode("utf-8")
+        if rank not in rank_codes:
+            rank_codes[rank] = len(rank_codes)
+        ranks[taxid] = rank_codes[rank]
+    if len(rank_codes) > 255:
+        raise ValueError(
+            "Too many distinct ranks for tree file: {0}".format(
+                len(rank_codes)))
+
+    num_slots = max(parents) + 1 if parents else 1
+    parent_arr = array.array("I", bytes(4 * num_slots))
+    rank_arr = array.array("B", bytes(num_slots))
+    offset_arr = array.array("I", bytes(4 * (num_slots + 1)))
+    for taxid, parent in parents.items():
+        parent_arr[taxid] = parent
+        rank_arr[taxid] = ranks[taxid]
+    offset = 0
+    for taxid in range(num_slots):
+        offset_arr[taxid] = offset
+        offset += len(names.get(taxid, b""))
+    offset_arr[num_slots] = offset
+    if offset >= 2 ** 32:
+        raise ValueError("Names block too large for tree file")
+
+    rank_block = "\n".join(
+        sorted(rank_codes, key=rank_codes.get)).encode("utf-8")
+    # A brocc run may have the old file mapped, so the new file is
+    # written alongside it and moved into place.
+    temp_fp = "{0}.{1}.tmp".format(fp, os.getpid())
+    try:
+        with open(temp_fp, "wb") as f:
+            f.write(_HEADER.pack(
+                TREE_MAGIC, TREE_VERSION, _BYTE_ORDERS[sys.byteorder],
+                num_slots, len(rank_codes), offset))
+            _write_padded(f, parent_arr.tobytes())
+            _write_padded(f, rank_arr.tobytes())
+            _write_padded(f, offset_arr.tobytes())
+            for taxid in range(num_slots):
+                name = names.get(taxid)
+                if name:
+                    f.write(name)
+            f.write(rank_block)
+        os.replace(temp_fp, fp)
+    finally:
+        if os.path.exists(temp_fp):
+            os.remove(temp_fp)
+
+
+def _write_padded(f, data):
+    f.write(data)
+    f.write(bytes(_aligned(len(data)) - len(data)))
+
+
+class TaxonomyTree(object):
+    max_depth = 100
+
+    def __init__(self, fp):
+        self.fp = fp
+        with open(fp, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+
+        magic, version, byte_order, num_slots, num_ranks, names_size = \
+            _HEADER.unpack_from(buf)
+        if magic != TREE_MAGIC:
+            raise ValueError("Not a taxonomy tree file: {0}".format(fp))
+        if version != TREE_VERSION:
+            raise ValueError(
+                "Unsupported taxonomy tree version: {0}".format(version))
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(
+                "Taxonomy tree was built on a machine with a different "
+                "byte order: {0}".format(fp))
+
+        pos = _HEADER.size
+        self.num_slots = num_slots
+        self._parents = buf[pos:pos + 4 * num_slots].cast("I")
+        pos += _aligned(4 * num_slots)
+        self._ranks = buf[pos:pos + num_slots]
+        pos += _aligned(num_slots)
+        self._name_offsets = buf[pos:pos + 4 * (num_slots + 1)].cast("I")
+        pos += _aligned(4 * (num_slots + 1))
+        self._names = buf[pos:pos + names_size]
+        pos += names_size
+        self.rank_names = bytes(buf[pos:]).decode("utf-8").split("\n")
+
+    def __contains__(self, taxon_id):
+        taxon_id = int(taxon_id)
+        return (0 < taxon_id < self.num_slots) and \
+            (self._parents[taxon_id] != 0)
+
+    def get_name(self, taxon_id):
+        start = self._name_offsets[taxon_id]
+        end = self._name_offsets[taxon_id + 1]
+        return bytes(self._names[start:end]).decode("utf-8")
+
+    def get_rank(self, taxon_id):
+        return self.rank_names[self._ranks[taxon_id]]
+
+    def get_lineage(self, taxon_id):
+        # Follows the same rules as NcbiLocal: the root node, which is
+        # its own parent, is left out, and we stop if the parent is
+        # missing or after max_depth levels.
+        lineage = []
+        taxon_id = int(taxon_id)
+        for _ in range(self.max_depth):
+            if taxon_id not in self:
+                break
+            parent = self._parents[taxon_id]
+            if parent == taxon_id:
+                break
+            lineage.append((self.get_name(taxon_id), self.get_rank(taxon_id)))
+            taxon_id = parent
+        lineage.reverse()
+        return lineage
+
+
+class NcbiTree(object):
+    """Taxonomy backend that reads lineages from a tree file.
+
+    Accessions are looked up in a second backend, usually NcbiLocal.
+    """
+    def __init__(self, tree_fp, taxon_id_db=None):
+        self.tree = TaxonomyTree(tree_fp)
+        self.taxon_id_db = taxon_id_db
+
+    def get_taxon_id(self, acc):
+        return self.taxon_id_db.get_taxon_id(acc)
+
+    def get_taxon_ids(self, accs):
+        return self.taxon_id_db.get_taxon_ids(accs)
+
+    def get_lineage(self, taxon_id):
+        return self.tree.get_lineage(taxon_id)
+
+    def get_lineages(self, taxon_ids):
+        return dict((t, self.tree.get_lineage(t)) for t in set(taxon_ids))
+
+    def stats(self):
+        if self.taxon_id_db is None:
+            return {}
+        return self.taxon_id_db.stats()
@@ -0,0 +1,156 @@
+"""Records of the votes behind each assignment.
+
+The Assigner gives each vote to a VoteTrace, which keeps a small
+record of the taxa and vote counts.  Nothing is formatted until the
+records are written out, so the cost of the voting log is only paid
+for the queries that are traced.  With sampling, about one query in
+N is traced.  The choice depends only on the query ID, so the same
+queries are traced in every run.
+"""
+
+import collections
+import json
+import os
+import zlib
+
+VOTE_TRACE_FORMATS = ["text", "json", "off"]
+VOTE_TRACE_FILENAMES = {
+    "text": "voting_log.txt",
+    "json": "voting_log.jsonl",
+    }
+
+# Outcome of the vote at one rank.  Candidates and generic taxa are
+# (taxon, votes) pairs.  If the vote was won, winner is a (taxon,
+# votes) pair, otherwise message gives the reason.
+VoteRecord = collections.namedtuple(
+    "VoteRecord",
+    ["query_id", "rank", "candidates", "generics", "winner", "message"])
+
+# Query whose assignment was copied from an earlier query
+ReuseRecord = collections.namedtuple("ReuseRecord", ["query_id", "same_as"])
+
+
+def parse_vote_trace(value):
+    """Parse the value of the --vote_trace option.
+
+    The value is a format, "sample=N", or both, separated by a comma.
+    Returns the format and the sampling interval.
+    """
+    trace_format = "text"
+    sample = 1
+    for part in value.split(","):
+        part = part.strip()
+        if part.startswith("sample="):
+            try:
+                sample = int(part[len("sample="):])
+            except ValueError:
+                sample = 0
+            if sample < 1:
+                raise ValueError(
+                    "Vote trace sample must be a positive integer: " + part)
+        elif part in VOTE_TRACE_FORMATS:
+            trace_format = part
+        else:
+            raise ValueError("Vote trace format not recognized: " + part)
+    return trace_format, sample
+
+
+def vote_record(a):
+    """Make a VoteRecord from an Assignment or NoAssignment."""
+    candidates = [(c.lineage.get_taxon(c.rank), c.votes) for c in a.candidates]
+    generics = [(taxon, votes) for votes, taxon in a.generics]
+    if a.is_valid_assignment:
+        c = a.winning_candidate
+        return VoteRecord(
+            a.query_id, a.rank, candidates, generics,
+            (c.lineage.get_taxon(c.rank), c.votes), None)
+    return VoteRecord(
+        a.query_id, a.rank, candidates, generics, None, a.message)
+
+
+class VoteTrace(object):
+    """Collects records of the votes for the traced queries."""
+    def __init__(self, sample=1):
+        self.sample = sample
+        self.records = []
+
+    def is_traced(self, query_id):
+        if self.sample == 1:
+            return True
+        return zlib.crc32(query_id.encode("utf-8")) % self.sample == 0
+
+    def record_vote(self, a):
+        self.records.append(vote_record(a))
+
+    def record_reuse(self, query_id, same_as):
+        self.records.append(ReuseRecord(query_id, same_as))
+
+    def pop_records(self):
+        records = self.records
+        self.records = []
+        return records
+
+
+def format_vote_text(record):
+    """Format a record as in the original voting log."""
+    if isinstance(record, ReuseRecord):
+        return "\n** {0} has the same hits as {1}, reusing assignment **\n"\
+            .format(record.query_id, record.same_as)
+    candidates = [
+        "{0} ({1} votes)".format(taxon, votes)
+        for taxon, votes in record.candidates if votes > 1]
+    generics = [
+        "{0} ({1} votes)".format(taxon, votes)
+        for taxon, votes in record.generics]
+    if record.winner is None:
+        result = record.message
+    else:
+        result = "WINNER: {0} ({1} votes)".format(*record.winner)
+    parts = [
+        "",
+        "** {0} voting for {1} **".format(record.query_id, record.rank),
+        "Candidates (>1 vote): {0}".format(", ".join(candidates)),
+        "Generic taxa: {0}".format(", ".join(generics)),
+        "Candidate total: {0} votes".format(
+            sum(votes for _, votes in record.candidates)),
+        result,
+        "",
+    ]
+    return "\n".join(parts)
+
+
+def format_vote_json(record):
+    """Format a record as one line of JSON."""
+    if isinstance(record, ReuseRecord):
+        obj = {"query": record.query_id, "same_as": record.same_as}
+    else:
+        obj = {
+            "query": record.query_id,
+            "rank": record.rank,
+            "candidates": record.candidates,
+            "generics": record.generics,
+            "winner": record.winner,
+            "message": record.message,
+            }
+    return json.dumps(obj, separators=(",", ":"))
+
+
+class VoteTraceWriter(object):
+    """Writes vote records to the voting log in the output directory."""
+    formatters = {
+        "text": format_vote_text,
+        "json": format_vote_json,
+        }
+
+    def __init__(self, output_dir, trace_format):
+        self.format = self.formatters[trace_format]
+        self.fp = os.path.join(output_dir, VOTE_TRACE_FILENAMES[trace_format])
+        self.file = open(self.fp, "w")
+
+    def write(self, records):
+        for record in records:
+            self.file.write(self.format(record))
+            self.file.write("\n")
+
+    def close(self):
+        self.file.close()
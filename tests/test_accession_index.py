@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from brocclib.accession_index import (
+    AccessionIndex, NcbiAccessionIndex, write_accession_index,
+)
+from brocclib.taxonomy_db import NcbiLocal, init_db, init_accession_index
+
+TEST_ACCESSIONS = [
+    ("A1", 2),
+    ("ABC123", 3324),
+    ("AF56", 9012),
+    ("Z9999999", 5),
+]
+
+TEST_NODES = [
+    (3324, 5, "Clostridiales", "order"),
+    (5, 4, "Clostridia", "class"),
+    (4, 3, "Firmicutes", "phylum"),
+    (3, 2, "Bacteria", "superkingdom"),
+    (2, 335, "cellular organisms", "no rank"),
+    (1, 1, "root", "no rank"),
+    (9012, 5, "Natronoanaerobium aggerbacterium", "species"),
+]
+
+
+class AccessionIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index_fp = os.path.join(self.temp_dir, "taxonomy.acc")
+        write_accession_index(self.index_fp, TEST_ACCESSIONS, 8)
+        self.index = AccessionIndex(self.index_fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get(self):
+        self.assertEqual(len(self.index), 4)
+        for acc, taxid in TEST_ACCESSIONS:
+            self.assertEqual(self.index.get(acc), taxid)
+
+    def test_rewrite(self):
+        # The old file stays readable while a new one is written
+        write_accession_index(self.index_fp, [("A1", 7)], 8)
+        self.assertEqual(self.index.get("ABC123"), 3324)
+        self.assertEqual(AccessionIndex(self.index_fp).get("A1"), 7)
+        self.assertEqual(os.listdir(self.temp_dir), ["taxonomy.acc"])
+
+    def test_get_missing(self):
+        self.assertEqual(self.index.get("A"), None)
+        self.assertEqual(self.index.get("ABC12"), None)
+        self.assertEqual(self.index.get("ZZ"), None)
+        self.assertEqual(self.index.get("Z99999999"), None)
+        self.assertEqual(self.index.get(u"Ä1"), None)
+
+    def test_unsorted(self):
+        fp = os.path.join(self.temp_dir, "unsorted.acc")
+        self.assertRaises(
+            ValueError, write_accession_index, fp,
+            [("B1", 1), ("A1", 2)], 8)
+
+    def test_too_long(self):
+        fp = os.path.join(self.temp_dir, "long.acc")
+        self.assertRaises(
+            ValueError, write_accession_index, fp, [("ABCDEFGHI", 1)], 8)
+
+
+class NcbiAccessionIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        sqlite_fp = os.path.join(self.temp_dir, "taxonomy.db")
+        init_db(sqlite_fp, TEST_ACCESSIONS, TEST_NODES)
+        init_accession_index(sqlite_fp)
+        self.local_db = NcbiLocal(sqlite_fp)
+        index_fp = os.path.join(self.temp_dir, "taxonomy.acc")
+        self.db = NcbiAccessionIndex(index_fp, self.local_db)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_same_taxon_ids_as_local_db(self):
+        accs = ["A1.1", "ABC123.2", "AF56", "XYZ", "Z9999999.1"]
+        self.assertEqual(
+            self.db.get_taxon_ids(accs), self.local_db.get_taxon_ids(accs))
+        self.assertEqual(self.db.get_taxon_id("AF56.3"), 9012)
+
+    def test_get_lineage(self):
+        self.assertEqual(
+            self.db.get_lineage(3324), self.local_db.get_lineage(3324))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+
+from brocclib.assign import Assigner
+from brocclib.parse import BlastHit
+
+ASCOMYCOTA = [
+    ("Eukaryota", "domain"),
+    ("Fungi", "kingdom"),
+    ("Ascomycota", "phylum"),
+    ("Saccharomycetes", "class"),
+    ("Saccharomycetales", "order"),
+    ("Debaryomycetaceae", "family"),
+    ]
+
+TAXON_IDS = {"A1": 1, "A2": 1, "A3": 2, "A4": 3, "A5": None}
+
+LINEAGES = {
+    1: ASCOMYCOTA + [
+        ("Candida", "genus"), ("Candida albicans", "species")],
+    2: ASCOMYCOTA + [
+        ("Candida", "genus"), ("Candida tropicalis", "species")],
+    3: None,
+    }
+
+
+class FakeTaxaDb(object):
+    def __init__(self):
+        self.lineage_requests = []
+
+    def get_taxon_ids(self, accs):
+        return dict((acc, TAXON_IDS[acc]) for acc in accs)
+
+    def get_lineages(self, taxon_ids):
+        self.lineage_requests.append(set(taxon_ids))
+        return dict((t, LINEAGES[t]) for t in taxon_ids)
+
+
+def _hits(*accs):
+    return [BlastHit(acc, 100.0, 100) for acc in accs]
+
+
+class AssignerTests(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeTaxaDb()
+        self.assigner = Assigner(
+            0.7, 99.0, 95.0, 80.0, [0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+            1, self.db)
+
+    def test_assign(self):
+        a = self.assigner.assign("q1", "A" * 100, _hits("A1", "A2", "A5"))
+        self.assertEqual(a.rank, "species")
+        self.assertEqual(
+            a.format_for_standard_taxonomy().split("\t")[1].split(";")[-1],
+            "Candida albicans\n")
+
+    def test_tie(self):
+        hits = _hits("A3", "A1")
+        a = self.assigner.assign("q1", "A" * 100, hits)
+        self.assertEqual(a.rank, "genus")
+        self.assertEqual(a.winning_candidate.votes, 2)
+
+        # The first hit wins ties
+        lineages = self.assigner._retrieve_lineages([1, 2])
+        db_hits = [(hits[0], lineages[2]), (hits[1], lineages[1])]
+        a = self.assigner.vote_at_rank("q1", "species", db_hits)
+        self.assertFalse(a.is_valid_assignment)
+        self.assertEqual(
+            [c.to_string() for c in a.candidates],
+            ["Candida tropicalis (1 votes)", "Candida albicans (1 votes)"])
+
+    def test_min_pct_id(self):
+        # Below the species threshold, but above the genus threshold
+        hits = [BlastHit("A1", 97.0, 100), BlastHit("A3", 99.5, 100)]
+        a = self.assigner.assign("q1", "A" * 100, hits)
+        self.assertEqual(a.rank, "species")
+        self.assertEqual(
+            list(a.winning_candidate.standard_taxa)[-1], "Candida tropicalis")
+
+    def test_collapse_hits(self):
+        lineages = self.assigner._retrieve_lineages([1, 2])
+        hits = [
+            BlastHit("A1", 100.0, 100), BlastHit("A3", 100.0, 100),
+            BlastHit("A2", 100.0, 100), BlastHit("A1", 97.0, 100),
+            BlastHit("A2", 99.5, 100),
+            ]
+        db_hits = [
+            (hits[0], lineages[1]), (hits[1], lineages[2]),
+            (hits[2], lineages[1]), (hits[3], lineages[1]),
+            (hits[4], lineages[1]),
+            ]
+        observed = self.assigner._collapse_hits(db_hits)
+        self.assertEqual(observed, [
+            (lineages[1], 3, 3), (lineages[2], 3, 1), (lineages[1], 2, 1)])
+
+    def test_lineages_shared(self):
+        self.assigner.assign("q1", "A" * 100, _hits("A1", "A3", "A4"))
+        self.assigner.assign("q2", "A" * 100, _hits("A1", "A2", "A3", "A4"))
+        # Each taxon ID is looked up once, even if it has no lineage
+        self.assertEqual(self.db.lineage_requests, [set([1, 2, 3])])
+        self.assertEqual(self.assigner.lineage_cache.hits, 3)
+        lineage1 = self.assigner.lineage_cache.get(1)
+        self.assertEqual(lineage1.get_taxon("genus"), "Candida")
+
+    def test_no_lineage_cache(self):
+        assigner = Assigner(
+            0.7, 99.0, 95.0, 80.0, [0.8] * 8, 1, self.db,
+            lineage_cache_size=0)
+        assigner.assign("q1", "A" * 100, _hits("A1"))
+        assigner.assign("q2", "A" * 100, _hits("A1"))
+        self.assertEqual(self.db.lineage_requests, [set([1]), set([1])])
+
+    def test_dedup_queries(self):
+        assigner = Assigner(
+            0.7, 99.0, 95.0, 80.0, [0.8] * 8, 1, self.db,
+            assignment_cache_size=10)
+        a1 = assigner.assign("q1", "A" * 100, _hits("A1", "A2", "A5"))
+        a2 = assigner.assign("q2", "A" * 120, _hits("A1", "A2", "A5"))
+        self.assertEqual(
+            a2.format_for_standard_taxonomy(),
+            a1.format_for_standard_taxonomy().replace("q1", "q2"))
+        self.assertEqual(a1.query_id, "q1")
+        self.assertEqual(assigner.assignment_cache.hits, 1)
+
+        # Hits that fail the coverage filter are not part of the match
+        hits = _hits("A1", "A2", "A5") + [BlastHit("A3", 100.0, 10)]
+        a3 = assigner.assign("q3", "A" * 100, hits)
+        self.assertEqual(a3.query_id, "q3")
+        self.assertEqual(assigner.assignment_cache.hits, 2)
+
+        # A different sequence length can change the filtered hits
+        a4 = assigner.assign("q4", "A" * 200, _hits("A1", "A2", "A5"))
+        self.assertFalse(a4.is_valid_assignment)
+        self.assertEqual(assigner.assignment_cache.hits, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,16 @@
+import contextlib
+import io
+import json
 import os.path
 import shutil
 import tempfile
 import unittest
 
-from brocclib.command import main
+import brocclib.command
+from brocclib.command import main, run_sweep
+from brocclib.hitstore import main as create_hit_store
+from brocclib.parse import iter_blast, unversion
+from brocclib.taxonomy_db import init_db
 
 def data_fp(filename):
     return os.path.join(
@@ -29,6 +36,7 @@ class BroccAcceptance(unittest.TestCase):
             "-b", data_fp(blast_fp),
             "-o", self.output_dir,
             "-a", "ITS",
+            "--eutils_cache", os.path.join(self.output_dir, "eutils.db"),
             ])
 
     @property
@@ -66,5 +74,297 @@ class BroccAcceptance(unittest.TestCase):
             read_from(self._assignments_fp),
             read_from(data_fp("sac_otu_assignments.txt")))
 
+
+# A small taxonomy, to run brocc without network access
+TEST_NODES = [
+    (1, 1, "root", "no rank"),
+    (2, 1, "Eukaryota", "domain"),
+    (3, 2, "Fungi", "kingdom"),
+    (4, 3, "Ascomycota", "phylum"),
+    (5, 4, "Saccharomycetes", "class"),
+    (6, 5, "Saccharomycetales", "order"),
+    (7, 6, "Debaryomycetaceae", "family"),
+    (8, 7, "Candida", "genus"),
+    (9, 8, "Candida albicans", "species"),
+    (10, 8, "Candida tropicalis", "species"),
+    (11, 6, "environmental samples", "no rank"),
+    (12, 11, "uncultured Saccharomycetales", "species"),
+    (13, 4, "Dothideomycetes", "class"),
+]
+
+
+class LocalTaxonomyTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="brocc")
+        self.taxonomy_db = os.path.join(self.temp_dir, "taxonomy.db")
+        with open(data_fp("serena_controls_blast.txt")) as f:
+            accessions = sorted(set(
+                unversion(hit.accession) for _, hit in iter_blast(f)))
+        species = [9, 9, 9, 10, 12, 13, 8]
+        taxa = [
+            (acc, species[i % len(species)])
+            for i, acc in enumerate(accessions)]
+        init_db(self.taxonomy_db, taxa, TEST_NODES)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _run_brocc(self, output_dir, *args, blast_fp=None):
+        if blast_fp is None:
+            blast_fp = data_fp("serena_controls_blast.txt")
+        main([
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", blast_fp,
+            "-o", output_dir,
+            "-a", "ITS",
+            "--taxonomy_db", self.taxonomy_db,
+            ] + list(args))
+        filenames = ["Standard_Taxonomy.txt", "brocc.log"]
+        return [read_from(os.path.join(output_dir, fn)) for fn in filenames]
+
+    def test_parallel(self):
+        expected = self._run_brocc(os.path.join(self.temp_dir, "serial"))
+        self.assertEqual(len(expected[0]), 41)
+        # Use small blocks, so that the work is split between processes
+        block_size = brocclib.command.QUERY_BLOCK_SIZE
+        brocclib.command.QUERY_BLOCK_SIZE = 3
+        try:
+            observed = self._run_brocc(
+                os.path.join(self.temp_dir, "parallel"), "--processes", "2")
+        finally:
+            brocclib.command.QUERY_BLOCK_SIZE = block_size
+        self.assertEqual(observed, expected)
+        voting_logs = []
+        for output_dir in ["serial", "parallel"]:
+            voting_logs.append(read_from(os.path.join(
+                self.temp_dir, output_dir, "voting_log.txt")))
+        self.assertEqual(voting_logs[1], voting_logs[0])
+
+    def test_parallel_needs_local_taxonomy(self):
+        self.assertRaises(SystemExit, main, [
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", data_fp("serena_controls_blast.txt"),
+            "-o", os.path.join(self.temp_dir, "eutils"),
+            "-a", "ITS",
+            "--taxonomy_db", os.path.join(self.temp_dir, "missing.db"),
+            "--processes", "2",
+            ])
+
+    def test_cache_stats(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self._run_brocc(os.path.join(self.temp_dir, "default"))
+        lines = stderr.getvalue().splitlines()
+        self.assertEqual(lines[0], "Cache statistics:")
+        names = [line.split(":")[0].strip() for line in lines[1:]]
+        self.assertEqual(names, ["lineage_object_cache", "taxon_id_cache"])
+
+    def test_eutils_cache_ttl_needs_cache(self):
+        self.assertRaises(SystemExit, main, [
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", data_fp("serena_controls_blast.txt"),
+            "-o", os.path.join(self.temp_dir, "eutils"),
+            "-a", "ITS",
+            "--eutils_cache_ttl", "30",
+            ])
+
+    def test_stream(self):
+        expected = self._run_brocc(os.path.join(self.temp_dir, "default"))
+        observed = self._run_brocc(
+            os.path.join(self.temp_dir, "stream"), "--stream")
+        self.assertEqual(observed, expected)
+
+    def test_hit_store(self):
+        expected = self._run_brocc(os.path.join(self.temp_dir, "default"))
+        hits_fp = os.path.join(self.temp_dir, "serena_controls.hits")
+        create_hit_store([data_fp("serena_controls_blast.txt"), "-o", hits_fp])
+        observed = self._run_brocc(
+            os.path.join(self.temp_dir, "hits"), blast_fp=hits_fp)
+        self.assertEqual(observed, expected)
+        observed = self._run_brocc(
+            os.path.join(self.temp_dir, "hits_stream"), "--stream",
+            blast_fp=hits_fp)
+        self.assertEqual(observed, expected)
+
+    def test_vote_trace(self):
+        text_dir = os.path.join(self.temp_dir, "text")
+        expected = self._run_brocc(text_dir)
+        text_log = read_from(os.path.join(text_dir, "voting_log.txt"))
+        self.assertTrue(text_log)
+
+        json_dir = os.path.join(self.temp_dir, "json")
+        observed = self._run_brocc(json_dir, "--vote_trace", "json")
+        self.assertEqual(observed, expected)
+        records = [
+            json.loads(line) for line in
+            read_from(os.path.join(json_dir, "voting_log.jsonl"))]
+        # One record for each vote in the text log
+        self.assertEqual(
+            len(records),
+            sum(1 for line in text_log if line.startswith("** ")))
+        winners = [r for r in records if r["winner"] is not None]
+        self.assertTrue(all(r["message"] is None for r in winners))
+
+        sample_dir = os.path.join(self.temp_dir, "sample")
+        self._run_brocc(sample_dir, "--vote_trace", "json,sample=3")
+        sampled = [
+            json.loads(line) for line in
+            read_from(os.path.join(sample_dir, "voting_log.jsonl"))]
+        self.assertTrue(0 < len(sampled) < len(records))
+        sampled_queries = set(r["query"] for r in sampled)
+        self.assertEqual(
+            sampled, [r for r in records if r["query"] in sampled_queries])
+
+        off_dir = os.path.join(self.temp_dir, "off")
+        observed = self._run_brocc(off_dir, "--vote_trace", "off")
+        self.assertEqual(observed, expected)
+        self.assertEqual(
+            sorted(os.listdir(off_dir)),
+            ["Standard_Taxonomy.txt", "brocc.log"])
+
+    def test_profile(self):
+        expected = self._run_brocc(os.path.join(self.temp_dir, "default"))
+        serial_dir = os.path.join(self.temp_dir, "serial")
+        observed = self._run_brocc(serial_dir, "--profile")
+        self.assertEqual(observed, expected)
+        with open(os.path.join(serial_dir, "brocc_profile.json")) as f:
+            report = json.load(f)
+        self.assertEqual(list(report["stages"]), [
+            "parse", "taxon_ids", "lineages", "vote", "output"])
+        counts = report["counts"]
+        self.assertEqual(counts["queries"], 41)
+        self.assertTrue(counts["db_queries"] > 0)
+        self.assertTrue(
+            counts["hits_checked"] >
+            counts["hits_low_identity"] + counts["hits_low_coverage"])
+        self.assertTrue(report["caches"]["taxon_id_cache"]["misses"] > 0)
+
+        # Counts from the worker processes are added up
+        block_size = brocclib.command.QUERY_BLOCK_SIZE
+        brocclib.command.QUERY_BLOCK_SIZE = 3
+        try:
+            parallel_dir = os.path.join(self.temp_dir, "parallel")
+            self._run_brocc(parallel_dir, "--profile", "--processes", "2")
+        finally:
+            brocclib.command.QUERY_BLOCK_SIZE = block_size
+        with open(os.path.join(parallel_dir, "brocc_profile.json")) as f:
+            parallel_report = json.load(f)
+        self.assertEqual(parallel_report["processes"], 2)
+        for key in ["queries", "hits_checked", "hits_low_coverage"]:
+            self.assertEqual(parallel_report["counts"][key], counts[key])
+
+    def test_sweep(self):
+        expected = self._run_brocc(os.path.join(self.temp_dir, "default"))
+        grid_fp = os.path.join(self.temp_dir, "grid.json")
+        with open(grid_fp, "w") as f:
+            json.dump([
+                {"name": "its", "amplicon": "ITS"},
+                {"min_winning_votes": 10000},
+                ], f)
+        # Lines without an assignment are skipped over
+        expected_fp = os.path.join(self.temp_dir, "expected.txt")
+        with open(expected_fp, "w") as f:
+            f.writelines(expected[0])
+            f.write("no_assignment\n\n")
+        sweep_dir = os.path.join(self.temp_dir, "sweep")
+        run_sweep([
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", data_fp("serena_controls_blast.txt"),
+            "-o", sweep_dir,
+            "-a", "ITS",
+            "--taxonomy_db", self.taxonomy_db,
+            "--grid", grid_fp,
+            "--expected", expected_fp,
+            ])
+        filenames = ["Standard_Taxonomy.txt", "brocc.log"]
+        observed = [
+            read_from(os.path.join(sweep_dir, "its", fn)) for fn in filenames]
+        self.assertEqual(observed, expected)
+
+        summary = read_from(os.path.join(sweep_dir, "sweep_summary.txt"))
+        rows = [line.rstrip("\n").split("\t") for line in summary]
+        self.assertEqual(rows[0][:8], [
+            "Configuration", "Settings", "Queries", "Assigned",
+            "Assigned_Pct", "Assigned_Pct_Diff", "Changed",
+            "Matching_Expected"])
+        self.assertEqual([r[0] for r in rows[1:]], ["its", "config_002"])
+        self.assertEqual(rows[1][2], "41")
+        self.assertEqual(rows[1][7], "41")
+        # Nothing gets 10000 votes
+        self.assertEqual(rows[2][3], "0")
+        self.assertEqual(rows[2][6], rows[1][3])
+
+    def test_sweep_stream(self):
+        grid_fp = os.path.join(self.temp_dir, "grid.json")
+        with open(grid_fp, "w") as f:
+            json.dump({"min_winning_votes": [2, 4]}, f)
+        args = [
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", data_fp("serena_controls_blast.txt"),
+            "-a", "ITS", "--taxonomy_db", self.taxonomy_db,
+            "--grid", grid_fp,
+            ]
+        outputs = []
+        runs = [("sweep", []), ("stream", ["--stream"])]
+        for output_dir, extra_args in runs:
+            sweep_dir = os.path.join(self.temp_dir, output_dir)
+            run_sweep(args + ["-o", sweep_dir] + extra_args)
+            outputs.append([
+                read_from(os.path.join(sweep_dir, config, fn))
+                for config in ["config_001", "config_002"]
+                for fn in ["Standard_Taxonomy.txt", "brocc.log"]])
+        self.assertEqual(outputs[1], outputs[0])
+
+        # Options that a sweep does not support are rejected
+        self.assertRaises(
+            SystemExit, run_sweep,
+            args + ["-o", os.path.join(self.temp_dir, "p"), "-p", "2"])
+        self.assertRaises(
+            SystemExit, run_sweep,
+            args + ["-o", os.path.join(self.temp_dir, "p"), "--profile"])
+
+    def test_sweep_grid_amplicon(self):
+        grid_fp = os.path.join(self.temp_dir, "grid.json")
+        with open(grid_fp, "w") as f:
+            json.dump({"amplicon": ["ITS", "18S"]}, f)
+        args = [
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", data_fp("serena_controls_blast.txt"),
+            "--taxonomy_db", self.taxonomy_db,
+            ]
+        sweep_dir = os.path.join(self.temp_dir, "sweep")
+        run_sweep(args + ["-o", sweep_dir, "--grid", grid_fp])
+        summary = read_from(os.path.join(sweep_dir, "sweep_summary.txt"))
+        self.assertEqual(len(summary), 3)
+
+        # Without -a, every configuration must give the thresholds
+        with open(grid_fp, "w") as f:
+            json.dump([{"amplicon": "ITS"}, {"min_id": 90.0}], f)
+        self.assertRaises(
+            SystemExit, run_sweep,
+            args + ["-o", os.path.join(self.temp_dir, "s2"),
+                    "--grid", grid_fp])
+
+    def test_sweep_grid(self):
+        grid_fp = os.path.join(self.temp_dir, "grid.json")
+        with open(grid_fp, "w") as f:
+            json.dump({"min_id": [80.0, 90.0], "min_cover": [0.5, 0.7]}, f)
+        sweep_dir = os.path.join(self.temp_dir, "sweep")
+        run_sweep([
+            "-i", data_fp("serena_controls.fasta"),
+            "-b", data_fp("serena_controls_blast.txt"),
+            "-o", sweep_dir, "-a", "ITS",
+            "--taxonomy_db", self.taxonomy_db, "--grid", grid_fp,
+            ])
+        summary = read_from(os.path.join(sweep_dir, "sweep_summary.txt"))
+        settings = [line.split("\t")[1] for line in summary[1:]]
+        self.assertEqual(settings, [
+            '{"min_cover": 0.5, "min_id": 80.0}',
+            '{"min_cover": 0.5, "min_id": 90.0}',
+            '{"min_cover": 0.7, "min_id": 80.0}',
+            '{"min_cover": 0.7, "min_id": 90.0}',
+            ])
+
+
 if __name__ == "__main__":
     unittest.main()
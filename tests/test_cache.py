@@ -0,0 +1,48 @@
+import unittest
+
+from brocclib.cache import LruCache
+
+
+class LruCacheTests(unittest.TestCase):
+    def test_get_put(self):
+        c = LruCache(10)
+        self.assertEqual(c.get("a"), None)
+        c.put("a", 1)
+        self.assertEqual(c.get("a"), 1)
+        self.assertEqual(c.get("b", "default"), "default")
+        self.assertEqual((c.hits, c.misses, c.evictions), (1, 2, 0))
+
+    def test_cached_none(self):
+        c = LruCache(10)
+        c.put("a", None)
+        missing = object()
+        self.assertEqual(c.get("a", missing), None)
+
+    def test_eviction(self):
+        c = LruCache(2)
+        c.put("a", 1)
+        c.put("b", 2)
+        # Using "a" makes "b" the least recently used item
+        c.get("a")
+        c.put("c", 3)
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.get("b"), None)
+        self.assertEqual(c.get("a"), 1)
+        self.assertEqual(c.evictions, 1)
+
+    def test_disabled(self):
+        c = LruCache(0)
+        c.put("a", 1)
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.get("a"), None)
+
+    def test_unbounded(self):
+        c = LruCache(None)
+        for i in range(100):
+            c.put(i, i)
+        self.assertEqual(len(c), 100)
+        self.assertEqual(c.stats()["evictions"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
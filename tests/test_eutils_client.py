@@ -0,0 +1,268 @@
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.parse
+
+from brocclib.get_xml import (
+    EutilsCache, EutilsClient, NcbiEutils, RateLimiter,
+    )
+
+# Stand-in for NCBI E-utilities, so the client can be tested without
+# network access.
+
+NUCLEOTIDE_RECORDS = {
+    "312434489": ("HQ608011.1", "531911"),
+    "343197291": ("HQ844023.1", "1056490"),
+    "1": ("AB000001.2", "9606"),
+}
+
+TAXONOMY_RECORDS = {
+    "531911": ("Pestalotiopsis maculiformans", "species", [
+        ("Fungi", "kingdom"), ("Pestalotiopsis", "genus")], ["12345"]),
+    "9606": ("Homo sapiens", "species", [
+        ("Metazoa", "kingdom"), ("Homo", "genus")], []),
+}
+
+
+def _esummary_json(ids):
+    result = {"uids": []}
+    for uid, (accession, taxid) in NUCLEOTIDE_RECORDS.items():
+        if (uid in ids) or (accession in ids) or \
+           (accession.partition(".")[0] in ids):
+            result["uids"].append(uid)
+            result[uid] = {
+                "uid": uid, "caption": accession.partition(".")[0],
+                "accessionversion": accession, "taxid": int(taxid)}
+    return json.dumps({"header": {}, "result": result})
+
+
+def _efetch_xml(ids):
+    taxa = []
+    for taxid, (name, rank, lineage, aka_ids) in TAXONOMY_RECORDS.items():
+        if (taxid not in ids) and not any(a in ids for a in aka_ids):
+            continue
+        lineage_xml = "".join(
+            "<Taxon><ScientificName>{0}</ScientificName>"
+            "<Rank>{1}</Rank></Taxon>".format(n, r) for n, r in lineage)
+        aka_xml = "".join("<TaxId>{0}</TaxId>".format(a) for a in aka_ids)
+        taxa.append(
+            "<Taxon><TaxId>{0}</TaxId><ScientificName>{1}</ScientificName>"
+            "<Rank>{2}</Rank><LineageEx>{3}</LineageEx>"
+            "<AkaTaxIds>{4}</AkaTaxIds></Taxon>".format(
+                taxid, name, rank, lineage_xml, aka_xml))
+    return "<?xml version=\"1.0\" ?><TaxaSet>{0}</TaxaSet>".format(
+        "".join(taxa))
+
+
+class FakeEutilsHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        params = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        ids = params["id"][0].split(",")
+        self.server.requests.append((self.path, ids))
+
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self._respond(503, "Service unavailable")
+        elif "bad" in ids:
+            self._respond(400, "Bad request")
+        elif self.path.endswith("/esummary.fcgi"):
+            self._respond(200, _esummary_json(ids))
+        elif self.path.endswith("/efetch.fcgi"):
+            self._respond(200, _efetch_xml(ids))
+        else:
+            self._respond(404, "Not found")
+
+    def _respond(self, code, body):
+        body = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EutilsClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), FakeEutilsHandler)
+        self.server.requests = []
+        self.server.failures = 0
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+        base_url = "http://127.0.0.1:{0}/entrez/eutils/".format(
+            self.server.server_address[1])
+        self.client = EutilsClient(
+            base_url=base_url, api_key="", batch_size=2,
+            requests_per_second=1000, max_tries=3, backoff=0.001)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_get_taxon_ids(self):
+        accs = ["HQ608011.1", "HQ608011", "343197291", "AB000001.2", "XX1"]
+        observed = self.client.get_taxon_ids(accs)
+        self.assertEqual(observed, {
+            "HQ608011.1": "531911", "HQ608011": "531911",
+            "343197291": "1056490", "AB000001.2": "9606", "XX1": None})
+        # Five accessions, two per request
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_get_lineages(self):
+        observed = self.client.get_lineages(["531911", "12345", "9606", 99])
+        expected_lineage = [
+            ("Fungi", "kingdom"), ("Pestalotiopsis", "genus"),
+            ("Pestalotiopsis maculiformans", "species")]
+        self.assertEqual(observed["531911"], expected_lineage)
+        # Merged taxon ID
+        self.assertEqual(observed["12345"], expected_lineage)
+        self.assertEqual(observed["9606"][-1], ("Homo sapiens", "species"))
+        self.assertEqual(observed[99], None)
+
+    def test_retry(self):
+        self.server.failures = 2
+        observed = self.client.get_taxon_ids(["HQ608011.1"])
+        self.assertEqual(observed, {"HQ608011.1": "531911"})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.client.num_requests, 3)
+
+    def test_give_up(self):
+        self.server.failures = 10
+        observed = self.client.get_lineages(["531911"])
+        self.assertEqual(observed, {"531911": None})
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_bad_request_not_retried(self):
+        self.assertRaises(
+            urllib.error.HTTPError, self.client.request,
+            "efetch.fcgi", {"db": "taxonomy", "id": "bad"})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_bad_id_in_batch(self):
+        self.client.batch_size = 4
+        observed = self.client.get_taxon_ids(
+            ["HQ608011.1", "bad", "343197291", "AB000001.2"])
+        self.assertEqual(observed, {
+            "HQ608011.1": "531911", "bad": None,
+            "343197291": "1056490", "AB000001.2": "9606"})
+        # The batch is split until the bad ID is on its own
+        self.assertEqual(
+            [ids for _, ids in self.server.requests], [
+                ["343197291", "AB000001.2", "HQ608011.1", "bad"],
+                ["343197291", "AB000001.2"],
+                ["HQ608011.1", "bad"],
+                ["HQ608011.1"],
+                ["bad"],
+            ])
+
+        observed = self.client.get_lineages(["531911", "bad", "9606"])
+        self.assertEqual(
+            observed["531911"][-1],
+            ("Pestalotiopsis maculiformans", "species"))
+        self.assertEqual(observed["9606"][-1], ("Homo sapiens", "species"))
+        self.assertEqual(observed["bad"], None)
+
+    def test_ncbi_eutils_cache(self):
+        db = NcbiEutils(self.client)
+        self.assertEqual(db.get_taxon_id("HQ608011.1"), "531911")
+        self.assertEqual(db.get_lineage("9606")[-1], ("Homo sapiens", "species"))
+        self.assertEqual(
+            db.get_taxon_ids(["HQ608011.1", "XX1"]),
+            {"HQ608011.1": "531911", "XX1": None})
+        db.get_taxon_ids(["HQ608011.1", "XX1"])
+        db.get_lineages(["9606"])
+        self.assertEqual(len(self.server.requests), 3)
+
+
+class CountingClient(object):
+    def __init__(self):
+        self.requested = []
+
+    def get_taxon_ids(self, accs):
+        self.requested.extend(accs)
+        return dict((acc, None if acc == "XX1" else "531911") for acc in accs)
+
+    def get_lineages(self, taxon_ids):
+        self.requested.extend(taxon_ids)
+        return dict((t, [("Fungi", "kingdom")]) for t in taxon_ids)
+
+
+class EutilsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_fp = os.path.join(self.temp_dir, "cache", "eutils.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_save_load(self):
+        cache = EutilsCache(self.cache_fp)
+        cache.save_taxon_ids({"HQ608011.1": "531911", "XX1": None})
+        cache.save_lineages({531911: [("Fungi", "kingdom")], "99": None})
+        cache = EutilsCache(self.cache_fp)
+        self.assertEqual(
+            cache.load_taxon_ids(["HQ608011.1", "XX1", "XX2"]),
+            {"HQ608011.1": "531911"})
+        self.assertEqual(
+            cache.load_lineages([531911, "99"]),
+            {531911: [("Fungi", "kingdom")]})
+        self.assertEqual(
+            cache.load_lineages(["531911"]),
+            {"531911": [("Fungi", "kingdom")]})
+
+    def test_ttl(self):
+        cache = EutilsCache(self.cache_fp, ttl=1)
+        cache.save_taxon_ids({"HQ608011.1": "531911", "HQ844023.1": "1"})
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        with cache.con:
+            cache.con.execute(
+                "UPDATE taxon_ids SET fetched = ? WHERE taxid = '1'",
+                (two_days_ago,))
+        accs = ["HQ608011.1", "HQ844023.1"]
+        self.assertEqual(cache.load_taxon_ids(accs), {"HQ608011.1": "531911"})
+        cache.ttl = 3
+        self.assertEqual(len(cache.load_taxon_ids(accs)), 2)
+
+    def test_ncbi_eutils_across_runs(self):
+        client = CountingClient()
+        db = NcbiEutils(client, EutilsCache(self.cache_fp))
+        db.get_taxon_ids(["HQ608011.1", "XX1"])
+        db.get_lineages(["531911"])
+        self.assertEqual(len(client.requested), 3)
+
+        client = CountingClient()
+        db = NcbiEutils(client, EutilsCache(self.cache_fp))
+        # Nothing is read from the cache until it is needed
+        self.assertEqual(db.taxon_ids, {})
+        self.assertEqual(
+            db.get_taxon_ids(["HQ608011.1", "XX1"]),
+            {"HQ608011.1": "531911", "XX1": None})
+        self.assertEqual(db.get_lineage("531911"), [("Fungi", "kingdom")])
+        # Failed lookups are not saved
+        self.assertEqual(client.requested, ["XX1"])
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_wait(self):
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        # The first call goes through right away
+        self.assertTrue(time.monotonic() - start >= 0.09)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import brocclib.hitstore
+from brocclib.hitstore import HitStore, is_hit_store, main, write_hit_store
+from brocclib.parse import BlastHit
+
+TEST_HITS = [
+    ("a", BlastHit("X1.1", 99.0, 100.0)),
+    ("a", BlastHit("X2.1", 98.5, 100.0)),
+    ("b é", BlastHit("X1.1", 97.0, 90.0)),
+    ]
+
+BLAST_OUTPUT = """\
+# BLASTN 2.2.25+
+# Query: 0 E7_168192
+0\tgi|259100874|gb|GQ513762.1|\t98.74\t159\t1\t1\t407\t564\t1\t159\t2e-70\t 275
+0\tgi|259098555|gb|GQ520853.1|\t98.11\t152\t1\t1\t407\t564\t1\t159\t2e-70\t 275
+"""
+
+
+def _as_tuples(hits):
+    return [(h.accession, h.pct_id, h.length) for h in hits]
+
+
+class HitStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.fp = os.path.join(self.temp_dir, "test.hits")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_write_read(self):
+        write_hit_store(self.fp, TEST_HITS)
+        self.assertTrue(is_hit_store(self.fp))
+        store = HitStore(self.fp)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(list(store), ["a", "b é"])
+        self.assertEqual(
+            _as_tuples(store["a"]), [("X1.1", 99.0, 100.0), ("X2.1", 98.5, 100.0)])
+        self.assertEqual(_as_tuples(store["b é"]), [("X1.1", 97.0, 90.0)])
+        self.assertEqual(store["c"], [])
+        self.assertFalse("c" in store)
+
+    def test_ungrouped_queries(self):
+        hits = [TEST_HITS[0], TEST_HITS[2], TEST_HITS[1]]
+        write_hit_store(self.fp, hits)
+        store = HitStore(self.fp)
+        self.assertEqual(
+            _as_tuples(store["a"]), [("X1.1", 99.0, 100.0), ("X2.1", 98.5, 100.0)])
+        self.assertEqual(_as_tuples(store["b é"]), [("X1.1", 97.0, 90.0)])
+
+    def test_many_queries(self):
+        # Hits for each query come in several runs, and the columns are
+        # written in many chunks.
+        hits = []
+        for i in range(300):
+            query_id = "q{0}".format((i * 7) % 40)
+            hits.append((query_id, BlastHit("X{0}.1".format(i % 13), i, i)))
+        expected = collections.defaultdict(list)
+        for query_id, hit in hits:
+            expected[query_id].append((hit.accession, hit.pct_id, hit.length))
+        chunk_size = brocclib.hitstore._CHUNK_SIZE
+        brocclib.hitstore._CHUNK_SIZE = 16
+        try:
+            write_hit_store(self.fp, hits)
+        finally:
+            brocclib.hitstore._CHUNK_SIZE = chunk_size
+        store = HitStore(self.fp)
+        self.assertEqual(list(store), list(expected))
+        for query_id, query_hits in expected.items():
+            self.assertEqual(_as_tuples(store[query_id]), query_hits)
+        for query_id in ["", "q", "q05", "q40", "r"]:
+            self.assertFalse(query_id in store)
+            self.assertEqual(store[query_id], [])
+
+    def test_empty(self):
+        write_hit_store(self.fp, [])
+        store = HitStore(self.fp)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store["a"], [])
+
+    def test_failed_write_keeps_old_store(self):
+        write_hit_store(self.fp, TEST_HITS)
+
+        def bad_hits():
+            yield TEST_HITS[0]
+            raise ValueError("Bad BLAST line")
+
+        self.assertRaises(ValueError, write_hit_store, self.fp, bad_hits())
+        self.assertEqual(os.listdir(self.temp_dir), ["test.hits"])
+        self.assertEqual(len(HitStore(self.fp)), 2)
+
+    def test_not_a_hit_store(self):
+        blast_fp = os.path.join(self.temp_dir, "test_blast.txt")
+        with open(blast_fp, "w") as f:
+            f.write(BLAST_OUTPUT)
+        self.assertFalse(is_hit_store(blast_fp))
+        self.assertRaises(ValueError, HitStore, blast_fp)
+
+    def test_main(self):
+        blast_fp = os.path.join(self.temp_dir, "test_blast.txt")
+        with open(blast_fp, "w") as f:
+            f.write(BLAST_OUTPUT)
+        main([blast_fp])
+        store = HitStore(os.path.join(self.temp_dir, "test_blast.hits"))
+        self.assertEqual(_as_tuples(store["0 E7_168192"]), [
+            ("GQ513762.1", 98.74, 159.0), ("GQ520853.1", 98.11, 152.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
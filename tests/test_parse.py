@@ -1,8 +1,9 @@
 from unittest import TestCase, main
-from io import StringIO
+from io import BytesIO, StringIO
 
 from brocclib.parse import (
-    read_blast, iter_fasta, parse_accession,
+    read_blast, iter_blast, iter_fasta, parse_accession, iter_blast_queries,
+    iter_query_hits, _iter_blocks,
     )
 
 
@@ -55,6 +56,69 @@ class BlastOutputTests(TestCase):
         obs = read_blast(StringIO(normal_output))
         self.assertEqual(obs['sdlkj'], [])
 
+    def test_binary_file(self):
+        expected = [
+            (q, h.accession, h.pct_id, h.length)
+            for q, h in iter_blast(normal_output.splitlines(True))]
+        obs = [
+            (q, h.accession, h.pct_id, h.length) for q, h in
+            iter_blast(BytesIO(normal_output.encode("utf-8")))]
+        self.assertEqual(obs, expected)
+        self.assertEqual(len(obs), 7)
+
+    def test_crlf(self):
+        crlf_output = two_query_output.replace("\n", "\r\n")
+        obs = [(q, h.accession, h.length) for q, h in
+               iter_blast(BytesIO(crlf_output.encode("utf-8")))]
+        self.assertEqual(
+            obs, [("a", "X1.1", 100), ("a", "X2.1", 100), ("b", "X3.1", 90)])
+
+    def test_no_final_newline(self):
+        obs = list(iter_blast(StringIO("a\tX1.1\t99.0\t100")))
+        self.assertEqual(obs[0][0], "a")
+        self.assertEqual(obs[0][1].length, 100)
+
+    def test_iter_blocks(self):
+        data = "\u00e9a\tX1.1\t99.0\t100\nb\tX2.1\t98.0\t90\nc"
+        blocks = list(_iter_blocks(BytesIO(data.encode("utf-8")), 5))
+        # Blocks end at line breaks, and multi-byte characters are
+        # not split.
+        self.assertEqual(
+            blocks, ["\u00e9a\tX1.1\t99.0\t100\n", "b\tX2.1\t98.0\t90\n", "c"])
+
+    def test_iter_blast_queries(self):
+        obs = list(iter_blast_queries(StringIO(two_query_output)))
+        self.assertEqual([q for q, hits in obs], ["a", "b"])
+        self.assertEqual([h.accession for h in obs[0][1]], ["X1.1", "X2.1"])
+        self.assertEqual([h.accession for h in obs[1][1]], ["X3.1"])
+
+
+class QueryHitsTests(TestCase):
+    def test_iter_query_hits(self):
+        fasta = [">a", "ACGT", ">c", "GG", ">b", "TTT", ">d", "C"]
+        obs = list(iter_query_hits(fasta, StringIO(two_query_output)))
+        self.assertEqual(
+            [(name, seq, len(hits)) for name, seq, hits in obs],
+            [("a", "ACGT", 2), ("c", "GG", 0), ("b", "TTT", 1),
+             ("d", "C", 0)])
+
+    def test_iter_query_hits_out_of_order(self):
+        fasta = [">b", "TTT", ">a", "ACGT", ">c", "GG", ">d", "C"]
+        obs = iter_query_hits(fasta, StringIO(two_query_output))
+        # Query b is passed over before the mismatch can be seen, but
+        # it is not yielded.
+        self.assertRaises(ValueError, next, obs)
+        self.assertEqual(list(obs), [])
+
+    def test_iter_query_hits_missing_from_fasta(self):
+        fasta = [">a", "ACGT", ">c", "GG", ">d", "C"]
+        obs = iter_query_hits(fasta, StringIO(two_query_output))
+        self.assertEqual(next(obs)[:2], ("a", "ACGT"))
+        # Query b has hits but no sequence, so the sequences after a
+        # are not yielded as having no hits.
+        self.assertRaises(ValueError, next, obs)
+        self.assertEqual(list(obs), [])
+
     
 
 
@@ -75,6 +139,13 @@ normal_output = """\
 """
 
 
+two_query_output = """\
+a\tX1.1\t99.0\t100\t1\t0\t1\t100\t1\t100\t1e-50\t 180
+a\tX2.1\t98.0\t100\t2\t0\t1\t100\t1\t100\t1e-49\t 178
+b\tX3.1\t97.0\t90\t3\t0\t1\t90\t1\t90\t1e-40\t 150
+"""
+
+
 malformed_output = """\
 # BLASTN 2.2.25+
 # Query: 0 E7_168192
@@ -0,0 +1,107 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from brocclib.command import main as run_brocc
+from brocclib.parse import read_blast
+from brocclib.synthetic import (
+    STANDARD_RANKS, SyntheticTaxonomy, main, write_queries,
+)
+from brocclib.taxonomy_db import NcbiLocal, main as create_db
+
+
+class SyntheticTaxonomyTests(unittest.TestCase):
+    def setUp(self):
+        self.taxonomy = SyntheticTaxonomy(200, lineage_depth=11, seed=3)
+
+    def test_species(self):
+        self.assertEqual(len(self.taxonomy.species_ids), 200)
+        self.assertEqual(len(self.taxonomy.accessions), 200)
+        ranks = dict((n[0], n[3]) for n in self.taxonomy.nodes)
+        for taxon_id in self.taxonomy.species_ids:
+            self.assertEqual(ranks[taxon_id], "species")
+
+    def test_species_range(self):
+        parents = dict((n[0], n[1]) for n in self.taxonomy.nodes)
+        names = dict((n[0], n[2]) for n in self.taxonomy.nodes)
+
+        def genus_name(species_idx):
+            taxon_id = self.taxonomy.species_ids[species_idx]
+            while not names[taxon_id].startswith("Genus "):
+                taxon_id = parents[taxon_id]
+            return names[taxon_id]
+
+        start, end = self.taxonomy.species_range(42, "genus")
+        self.assertTrue(start <= 42 < end)
+        observed = set(genus_name(i) for i in range(start, end))
+        self.assertEqual(observed, set([genus_name(42)]))
+        if start > 0:
+            self.assertNotEqual(genus_name(start - 1), genus_name(42))
+        self.assertEqual(self.taxonomy.species_range(42, None), (0, 200))
+
+    def test_lineage_depth_too_small(self):
+        self.assertRaises(ValueError, SyntheticTaxonomy, 10, lineage_depth=5)
+
+    def test_write_queries(self):
+        fasta_file = io.StringIO()
+        blast_file = io.StringIO()
+        write_queries(self.taxonomy, fasta_file, blast_file, 4, 20)
+        self.assertEqual(fasta_file.getvalue().count(">"), 4)
+        hits = read_blast(io.BytesIO(blast_file.getvalue().encode("ascii")))
+        self.assertEqual(sorted(hits), ["query1", "query2", "query3", "query4"])
+        for query_hits in hits.values():
+            self.assertEqual(len(query_hits), 20)
+            pct_ids = [h.pct_id for h in query_hits]
+            self.assertEqual(pct_ids, sorted(pct_ids, reverse=True))
+
+
+class SyntheticDataTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.temp_dir, "synthetic")
+        self.database_fp = os.path.join(self.temp_dir, "taxonomy.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_main(self):
+        main([
+            self.data_dir, "--species", "50", "--queries", "5",
+            "--hits_per_query", "10", "--lineage_depth", "10"])
+        create_db([
+            "--download_dir", self.data_dir,
+            "--database_fp", self.database_fp, "--processes", "1"])
+        db = NcbiLocal(self.database_fp)
+        taxon_id = db.get_taxon_id("SY000000000")
+        lineage = db.get_lineage(taxon_id)
+        self.assertEqual(len(lineage), 10)
+        ranks = [rank for _, rank in lineage if rank in STANDARD_RANKS]
+        self.assertEqual(ranks, STANDARD_RANKS)
+
+        output_dir = os.path.join(self.temp_dir, "brocc")
+        run_brocc([
+            "-i", os.path.join(self.data_dir, "synthetic.fasta"),
+            "-b", os.path.join(self.data_dir, "synthetic_blast.txt"),
+            "-o", output_dir,
+            "-a", "ITS",
+            "--taxonomy_db", self.database_fp,
+            ])
+        with open(os.path.join(output_dir, "Standard_Taxonomy.txt")) as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+    def test_existing_dump_files_kept(self):
+        os.makedirs(self.data_dir)
+        names_fp = os.path.join(self.data_dir, "names.dmp")
+        with open(names_fp, "w") as f:
+            f.write("not synthetic\n")
+        main([self.data_dir, "--species", "20", "--queries", "2"])
+        with open(names_fp) as f:
+            self.assertEqual(f.read(), "not synthetic\n")
+        self.assertFalse(
+            os.path.exists(os.path.join(self.data_dir, "nodes.dmp")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -41,6 +41,27 @@ class TaxonTests(unittest.TestCase):
         t = Lineage(self.d)
         self.assertEqual(t.is_generic("species"), False)
 
+    def test_generic(self):
+        t = Lineage([
+            ("Eukaryota", "domain"),
+            ("Fungi", "kingdom"),
+            ("unclassified Fungi", "no rank"),
+            ("Fungi sp. 1", "species"),
+        ])
+        self.assertEqual(t.is_generic("kingdom"), False)
+        self.assertEqual(t.is_generic("phylum"), True)
+        self.assertEqual(t.is_generic("species"), True)
+        self.assertEqual(t.get_taxon("phylum"), "Fungi sp. 1 (phylum)")
+
+    def test_domain(self):
+        t = Lineage(self.d)
+        self.assertEqual(t.get_taxon("domain"), "Eukaryota")
+        self.assertEqual(list(t.get_standard_taxa("domain")), ["Eukaryota"])
+
+    def test_unknown_rank(self):
+        t = Lineage(self.d)
+        self.assertRaises(ValueError, t.get_taxon, "subphylum")
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -1,11 +1,17 @@
+import gzip
+import io
 import os
 import shutil
+import tarfile
 import tempfile
 import unittest
+from unittest import mock
 
 from brocclib.taxonomy_db import (
-    NcbiLocal, init_db,
+    NcbiLocal, get_db_version, init_db, init_lineages, main,
+    parse_accessions,
 )
+from brocclib.taxonomy_tree import TaxonomyTree, taxonomy_tree_fp
 
 TEST_ACCESSIONS = [
     ("ABC123", 3324),
@@ -26,7 +32,7 @@ class NcbiLocalTests(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.mkdtemp()
         sqlite_fp = os.path.join(self.temp_dir, "taxonomy.db")
-        init_db(sqlite_fp, self.temp_dir, TEST_ACCESSIONS, TEST_NODES)
+        init_db(sqlite_fp, TEST_ACCESSIONS, TEST_NODES)
         self.db = NcbiLocal(sqlite_fp)
 
     def tearDown(self):
@@ -41,3 +47,226 @@ class NcbiLocalTests(unittest.TestCase):
             (u'Clostridia', u'class'),
             (u'Clostridiales', u'order')]
         self.assertEqual(observed_lineage, expected_lineage)
+
+    def test_get_taxon_id(self):
+        self.assertEqual(self.db.get_taxon_id("ABC123.2"), 3324)
+        self.assertEqual(self.db.get_taxon_id("XYZ"), None)
+
+    def test_get_taxon_ids(self):
+        observed = self.db.get_taxon_ids(["ABC123.1", "ABC123", "XYZ"])
+        expected = {"ABC123.1": 3324, "ABC123": 3324, "XYZ": None}
+        self.assertEqual(observed, expected)
+
+    def test_get_taxon_ids_many_chunks(self):
+        self.db.max_query_params = 1
+        observed = self.db.get_taxon_ids(["ABC123", "XYZ.1"])
+        self.assertEqual(observed, {"ABC123": 3324, "XYZ.1": None})
+
+    def test_get_lineage_missing(self):
+        self.assertEqual(self.db.get_lineage(12), [])
+
+    def test_get_lineages(self):
+        observed = self.db.get_lineages([9012, 4, 12])
+        expected = {
+            9012: [
+                (u'cellular organisms', u'no rank'),
+                (u'Bacteria', u'superkingdom'),
+                (u'Firmicutes', u'phylum'),
+                (u'Clostridia', u'class'),
+                (u'Natronoanaerobium aggerbacterium', u'species')],
+            4: [
+                (u'cellular organisms', u'no rank'),
+                (u'Bacteria', u'superkingdom'),
+                (u'Firmicutes', u'phylum')],
+            12: [],
+        }
+        self.assertEqual(observed, expected)
+
+    def test_cache(self):
+        self.db.get_taxon_ids(["ABC123.1", "XYZ"])
+        self.db.get_taxon_ids(["ABC123.2", "XYZ.1"])
+        self.assertEqual(self.db.get_taxon_id("XYZ"), None)
+        stats = self.db.stats()
+        self.assertEqual(stats["taxon_id_cache"]["hits"], 3)
+        self.assertEqual(stats["taxon_id_cache"]["misses"], 2)
+
+
+class NcbiLocalLineagesTests(NcbiLocalTests):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        sqlite_fp = os.path.join(self.temp_dir, "taxonomy.db")
+        init_db(sqlite_fp, TEST_ACCESSIONS, TEST_NODES)
+        init_lineages(sqlite_fp)
+        self.db = NcbiLocal(sqlite_fp)
+
+    def test_lineages_table(self):
+        self.assertTrue(self.db.rank_names is not None)
+        n = self.db.con.execute("SELECT COUNT(*) FROM lineages").fetchone()
+        self.assertEqual(n[0], len(TEST_NODES))
+
+
+def _write_dumps(download_dir, accessions=TEST_ACCESSIONS, nodes=TEST_NODES,
+                 merged=(), deleted=(), mtime=1500000000):
+    # Same layout as the files on the NCBI FTP site
+    accession_fp = os.path.join(download_dir, "nucl_gb.accession2taxid.gz")
+    with gzip.open(accession_fp, "wt") as f:
+        f.write("accession\taccession.version\ttaxid\tgi\n")
+        for acc, taxid in accessions:
+            f.write("{0}\t{0}.1\t{1}\t0\n".format(acc, taxid))
+
+    names_dmp = "".join(
+        "{0}\t|\t{1}\t|\t\t|\tscientific name\t|\n".format(taxid, name)
+        for taxid, _, name, _ in nodes)
+    names_dmp += "9012\t|\tN. aggerbacterium\t|\t\t|\tsynonym\t|\n"
+    nodes_dmp = "".join(
+        "{0}\t|\t{1}\t|\t{2}\t|\t\t|\n".format(taxid, parent, rank)
+        for taxid, parent, _, rank in nodes)
+    merged_dmp = "".join(
+        "{0}\t|\t{1}\t|\n".format(old, new) for old, new in merged)
+    delnodes_dmp = "".join("{0}\t|\n".format(taxid) for taxid in deleted)
+    taxdump_fp = os.path.join(download_dir, "taxdump.tar.gz")
+    with tarfile.open(taxdump_fp, "w:gz") as tar:
+        for filename, text in [
+                ("delnodes.dmp", delnodes_dmp), ("merged.dmp", merged_dmp),
+                ("names.dmp", names_dmp), ("nodes.dmp", nodes_dmp)]:
+            data = text.encode("utf-8")
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    for fp in [accession_fp, taxdump_fp]:
+        os.utime(fp, (mtime, mtime))
+
+
+class CreateDatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.download_dir = os.path.join(self.temp_dir, "download")
+        os.mkdir(self.download_dir)
+        _write_dumps(self.download_dir)
+        self.database_fp = os.path.join(self.temp_dir, "taxonomy.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_main(self):
+        main([
+            "--download_dir", self.download_dir,
+            "--database_fp", self.database_fp])
+        db = NcbiLocal(self.database_fp)
+        self.assertEqual(db.get_taxon_id("ABC123.1"), 3324)
+        self.assertEqual(db.get_lineage(9012), [
+            ("cellular organisms", "no rank"),
+            ("Bacteria", "superkingdom"),
+            ("Firmicutes", "phylum"),
+            ("Clostridia", "class"),
+            ("Natronoanaerobium aggerbacterium", "species"),
+            ])
+        # Downloaded files are left in place
+        self.assertEqual(
+            sorted(os.listdir(self.download_dir)),
+            ["nucl_gb.accession2taxid.gz", "taxdump.tar.gz"])
+
+    def test_main_processes(self):
+        main([
+            "--download_dir", self.download_dir,
+            "--database_fp", self.database_fp, "--processes", "2"])
+        db = NcbiLocal(self.database_fp)
+        self.assertEqual(db.get_taxon_id("ABC123"), 3324)
+
+    @mock.patch("brocclib.taxonomy_db.subprocess.check_call")
+    def test_update(self, check_call):
+        args = [
+            "--download_dir", self.download_dir,
+            "--database_fp", self.database_fp]
+        main(args + ["--tree"])
+        # Files in the download directory are used as they are
+        self.assertEqual(check_call.call_count, 0)
+        first_version = get_db_version(self.database_fp)
+        self.assertTrue(first_version.startswith(
+            "nucl_gb.accession2taxid.gz 2017-07-14T02:40:00Z"))
+
+        nodes = [n for n in TEST_NODES if n[0] != 4]
+        nodes.append((4, 3, "Bacillota", "phylum"))
+        _write_dumps(
+            self.download_dir, [("ABC123", 3324), ("XYZ9", 4)], nodes,
+            mtime=1600000000)
+        main(args + ["--update"])
+        # With --update, wget checks for newer files on the server
+        self.assertEqual(check_call.call_count, 2)
+        self.assertTrue(all(
+            "--timestamping" in call[0][0]
+            for call in check_call.call_args_list))
+        self.assertNotEqual(get_db_version(self.database_fp), first_version)
+        db = NcbiLocal(self.database_fp)
+        self.assertEqual(db.get_taxon_id("XYZ9"), 4)
+        self.assertEqual(db.get_taxon_id("AF56.1"), None)
+        # The tree file is refreshed along with the database
+        tree = TaxonomyTree(taxonomy_tree_fp(self.database_fp))
+        self.assertEqual(tree.get_name(4), "Bacillota")
+
+        with self.assertLogs(level="INFO") as logs:
+            main(args + ["--update"])
+        self.assertTrue(any("up to date" in x for x in logs.output))
+
+    @mock.patch("brocclib.taxonomy_db.subprocess.check_call")
+    def test_update_merged_and_deleted(self, check_call):
+        args = [
+            "--download_dir", self.download_dir,
+            "--database_fp", self.database_fp]
+        main(args)
+        nodes = [n for n in TEST_NODES if n[0] != 9012]
+        _write_dumps(
+            self.download_dir,
+            [("ABC123", 3324), ("OLD5", 77), ("AF56", 9012)], nodes,
+            merged=[(77, 3324)], deleted=[9012], mtime=1600000000)
+        main(args + ["--update"])
+        db = NcbiLocal(self.database_fp)
+        self.assertEqual(db.get_taxon_id("OLD5"), 3324)
+        # The accession that points to a deleted taxon is removed
+        self.assertEqual(
+            sorted(db.con.execute("SELECT * FROM accessions")),
+            [("ABC123", 3324), ("OLD5", 3324)])
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir)), ["download", "taxonomy.db"])
+
+    def test_update_without_database(self):
+        main([
+            "--download_dir", self.download_dir,
+            "--database_fp", self.database_fp, "--update"])
+        db = NcbiLocal(self.database_fp)
+        self.assertEqual(db.get_taxon_id("ABC123"), 3324)
+
+
+ACCESSION_LINES = [
+    "accession\taccession.version\ttaxid\tgi\n",
+    "XY2\tXY2.1\t5\t0\n",
+    "AB1\tAB1.3\t3324\t0\n",
+    "CD20\tCD20.1\t9012\t0\n",
+    "AA7\tAA7.2\t12\t0\n",
+    "ZZ9\tZZ9.1\t2\t0\n",
+]
+
+
+class ParseAccessionsTests(unittest.TestCase):
+    def test_parse_accessions(self):
+        f = io.StringIO("".join(ACCESSION_LINES))
+        observed = list(parse_accessions(f))
+        self.assertEqual(observed, [
+            ("AA7", 12), ("AB1", 3324), ("CD20", 9012), ("XY2", 5),
+            ("ZZ9", 2)])
+
+    def test_blocks(self):
+        # Blocks end at line breaks and are sorted separately
+        f = io.StringIO("".join(ACCESSION_LINES))
+        observed = list(parse_accessions(f, block_size=20))
+        self.assertEqual(observed, [
+            ("AB1", 3324), ("XY2", 5), ("AA7", 12), ("CD20", 9012),
+            ("ZZ9", 2)])
+
+    def test_processes(self):
+        f = io.StringIO("".join(ACCESSION_LINES))
+        observed = list(parse_accessions(f, processes=2, block_size=20))
+        self.assertEqual(observed, [
+            ("AB1", 3324), ("XY2", 5), ("AA7", 12), ("CD20", 9012),
+            ("ZZ9", 2)])
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from brocclib.taxonomy_db import NcbiLocal, init_db
+from brocclib.taxonomy_tree import (
+    NcbiTree, TaxonomyTree, write_taxonomy_tree,
+)
+
+TEST_ACCESSIONS = [
+    ("ABC123", 3324),
+    ("AF56.1", 9012),
+]
+
+TEST_NODES = [
+    (3324, 5, "Clostridiales", "order"),
+    (5, 4, "Clostridia", "class"),
+    (4, 3, "Firmicutes", "phylum"),
+    (3, 2, "Bacteria", "superkingdom"),
+    (2, 335, "cellular organisms", "no rank"),
+    (1, 1, "root", "no rank"),
+    (9012, 5, "Natronoanaerobium aggerbacterium", "species"),
+    (9013, 5, u"Bézier bacterium", "species"),
+]
+
+
+class TaxonomyTreeTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tree_fp = os.path.join(self.temp_dir, "taxonomy.tree")
+        write_taxonomy_tree(self.tree_fp, TEST_NODES)
+        self.tree = TaxonomyTree(self.tree_fp)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_lineage(self):
+        self.assertEqual(self.tree.get_lineage(3324), [
+            ('cellular organisms', 'no rank'),
+            ('Bacteria', 'superkingdom'),
+            ('Firmicutes', 'phylum'),
+            ('Clostridia', 'class'),
+            ('Clostridiales', 'order')])
+
+    def test_rewrite(self):
+        # The old file stays readable while a new one is written
+        nodes = [n for n in TEST_NODES if n[0] != 4]
+        nodes.append((4, 3, "Bacillota", "phylum"))
+        write_taxonomy_tree(self.tree_fp, nodes)
+        self.assertEqual(self.tree.get_name(4), "Firmicutes")
+        self.assertEqual(TaxonomyTree(self.tree_fp).get_name(4), "Bacillota")
+        self.assertEqual(os.listdir(self.temp_dir), ["taxonomy.tree"])
+
+    def test_get_lineage_unicode(self):
+        self.assertEqual(
+            self.tree.get_lineage("9013")[-1],
+            (u"Bézier bacterium", "species"))
+
+    def test_get_lineage_missing(self):
+        self.assertEqual(self.tree.get_lineage(12), [])
+        self.assertEqual(self.tree.get_lineage(100000), [])
+        self.assertEqual(self.tree.get_lineage(1), [])
+
+    def test_contains(self):
+        self.assertTrue(3324 in self.tree)
+        self.assertFalse(335 in self.tree)
+        self.assertFalse(0 in self.tree)
+
+    def test_not_a_tree_file(self):
+        fp = os.path.join(self.temp_dir, "other.tree")
+        with open(fp, "wb") as f:
+            f.write(b"SQLite format 3\x00" + bytes(100))
+        self.assertRaises(ValueError, TaxonomyTree, fp)
+
+
+class NcbiTreeTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        sqlite_fp = os.path.join(self.temp_dir, "taxonomy.db")
+        init_db(sqlite_fp, TEST_ACCESSIONS, TEST_NODES)
+        self.local_db = NcbiLocal(sqlite_fp)
+        tree_fp = os.path.join(self.temp_dir, "taxonomy.tree")
+        write_taxonomy_tree(tree_fp, TEST_NODES)
+        self.db = NcbiTree(tree_fp, self.local_db)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_taxon_ids(self):
+        self.assertEqual(self.db.get_taxon_id("ABC123.1"), 3324)
+        self.assertEqual(
+            self.db.get_taxon_ids(["ABC123.1", "XYZ"]),
+            {"ABC123.1": 3324, "XYZ": None})
+
+    def test_same_lineages_as_local_db(self):
+        taxon_ids = [n[0] for n in TEST_NODES] + [12]
+        self.assertEqual(
+            self.db.get_lineages(taxon_ids),
+            self.local_db.get_lineages(taxon_ids))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from brocclib.votetrace import (
+    ReuseRecord, VoteRecord, VoteTrace, format_vote_json, format_vote_text,
+    parse_vote_trace,
+    )
+
+
+class ParseVoteTraceTests(unittest.TestCase):
+    def test_parse_vote_trace(self):
+        self.assertEqual(parse_vote_trace("text"), ("text", 1))
+        self.assertEqual(parse_vote_trace("off"), ("off", 1))
+        self.assertEqual(parse_vote_trace("sample=10"), ("text", 10))
+        self.assertEqual(parse_vote_trace("json, sample=5"), ("json", 5))
+
+    def test_bad_values(self):
+        self.assertRaises(ValueError, parse_vote_trace, "xml")
+        self.assertRaises(ValueError, parse_vote_trace, "sample=0")
+        self.assertRaises(ValueError, parse_vote_trace, "sample=a")
+
+
+class VoteTraceTests(unittest.TestCase):
+    def test_sample(self):
+        query_ids = ["q{0}".format(n) for n in range(1000)]
+        trace = VoteTrace(10)
+        traced = [q for q in query_ids if trace.is_traced(q)]
+        self.assertTrue(50 < len(traced) < 150)
+        # The same queries are traced every time
+        self.assertEqual(
+            traced, [q for q in query_ids if VoteTrace(10).is_traced(q)])
+        self.assertTrue(all(VoteTrace().is_traced(q) for q in query_ids))
+
+    def test_pop_records(self):
+        trace = VoteTrace()
+        trace.record_reuse("q2", "q1")
+        self.assertEqual(trace.pop_records(), [ReuseRecord("q2", "q1")])
+        self.assertEqual(trace.pop_records(), [])
+
+
+class FormatTests(unittest.TestCase):
+    def setUp(self):
+        self.record = VoteRecord(
+            "q1", "genus", [("Candida", 5), ("Pichia", 1)],
+            [("uncultured fungus", 2)], ("Candida", 5), None)
+
+    def test_format_vote_text(self):
+        self.assertEqual(format_vote_text(self.record), (
+            "\n"
+            "** q1 voting for genus **\n"
+            "Candidates (>1 vote): Candida (5 votes)\n"
+            "Generic taxa: uncultured fungus (2 votes)\n"
+            "Candidate total: 6 votes\n"
+            "WINNER: Candida (5 votes)\n"))
+
+    def test_format_vote_json(self):
+        self.assertEqual(format_vote_json(self.record), (
+            '{"query":"q1","rank":"genus",'
+            '"candidates":[["Candida",5],["Pichia",1]],'
+            '"generics":[["uncultured fungus",2]],'
+            '"winner":["Candida",5],"message":null}'))
+        self.assertEqual(
+            format_vote_json(ReuseRecord("q2", "q1")),
+            '{"query":"q2","same_as":"q1"}')
+
+
+if __name__ == "__main__":
+    unittest.main()